@@ -3,8 +3,8 @@ from billsum.post_process import greedy_summarize, mmr_selection
 import os
 import pandas as pd 
 import pickle 
-from rouge import Rouge
-rouge = Rouge()
+from billsum.utils import batch_rouge
+from billsum.utils.sentence_store import SentenceStore
 
 prefix = os.path.expanduser('~/BSDATA/')
 
@@ -24,7 +24,7 @@ pos_pred = predictions[1].values[1:]
 
 # Load in the sentence data
 
-sent_data = pickle.load(open(prefix + 'sent_data/us_test_sent_scores.pkl', 'rb'))
+sent_data = SentenceStore(prefix + 'sent_data/us_test_sent_scores.store')
 
 docs = pd.read_json(prefix + 'clean_final/us_test_data_final.jsonl', lines=True)
 docs.set_index('bill_id', inplace=True)
@@ -37,20 +37,18 @@ doc_order = sorted(sent_data.keys())
 i = 0
 for bill_id in sent_data:
 
-    sents = sent_data[bill_id]
+    # Get sent text
+    mysents = sent_data.sentence_texts(bill_id)
     
-    tot_sent = len(sents)
+    tot_sent = len(mysents)
 
     # Collect the predictions that correspond to this bill
     ys = pos_pred[i : i+tot_sent]
     i += tot_sent
 
-    # Get sent text
-    mysents = [s[0] for s in sents]
-
     final_sum = ' '.join(mmr_selection(mysents, ys))
     
-    score = rouge.get_scores([final_sum], [docs.loc[bill_id].clean_summary])[0]
+    score = batch_rouge.score(final_sum, docs.loc[bill_id].clean_summary)
     all_scores[bill_id] = score
     #rint(score)
 
@@ -65,7 +63,7 @@ pos_pred = predictions[1].values[1:]
 
 # Load in the sentence data
 
-sent_data = pickle.load(open(prefix + 'sent_data/ca_test_sent_scores.pkl', 'rb'))
+sent_data = SentenceStore(prefix + 'sent_data/ca_test_sent_scores.store')
 
 docs = pd.read_json(prefix + 'clean_final/ca_test_data_final.jsonl', lines=True)
 docs.set_index('bill_id', inplace=True)
@@ -78,20 +76,18 @@ doc_order = sorted(sent_data.keys())
 i = 0
 for bill_id in sent_data:
 
-    sents = sent_data[bill_id]
+    # Get sent text
+    mysents = sent_data.sentence_texts(bill_id)
     
-    tot_sent = len(sents)
+    tot_sent = len(mysents)
 
     # Collect the predictions that correspond to this bill
     ys = pos_pred[i : i+tot_sent]
     i += tot_sent
 
-    # Get sent text
-    mysents = [s[0] for s in sents]
-    
     final_sum = ' '.join(mmr_selection(mysents, ys))
     
-    score = rouge.get_scores([docs.loc[bill_id].clean_summary], [final_sum])[0]
+    score = batch_rouge.score(docs.loc[bill_id].clean_summary, final_sum)
     all_scores[bill_id] = score
 
 pickle.dump(all_scores, open(prefix + 'score_data/ca_bert_scores.pkl', 'wb'))
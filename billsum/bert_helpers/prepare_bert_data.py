@@ -3,7 +3,8 @@ Take in data from cleaned sentence files and write them into simple tsvs for BER
 '''
 import os
 import pandas as pd 
-import pickle
+
+from billsum.utils.sentence_store import SentenceStore
 
 
 prefix = os.environ['BILLSUM_PREFIX']
@@ -16,17 +17,17 @@ if not os.path.isdir(prefix + 'bert_data'):
 	os.mkdir(prefix + 'bert_data')
 
 #### Process training data ####
-sent_data = pickle.load(open(prefix + 'sent_data/us_train_sent_scores.pkl', 'rb'))
+sent_data = SentenceStore(prefix + 'sent_data/us_train_sent_scores.store')
 
 # Establish an ordering for scoring after BERT runs
 doc_order = sorted(sent_data.keys())
+labels = sent_data.labels('rouge-2', 'p', 0.1) # Our label
 
 to_save = []
 for key in doc_order:
-	doc = sent_data[key]
-	for sent in doc:
-		y = int(sent[2]['rouge-2']['p'] > 0.1) # Our label 
-		to_save.append([sent[0], y])
+	first, end = sent_data.sentence_range(key)
+	for text, y in zip(sent_data.sentence_texts(key), labels[first:end]):
+		to_save.append([text, int(y)])
 
 # Save in tsv format
 final = pd.DataFrame(to_save)
@@ -42,16 +43,16 @@ final[0].to_csv(prefix + 'bert_data/all_texts_us_train.txt', index=None)
 
 ###### Repeat for both test files ######
 
-sent_data = pickle.load(open(prefix + 'sent_data/us_test_sent_scores.pkl', 'rb'))
+sent_data = SentenceStore(prefix + 'sent_data/us_test_sent_scores.store')
 
 doc_order = sorted(sent_data.keys())
+labels = sent_data.labels('rouge-2', 'p', 0.1) # Our label
 
 to_save = []
 for key in doc_order:
-	doc = sent_data[key]
-	for sent in doc:
-		y = int(sent[2]['rouge-2']['p'] > 0.1) # Our label 
-		to_save.append([sent[0], y])
+	first, end = sent_data.sentence_range(key)
+	for text, y in zip(sent_data.sentence_texts(key), labels[first:end]):
+		to_save.append([text, int(y)])
 
 # Save in tsv format
 final = pd.DataFrame(to_save)
@@ -59,17 +60,17 @@ final.to_csv(prefix + 'bert_data/us_test.tsv', sep='\t', index=None)
 
 
 # CA
-sent_data = pickle.load(open(prefix + 'sent_data/ca_test_sent_scores.pkl', 'rb'))
+sent_data = SentenceStore(prefix + 'sent_data/ca_test_sent_scores.store')
 
 # Establish an ordering for scoring after BERT runs
 doc_order = sorted(sent_data.keys())
+labels = sent_data.labels('rouge-2', 'p', 0.1) # Our label
 
 to_save = []
 for key in doc_order:
-	doc = sent_data[key]
-	for sent in doc:
-		y = int(sent[2]['rouge-2']['p'] > 0.1) # Our label 
-		to_save.append([sent[0], y])
+	first, end = sent_data.sentence_range(key)
+	for text, y in zip(sent_data.sentence_texts(key), labels[first:end]):
+		to_save.append([text, int(y)])
 
 # Save in tsv format
 final = pd.DataFrame(to_save)
@@ -1,7 +1,7 @@
 from billsum.classifiers.features.generic_features import *
 from billsum.classifiers.features.tfidf_features import *
 from billsum.classifiers.text_transformer import SpacyTfidfWrapper
-from billsum.utils.sentence_utils import list_to_doc
+from billsum.utils.sentence_utils import check_fields, list_to_doc
 
 import numpy as np
 from sklearn.ensemble import RandomForestClassifier
@@ -24,6 +24,13 @@ class FeatureScorer:
 
         self.score_threshold = 0.1
 
+    def check_fields(self, docs):
+        '''
+        Raise a ValueError if the docs lack annotations a feature needs
+        '''
+        for f in self.feats:
+            check_fields(f.required_fields, docs, type(f).__name__)
+
     def create_features(self, doc):
 
         all_feats = []
@@ -40,6 +47,7 @@ class FeatureScorer:
         
         # Transform sentences into our custom format
         new_docs = [list_to_doc(doc['doc']) for doc in train_docs]
+        self.check_fields(new_docs)
 
         for f in self.feats:
             f.fit(new_docs, summaries)
@@ -60,6 +68,7 @@ class FeatureScorer:
     def score_doc(self, doc):
 
         doc = list_to_doc(doc['doc'])
+        self.check_fields([doc])
         X = self.create_features(doc)
 
         return self.clf.predict_proba(X)[:,1]
@@ -90,6 +99,7 @@ class TextScorer:
 
     def train(self, train_docs):
         tdocs = [d['doc'] for d in train_docs]
+        check_fields(self.tfidf.required_fields, tdocs, 'TextScorer')
         self.tfidf.fit(tdocs)
         
         print('Text fit')
@@ -13,7 +13,10 @@ class GenericFeature(object):
     """
     An example of a feature generating class - contains the basics that all 
     other classes will extend. 
+
+    required_fields: the fields of utils.sentence_utils.Word the feature reads
     """
+    required_fields = ()
 
     def __init__(self, use_spacy=False):
         
@@ -84,6 +87,7 @@ class SentencePosF(GenericFeature):
 
 
 class NearSectionStartF(GenericFeature):
+    required_fields = ('text',)
 
     def prepare_doc(self, doc, *args, **kwargs):
 
@@ -124,6 +128,7 @@ class HasNerF(GenericFeature):
 
     TODO: make into count of each type
     """
+    required_fields = ('ent_type_', 'ent_iob_')
     enttypes = ['PERSON', 'NORP', 'FAC', 'ORG', 'GPE', 'LOC',
                 'PRODUCT', 'EVENT', 'WORK_OF_ART', 'LAW', 
                 'LANGUAGE', 'DATE', 'TIME', 'PERCENT', 'MONEY',
@@ -136,6 +141,7 @@ class HasNerF(GenericFeature):
    
         
 class SecretaryF(GenericFeature):
+    required_fields = ('text',)
 
     def make_features(self, i, sent):
 
@@ -16,6 +16,10 @@ class GlobalTfidfF(GenericFeature):
     The word score is the TF-IDF score over the whole document - since
     different sentences contain different subsets of words, their feature will be different. 
     """
+    @property
+    def required_fields(self):
+        return self.text_transformer.required_fields
+
     def __init__(self, tfidf_args=None, text_transformer=None):
 
         if not text_transformer:
@@ -51,6 +55,7 @@ class DocTfidfF(GenericFeature):
     
     Returns statistics on the probability of words in each sent
     '''
+    required_fields = ('lemma_',)
 
     def __init__(self, average=True ):
 
@@ -82,6 +87,7 @@ class KLSummaryF(GenericFeature):
     The feature is the average/max of the scores of the concepts in the sentence.
 
     '''
+    required_fields = ('lemma_',)
     def __init__(self):
 
         self.offset =  0.000005
@@ -48,6 +48,10 @@ class SpacyTfidfWrapper(object):
 
         self.tfidf = tfidf
 
+    @property
+    def required_fields(self):
+        return ('lemma_',) if self.lemmatize else ('text',)
+
     def prep_sent(self, sent):
         
         final_words = []
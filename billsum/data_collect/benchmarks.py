@@ -0,0 +1,116 @@
+'''
+Benchmarks for the dataset preparation code.
+
+Usage:
+    python billsum/data_collect/benchmarks.py xml FILE [FILE ...]
+    python billsum/data_collect/benchmarks.py text VERSION_DIR [VERSION_DIR ...]
+
+xml: compares extract_data_xml (full ET.parse) against the streaming
+     extract_data_xml_stream on a set of data.xml / billStatus files.
+text: compares preparing and cleaning bill texts from document.html only
+     against the xml-first path (document.xml where there is one) on a set
+     of text version directories.
+'''
+import sys
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+from billsum.data_collect.prepare_dataset import (extract_data_xml, extract_data_xml_stream, read_bill_text,
+                                                  read_latest_text, version_text_files)
+from billsum.data_prep.clean_text import clean_text
+
+
+def parse_xml_tree(path):
+    return extract_data_xml(ET.parse(path).getroot())
+
+
+def time_function(fn, paths, repeat=3):
+    '''
+    Best total time (in seconds) of running fn over all the paths.
+    '''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for path in paths:
+            fn(path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def peak_memory(fn, paths):
+    '''
+    Largest peak of traced memory (in bytes) over single calls of fn.
+    '''
+    peak = 0
+    for path in paths:
+        tracemalloc.start()
+        fn(path)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return peak
+
+
+def benchmark_xml_extraction(paths, repeat=3):
+    '''
+    Time both xml extractors over the files, measure their peak memory and
+    make sure they agree on every file.
+
+    Returns dict of extractor name -> (seconds, peak bytes)
+    '''
+    extractors = [('tree', parse_xml_tree), ('stream', extract_data_xml_stream)]
+
+    mismatches = [p for p in paths if parse_xml_tree(p) != extract_data_xml_stream(p)]
+    if mismatches:
+        raise ValueError('Extractors disagree on {}'.format(mismatches[:5]))
+
+    results = {}
+    for name, fn in extractors:
+        results[name] = (time_function(fn, paths, repeat), peak_memory(fn, paths))
+
+    print('{} files'.format(len(paths)))
+    for name, (seconds, peak) in results.items():
+        print('{:8s} {:8.3f}s  {:8.2f} ms/file  peak {:8.1f} KB'.format(
+            name, seconds, 1000 * seconds / len(paths), peak / 1024))
+
+    return results
+
+
+def html_text_path(version_dir):
+    return clean_text(read_bill_text(version_text_files(version_dir)[1]))
+
+
+def xml_text_path(version_dir):
+    return clean_text(read_latest_text(*version_text_files(version_dir)))
+
+
+def benchmark_text_paths(version_dirs, repeat=3):
+    '''
+    Time preparing and cleaning the texts of the versions through the html
+    and through the xml-first path. Every version needs a document.html, a
+    mix with and without document.xml shows the speedup on real sessions.
+
+    Returns dict of path name -> seconds
+    '''
+    n_xml = len([d for d in version_dirs if version_text_files(d)[0] is not None])
+
+    results = {}
+    for name, fn in [('html', html_text_path), ('xml-first', xml_text_path)]:
+        results[name] = time_function(fn, version_dirs, repeat)
+
+    print('{} versions, {} with xml'.format(len(version_dirs), n_xml))
+    for name, seconds in results.items():
+        print('{:10s} {:8.3f}s  {:8.2f} ms/version'.format(name, seconds, 1000 * seconds / len(version_dirs)))
+    print('speedup {:.2f}x'.format(results['html'] / results['xml-first']))
+
+    return results
+
+
+if __name__ == '__main__':
+    benchmarks = {'xml': benchmark_xml_extraction, 'text': benchmark_text_paths}
+    if len(sys.argv) < 3 or sys.argv[1] not in benchmarks:
+        print(__doc__)
+        sys.exit(1)
+
+    benchmarks[sys.argv[1]](sys.argv[2:])
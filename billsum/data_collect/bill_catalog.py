@@ -0,0 +1,231 @@
+'''
+A SQLite catalog of the congress data tree.
+
+The tree is swept once with os.scandir and every session, bill and text
+version is recorded with its file paths, so that prepare_dataset.py and
+other tools can find a bill's latest text, or select a subset of bills,
+without listing the directories again.
+
+Usage:
+    python billsum/data_collect/bill_catalog.py CONGRESS_ROOT CATALOG_DB [SESSION ...]
+
+CONGRESS_ROOT holds one directory per session, laid out as described in
+BillSum_Data_Documentation.md.
+'''
+import os
+import re
+import sqlite3
+import sys
+
+from billsum.data_collect.text_versions import is_house_type, pick_latest_version, version_rank
+
+
+SCHEMA = '''
+CREATE TABLE bills (
+    id INTEGER PRIMARY KEY,
+    session INTEGER NOT NULL,
+    bill_type TEXT NOT NULL,
+    bill_name TEXT NOT NULL,
+    bill_num INTEGER,
+    bill_dir TEXT NOT NULL,
+    data_path TEXT,
+    has_text_versions INTEGER NOT NULL,
+    latest_version TEXT,
+    text_path TEXT,
+    text_xml_path TEXT
+);
+CREATE TABLE versions (
+    bill INTEGER NOT NULL REFERENCES bills(id),
+    version TEXT NOT NULL,
+    rank INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    html_path TEXT,
+    xml_path TEXT
+);
+CREATE INDEX bills_by_type ON bills(session, bill_type, bill_num);
+CREATE UNIQUE INDEX bills_by_name ON bills(session, bill_name);
+CREATE INDEX bills_by_dir ON bills(bill_dir);
+CREATE INDEX versions_by_bill ON versions(bill, rank DESC, position);
+'''
+
+BILL_NUM_RE = re.compile('([0-9]+)$')
+
+
+def _scan_dirs(path):
+    '''
+    Names and paths of the sub directories of path, in listing order.
+    '''
+    with os.scandir(path) as it:
+        return [(e.name, e.path) for e in it if e.is_dir()]
+
+
+def _scan_files(path):
+    with os.scandir(path) as it:
+        return {e.name: e.path for e in it if e.is_file()}
+
+
+def scan_bill(bill_dir, bill_type):
+    '''
+    Collect the files of one bill directory.
+
+    Returns (data_path, has_text_versions, versions) where versions is a list
+    of (version, rank, html_path, xml_path) in listing order.
+    '''
+    files = _scan_files(bill_dir)
+    data_path = files.get('data.json', files.get('data.xml'))
+
+    versions_dir = os.path.join(bill_dir, 'text-versions')
+    if not os.path.isdir(versions_dir):
+        return data_path, False, []
+
+    house = is_house_type(bill_type)
+    versions = []
+    for version, version_dir in _scan_dirs(versions_dir):
+        docs = _scan_files(version_dir)
+        versions.append((version, version_rank(version, house),
+                         docs.get('document.html'), docs.get('document.xml')))
+
+    return data_path, True, versions
+
+
+def build_catalog(root, db_path, sessions=None):
+    '''
+    Sweep the congress tree under root and write the catalog to db_path.
+    The catalog is built in a temporary file that replaces db_path at the
+    end, so readers never see a half-built catalog.
+
+    sessions: optional list of sessions to include (default: every numeric
+        directory under root)
+
+    Returns number of bills in the catalog
+    '''
+    tmp_path = db_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    conn.executescript(SCHEMA)
+
+    if sessions is None:
+        sessions = sorted(int(name) for name, _ in _scan_dirs(root) if name.isdigit())
+
+    total = 0
+    for ses in sessions:
+        bills_dir = os.path.join(root, str(ses), 'bills')
+        if not os.path.isdir(bills_dir):
+            continue
+
+        for btype, type_dir in _scan_dirs(bills_dir):
+            for name, bill_dir in _scan_dirs(type_dir):
+                data_path, has_versions, versions = scan_bill(bill_dir, btype)
+
+                latest_version = None
+                text_path = None
+                text_xml_path = None
+                if versions:
+                    latest_version = pick_latest_version([v[0] for v in versions], is_house_type(btype))
+                    text_path, text_xml_path = [v[2:] for v in versions if v[0] == latest_version][0]
+
+                num = BILL_NUM_RE.search(name)
+                cur = conn.execute(
+                    'INSERT INTO bills (session, bill_type, bill_name, bill_num, bill_dir, data_path, '
+                    'has_text_versions, latest_version, text_path, text_xml_path) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (ses, btype, name, int(num.group(1)) if num else None, bill_dir, data_path,
+                     int(has_versions), latest_version, text_path, text_xml_path))
+
+                conn.executemany(
+                    'INSERT INTO versions (bill, version, rank, position, html_path, xml_path) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    [(cur.lastrowid, v, rank, i, html, xml)
+                     for i, (v, rank, html, xml) in enumerate(versions)])
+                total += 1
+
+        print(ses, total)
+
+    conn.commit()
+    conn.close()
+    os.replace(tmp_path, db_path)
+
+    return total
+
+
+def open_catalog(db_path):
+    if not os.path.isfile(db_path):
+        raise ValueError('No catalog at {}'.format(db_path))
+
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def select_bills(conn, session=None, bill_type=None, include_res=False):
+    '''
+    Select bills from the catalog, in the order they were found on disk.
+
+    session, bill_type: optional filters, e.g. select_bills(conn, 110, 'hr')
+    include_res: also return resolutions (skipped by the dataset)
+
+    Returns list of dicts with the columns of the bills table
+    '''
+    query = 'SELECT * FROM bills'
+    conds = []
+    params = []
+    if session is not None:
+        conds.append('session = ?')
+        params.append(session)
+    if bill_type is not None:
+        conds.append('bill_type = ?')
+        params.append(bill_type)
+    if not include_res:
+        conds.append("bill_type NOT LIKE '%res%'")
+
+    if conds:
+        query += ' WHERE ' + ' AND '.join(conds)
+    query += ' ORDER BY id'
+
+    return [dict(row) for row in conn.execute(query, params)]
+
+
+def lookup_bill(conn, session, bill_name):
+    '''
+    Catalog entry of one bill (e.g. lookup_bill(conn, 110, 'hr1424')), or None.
+    '''
+    row = conn.execute('SELECT * FROM bills WHERE session = ? AND bill_name = ?',
+                       (session, bill_name)).fetchone()
+    return dict(row) if row is not None else None
+
+
+def latest_text(conn, session, bill_name):
+    '''
+    Latest text version of a bill as (version, path to document.html), or
+    None if the bill has no text versions.
+    '''
+    row = conn.execute('SELECT latest_version, text_path FROM bills WHERE session = ? AND bill_name = ?',
+                       (session, bill_name)).fetchone()
+    if row is None or row['latest_version'] is None:
+        return None
+    return row['latest_version'], row['text_path']
+
+
+def bill_versions(conn, session, bill_name):
+    '''
+    All text versions of a bill, latest first.
+
+    Returns list of dicts with version, rank, html_path and xml_path
+    '''
+    rows = conn.execute(
+        'SELECT v.version, v.rank, v.html_path, v.xml_path FROM versions v '
+        'JOIN bills b ON v.bill = b.id WHERE b.session = ? AND b.bill_name = ? '
+        'ORDER BY v.rank DESC, v.position', (session, bill_name))
+    return [dict(row) for row in rows]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+
+    sessions = [int(s) for s in sys.argv[3:]] or None
+    total = build_catalog(sys.argv[1], sys.argv[2], sessions)
+    print('Catalogued {} bills'.format(total))
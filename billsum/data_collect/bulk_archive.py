@@ -0,0 +1,215 @@
+'''
+Prepare bills straight out of bulk-data zip archives, without unpacking
+them to disk first.
+
+Two member layouts are recognized:
+    - the congress tree (see BillSum_Data_Documentation.md), e.g.
+      115/bills/hr/hr1/data.xml and 115/bills/hr/hr1/text-versions/ih/document.html
+      (or document.xml)
+    - govinfo bulk-data names, e.g. BILLSTATUS-115hr1.xml for the metadata
+      and BILLS-115hr1ih.htm or BILLS-115hr1ih.xml for the text of a version
+
+As in prepare_dataset.py, the xml text of a version is used where there is
+one, and the html otherwise.
+
+Metadata and texts can be split over several archives. Bills are prepared
+in the order their members appear in the archives, and every member is read
+through a stream from the zip.
+
+Usage:
+    python billsum/data_collect/bulk_archive.py --output-path OUT_{}.jsonl ARCHIVE [ARCHIVE ...]
+'''
+import argparse
+from collections import OrderedDict
+import io
+import re
+import zipfile
+
+from billsum.data_collect.near_dups import DEDUP_MODES
+from billsum.data_collect.prepare_dataset import OUTPUT_PATH, read_bill_data, read_latest_text, run_ingestion
+from billsum.data_collect.text_versions import is_house_type, pick_latest_version
+
+
+TREE_RE = re.compile(
+    r'(?:^|/)([0-9]+)/bills/([a-z]+)/([a-z]+[0-9]+)/(data\.json|data\.xml|text-versions/([a-z0-9]+)/(document\.(?:html|xml))?)$')
+BILLSTATUS_RE = re.compile(r'(?:^|/)BILLSTATUS-([0-9]+)([a-z]+)([0-9]+)\.xml$')
+BILLS_RE = re.compile(r'(?:^|/)BILLS-([0-9]+)([a-z]+)([0-9]+)([a-z][a-z0-9]*)\.(html?|xml)$')
+
+
+def parse_member(name):
+    '''
+    Work out what a zip member holds.
+
+    Returns (session, bill_type, bill_name, kind, version) where kind is
+    'data.json', 'data.xml', 'html' or 'xml' (text of a version) or 'version'
+    (directory entry of a text version), or None for unrelated members.
+    '''
+    m = TREE_RE.search(name)
+    if m:
+        ses, btype, bill_name, kind, version, doc = m.groups()
+        if version is not None:
+            kind = doc.rsplit('.', 1)[1] if doc else 'version'
+        return int(ses), btype, bill_name, kind, version
+
+    m = BILLSTATUS_RE.search(name)
+    if m:
+        ses, btype, num = m.groups()
+        return int(ses), btype, btype + num, 'data.xml', None
+
+    m = BILLS_RE.search(name)
+    if m:
+        ses, btype, num, version, ext = m.groups()
+        return int(ses), btype, btype + num, 'xml' if ext == 'xml' else 'html', version
+
+    return None
+
+
+def index_archives(archive_paths):
+    '''
+    Read the central directories of the archives and group the members by
+    bill. Only reads the zip indexes, not the members.
+
+    Returns OrderedDict of (session, bill_type, bill_name) -> dict with
+        data: (archive path, member name) of the metadata, or None
+        versions: OrderedDict of version -> dict with the (archive path, member
+            name) of its 'xml' and 'html' text, or None for a missing text
+    in the order the bills first appear in the archives.
+    '''
+    bills = OrderedDict()
+
+    for path in archive_paths:
+        with zipfile.ZipFile(path) as zf:
+            for info in zf.infolist():
+                parsed = parse_member(info.filename)
+                if parsed is None:
+                    continue
+
+                ses, btype, bill_name, kind, version = parsed
+                bill = bills.setdefault((ses, btype, bill_name), {'data': None, 'versions': OrderedDict()})
+
+                if kind in ('xml', 'html'):
+                    bill['versions'].setdefault(version, {'xml': None, 'html': None})[kind] = (path, info.filename)
+                elif kind == 'version':
+                    bill['versions'].setdefault(version, {'xml': None, 'html': None})
+                # data.json takes precedence over data.xml, as in prepare_bill
+                elif bill['data'] is None or kind == 'data.json':
+                    bill['data'] = (path, info.filename)
+
+    return bills
+
+
+# Archives opened by this process, so that workers open every archive once
+_archives = {}
+
+
+def open_member(archive_path, member, mode='r'):
+    '''
+    Open a zip member for reading - in text mode (with the same decoding and
+    newline handling as open) unless mode is 'rb'.
+    '''
+    if archive_path not in _archives:
+        _archives[archive_path] = zipfile.ZipFile(archive_path)
+
+    f = _archives[archive_path].open(member)
+    if mode == 'rb':
+        return f
+    return io.TextIOWrapper(f)
+
+
+def ingest_archive_bill(task):
+    '''
+    Prepare one bill from its archive members. Same results as ingest_bill.
+
+    task: (session, bill_name, data, xml, html) where data, xml and html are
+        (archive path, member name) pairs or None
+    '''
+    ses, bill_name, data, xml, html = task
+    label = '{}_{}'.format(ses, bill_name)
+    print(label)
+
+    try:
+        if data is None:
+            raise ValueError('No data file for bill ')
+
+        archive, member = data
+        bd = read_bill_data(member, lambda name, mode: open_member(archive, name, mode))
+        bd['bill_id'] = label
+
+        def open_text(member, mode):
+            archive = xml[0] if xml is not None and member == xml[1] else html[0]
+            return open_member(archive, member, mode)
+
+        bd['text'] = read_latest_text(xml and xml[1], html and html[1], open_text)
+    except ValueError as e:
+        return ses, label, 'error', str(e)
+
+    if bd.get('summary') is not None and bd.get('text') is not None:
+        return ses, label, 'kept', bd
+    return ses, label, 'skipped', None
+
+
+def archive_tasks(bills, sessions):
+    '''
+    Tasks for ingest_archive_bill, grouped by session in the order of
+    sessions and in archive order within each session. Resolutions are
+    skipped, as in prepare_dataset.py.
+    '''
+    tasks = []
+    for ses in sessions:
+        for (bill_ses, btype, bill_name), bill in bills.items():
+            if bill_ses != ses or 'res' in btype:
+                continue
+
+            xml = html = None
+            if bill['versions']:
+                latest = pick_latest_version(list(bill['versions']), is_house_type(btype))
+                xml = bill['versions'][latest]['xml']
+                html = bill['versions'][latest]['html']
+
+            tasks.append((ses, bill_name, bill['data'], xml, html))
+    return tasks
+
+
+def ingest_archives(archive_paths, output_path=OUTPUT_PATH, sessions=None, workers=1, chunksize=16,
+                    shard_size=None, dedup=None, dedup_path=None):
+    '''
+    Prepare every bill found in the archives and write one jsonl per session,
+    like prepare_dataset.ingest_sessions.
+
+    sessions: optional list of sessions to prepare (default: all sessions in
+        the archives)
+    shard_size: write compressed shards instead, see ingest_sessions
+    dedup, dedup_path: near-duplicate handling, see ingest_sessions
+    '''
+    bills = index_archives(archive_paths)
+    if sessions is None:
+        sessions = sorted(set(key[0] for key in bills))
+
+    tasks = archive_tasks(bills, sessions)
+    print('Found {} bills in {} archives'.format(len(tasks), len(archive_paths)))
+
+    return run_ingestion(ingest_archive_bill, tasks, sessions, output_path, workers, chunksize,
+                         shard_size=shard_size, dedup=dedup, dedup_path=dedup_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the final per-session datasets from bulk-data zip archives')
+    parser.add_argument('archives', nargs='+', help='Zip archives with bill metadata and texts')
+    parser.add_argument('--output-path', default=OUTPUT_PATH,
+                        help='Output jsonl path, with {} for the session')
+    parser.add_argument('--sessions', type=int, nargs='*',
+                        help='Only prepare these sessions')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes used to prepare bills')
+    parser.add_argument('--chunksize', type=int, default=16,
+                        help='Bills sent to a worker at a time')
+    parser.add_argument('--shard-size', type=int,
+                        help='Write compressed shards of this many bills with a bill_id index')
+    parser.add_argument('--dedup', choices=DEDUP_MODES,
+                        help='Drop, tag or point to their canonical bill the near-duplicate bills')
+    parser.add_argument('--dedup-path',
+                        help='Save the bill_id -> canonical bill_id map of --dedup here')
+    args = parser.parse_args()
+
+    ingest_archives(args.archives, args.output_path, args.sessions, args.workers, args.chunksize,
+                    args.shard_size, args.dedup, args.dedup_path)
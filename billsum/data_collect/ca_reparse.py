@@ -0,0 +1,184 @@
+'''
+Rebuild the California records offline from a page archive written by
+ca_scraper.py --archive, without fetching anything.
+
+Pages are parsed with plain lxml and pyquery (the same text extraction
+requests_html does, without its BeautifulSoup pass) in a pool of worker
+processes.
+
+Usage:
+    python billsum/data_collect/ca_reparse.py ARCHIVE_DIR [--sessions 201520160 ...]
+        [--output-dir DIR] [--workers N] [--pickle] [--check N]
+
+The records of a session go to OUTPUT_DIR/ca_<session>_reparsed.jsonl, so
+that a scrape's ca_<session>.jsonl and its checkpoint are left alone.
+
+--check N first compares the lxml parser against ca_scraper.parse_bill_page
+on N archived pages.
+'''
+import argparse
+import json
+import lxml.html
+from lxml import etree
+import multiprocessing
+import os
+from pyquery import PyQuery
+import random
+import time
+
+from billsum.data_collect.ca_scraper import SESSION_RANGES, export_pickle, parse_bill_page, session_bills
+from billsum.data_collect.page_archive import PageArchive
+
+
+def reparse_output(output_dir, session):
+    # Not the scraper's ca_<session>.jsonl, which its checkpoint describes
+    return os.path.join(output_dir, 'ca_{}_reparsed.jsonl'.format(session))
+
+
+def _find(doc, element_id):
+    found = doc.xpath('//*[@id=$id]', id=element_id)
+    if not found:
+        raise ValueError('No #{} in page'.format(element_id))
+    return found[0]
+
+
+def parse_page_lxml(html, external_id):
+    '''
+    Same as ca_scraper.parse_bill_page, on a plain lxml tree.
+
+    Returns None for bills with amendments marked up (strike-through text)
+    '''
+    doc = lxml.html.fromstring(html.decode('utf-8', errors='replace'))
+
+    bill = _find(doc, 'bill')
+    if '<strike/>' in etree.tostring(bill, encoding='unicode'):
+        return None
+
+    title = PyQuery(_find(doc, 'title')).text()
+
+    summary = PyQuery(_find(doc, 'digesttext')).text()
+
+    text = PyQuery(bill).text()
+
+    text = text.replace(u'\xa0', u' ')
+
+    return {'summary': summary, 'text': text, 'title': title, 'external_id': external_id}
+
+
+_archive = None
+
+
+def _init_worker(root):
+    global _archive
+    _archive = PageArchive(root)
+
+
+def reparse_page(task):
+    '''
+    task: (external_id, sha1)
+
+    Returns (external_id, status, record) like ca_scraper.scrape_bill
+    '''
+    external_id, sha1 = task
+    try:
+        record = parse_page_lxml(_archive.get(sha1), external_id)
+    except Exception as e:
+        print("bad bill", external_id, e)
+        return external_id, 'error', None
+
+    if record is None:
+        return external_id, 'skipped', None
+    return external_id, 'kept', record
+
+
+def session_tasks(archive, session, ranges=None):
+    '''
+    (external_id, sha1) of the archived pages of a session, in bill order if
+    the session's bill ranges are known and in fetch order otherwise.
+    '''
+    pages = archive.pages(session)
+    if ranges is None:
+        ranges = SESSION_RANGES.get(session)
+
+    if ranges is None:
+        return [(external_id, sha1) for (_, external_id), sha1 in pages.items()]
+
+    tasks = []
+    for bill in session_bills(ranges):
+        external_id = '{} {}'.format(*bill)
+        if (session, external_id) in pages:
+            tasks.append((external_id, pages[(session, external_id)]))
+    return tasks
+
+
+def reparse_session(archive_root, session, output_dir='.', ranges=None, workers=None, chunksize=32):
+    '''
+    Parse every archived page of a session and write the records to
+    output_dir/ca_<session>_reparsed.jsonl.
+
+    Returns dict of status -> count
+    '''
+    archive = PageArchive(archive_root)
+    tasks = session_tasks(archive, session, ranges)
+    output_file = reparse_output(output_dir, session)
+
+    counts = {'kept': 0, 'skipped': 0, 'error': 0}
+    start = time.time()
+    with multiprocessing.Pool(workers, _init_worker, (archive_root,)) as pool, open(output_file, 'w') as out:
+        for external_id, status, record in pool.imap(reparse_page, tasks, chunksize):
+            counts[status] += 1
+            if record is not None:
+                out.write(json.dumps(record) + '\n')
+
+    elapsed = time.time() - start
+    print('{}: {} pages in {:.1f}s ({:.1f} pages/sec), kept: {} skipped: {} errors: {}'.format(
+        session, len(tasks), elapsed, len(tasks) / max(elapsed, 1e-9),
+        counts['kept'], counts['skipped'], counts['error']))
+    return counts
+
+
+def check_parsers(archive_root, n=100, seed=0):
+    '''
+    Compare parse_page_lxml with ca_scraper.parse_bill_page on a random
+    sample of n archived pages.
+
+    Returns list of external_ids where they disagree
+    '''
+    archive = PageArchive(archive_root)
+    pages = list(archive.pages().items())
+    random.Random(seed).shuffle(pages)
+
+    mismatches = []
+    for (_, external_id), sha1 in pages[:n]:
+        html = archive.get(sha1)
+        if parse_page_lxml(html, external_id) != parse_bill_page(html, external_id):
+            mismatches.append(external_id)
+
+    print('Checked {} pages, {} mismatches'.format(min(n, len(pages)), len(mismatches)))
+    return mismatches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild the California records from a page archive')
+    parser.add_argument('archive', help='Page archive directory')
+    parser.add_argument('--sessions', nargs='*',
+                        help='Sessions to rebuild (default: all sessions in the archive)')
+    parser.add_argument('--output-dir', default='.')
+    parser.add_argument('--workers', type=int,
+                        help='Number of processes (default: all cores)')
+    parser.add_argument('--pickle', action='store_true',
+                        help='Also export every session as a pickled list of records')
+    parser.add_argument('--check', type=int, default=0,
+                        help='Compare against the requests_html parser on this many pages first')
+    args = parser.parse_args()
+
+    if args.check and check_parsers(args.archive, args.check):
+        raise SystemExit('The lxml parser disagrees with parse_bill_page')
+
+    sessions = args.sessions or PageArchive(args.archive).sessions()
+    for session in sessions:
+        reparse_session(args.archive, session, args.output_dir, workers=args.workers)
+
+        if args.pickle and session in SESSION_RANGES:
+            output_file = reparse_output(args.output_dir, session)
+            export_pickle(output_file, os.path.splitext(output_file)[0] + '.pkl', SESSION_RANGES[session])
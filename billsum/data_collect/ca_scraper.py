@@ -1,73 +1,364 @@
+'''
+Scrape the California bills (text, digest and title) from leginfo.
+
+Pages are fetched concurrently on one pooled HTTP client, with a limit on
+the number of requests in flight, a token-bucket rate limit and retries
+with exponential backoff.
+
+Usage:
+	python billsum/data_collect/ca_scraper.py [--sessions 201520160 ...] [--output-dir DIR]
+		[--concurrency 8] [--rate 2] [--base-url URL] [--pickle] [--archive DIR]
+
+Records are appended to OUTPUT_DIR/ca_<session>.jsonl as they arrive, and
+every finished bill is logged in a checkpoint next to it, so an interrupted
+run picks up where it stopped. --pickle also exports the session in bill
+order as a list of records, like the original ca_senate_20152016.pkl.
+
+Sessions are leginfo bill_id prefixes, e.g. 201520160 for 2015-2016.
+
+Point --base-url at a local stand-in (see standin_server.py) to try the
+scraper without hitting leginfo.
+
+With --archive DIR every fetched page is also kept raw in a page archive
+(see page_archive.py), and ca_reparse.py can rebuild the records from it
+offline when the extraction changes.
+'''
+import aiohttp
+import argparse
+import asyncio
+import json
+import os
 import pickle
-from requests_html import HTMLSession
+from requests_html import HTML
 import time
 
-session = HTMLSession()
+from billsum.data_collect.page_archive import PageArchive
 
 
-base = "http://leginfo.legislature.ca.gov/faces/billTextClient.xhtml?bill_id=201520160"
+base = "http://leginfo.legislature.ca.gov/faces/billTextClient.xhtml?bill_id="
 
+DEFAULT_SESSION = '201520160'
 
-data = []
+# (bill type, last bill number) per session
+SESSION_RANGES = {
+	'201520160': [('SB', 1481), ('AB', 2915)],
+}
+
+# Responses worth another try
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class FetchError(Exception):
+	pass
+
+
+class TokenBucket:
+	'''
+	Token-bucket rate limiter - on average rate requests per second, with
+	bursts of up to capacity requests.
+	'''
+
+	def __init__(self, rate, capacity=None):
+		self.rate = rate
+		self.capacity = capacity if capacity is not None else max(1, rate)
+		self.tokens = self.capacity
+		self.updated = time.monotonic()
+		self.lock = asyncio.Lock()
+
+	async def acquire(self):
+		async with self.lock:
+			while True:
+				now = time.monotonic()
+				self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+				self.updated = now
+
+				if self.tokens >= 1:
+					self.tokens -= 1
+					return
+
+				await asyncio.sleep((1 - self.tokens) / self.rate)
 
-try:
-	for i in range(1, 1482):
-		try:
-			if i % 10 == 0:
-				print(i, len(data))
-				time.sleep(5)
 
-			url = base + "SB{}".format(i)
+def parse_bill_page(html, external_id, url=None):
+	'''
+	Extract the record of a bill from its page.
 
-			r = session.get(url)
+	Returns None for bills with amendments marked up (strike-through text),
+	which we skip.
+	'''
+	page = HTML(url=url, html=html)
 
-			if '<strike/>' in str(r.html.find('#bill', first=True).raw_html):
-				print('too fancy')
-				continue
+	if '<strike/>' in str(page.find('#bill', first=True).raw_html):
+		return None
 
-			title = r.html.find('#title', first=True).text 
+	title = page.find('#title', first=True).text
 
-			summary = r.html.find('#digesttext', first=True).text 
+	summary = page.find('#digesttext', first=True).text
 
-			text = r.html.find('#bill', first=True).text
+	text = page.find('#bill', first=True).text
 
-			text = text.replace(u'\xa0', u' ')
+	text = text.replace(u'\xa0', u' ')
 
-			data.append({'summary': summary, 'text': text, 'title': title, 'external_id': 'SB {}'.format(i)})
-		except KeyboardInterrupt:
-			raise KeyboardInterrupt
-		except:
-			print("bad bill", i)
+	return {'summary': summary, 'text': text, 'title': title, 'external_id': external_id}
 
 
-	for i in range(1, 2916):
+async def fetch_page(session, url, limiter, retries=3, backoff=1.0):
+	'''
+	GET a page, retrying connection errors, timeouts and the statuses in
+	RETRY_STATUSES with exponential backoff.
+
+	Returns the body as bytes
+	'''
+	error = None
+	for attempt in range(retries + 1):
+		await limiter.acquire()
+		try:
+			async with session.get(url) as resp:
+				if resp.status < 400:
+					return await resp.read()
+				if resp.status not in RETRY_STATUSES:
+					raise FetchError('HTTP {} for {}'.format(resp.status, url))
+				error = 'HTTP {}'.format(resp.status)
+		except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+			error = repr(e)
+
+		if attempt < retries:
+			await asyncio.sleep(backoff * 2 ** attempt)
+
+	raise FetchError('Giving up on {}: {}'.format(url, error))
+
+
+async def scrape_bill(session, limiter, semaphore, base_url, bill_type, i, retries=3, backoff=1.0, store=None):
+	'''
+	Fetch and parse one bill.
+
+	store: optional function called with (external_id, html) for every
+		fetched page, before it is parsed
+
+	Returns (external_id, status, record) where status is 'kept', 'skipped'
+	(too fancy) or 'error'
+	'''
+	url = base_url + "{}{}".format(bill_type, i)
+	external_id = '{} {}'.format(bill_type, i)
+
+	async with semaphore:
 		try:
-			if i % 10 == 0:
-				print(i, len(data))
-				time.sleep(5)
+			html = await fetch_page(session, url, limiter, retries, backoff)
+			if store is not None:
+				store(external_id, html)
+			record = parse_bill_page(html, external_id, url)
+		except (KeyboardInterrupt, asyncio.CancelledError):
+			raise
+		except Exception:
+			print("bad bill", external_id)
+			return external_id, 'error', None
+
+	if record is None:
+		print('too fancy', external_id)
+		return external_id, 'skipped', None
+	return external_id, 'kept', record
+
+
+class ScrapeLog:
+	'''
+	Streaming output of a session scrape: records go to a jsonl file and the
+	external_id of every finished bill to a checkpoint file, both flushed as
+	they arrive.
+
+	Bills that failed are not checkpointed, so they are tried again on the
+	next run. A record whose checkpoint line was lost in a crash still counts
+	as done, and a partly written last line is dropped.
+	'''
+
+	def __init__(self, output_file):
+		self.output_file = output_file
+		self.checkpoint_file = checkpoint_path(output_file)
+		self.done = set()
+
+		if os.path.isfile(self.output_file):
+			_truncate_partial_line(self.output_file)
+			self.done.update(r['external_id'] for r in read_records(self.output_file))
+		if os.path.isfile(self.checkpoint_file):
+			_truncate_partial_line(self.checkpoint_file)
+			with open(self.checkpoint_file) as f:
+				self.done.update(line.split('\t')[0] for line in f)
+
+		self.out = open(self.output_file, 'a')
+		self.checkpoint = open(self.checkpoint_file, 'a')
+
+	def add(self, external_id, status, record=None):
+		if status == 'error':
+			return
+
+		if record is not None:
+			self.out.write(json.dumps(record) + '\n')
+			self.out.flush()
+
+		self.checkpoint.write('{}\t{}\n'.format(external_id, status))
+		self.checkpoint.flush()
+		self.done.add(external_id)
+
+	def close(self):
+		self.out.close()
+		self.checkpoint.close()
+
+
+def checkpoint_path(output_file):
+	return os.path.splitext(output_file)[0] + '.checkpoint'
+
+
+def _truncate_partial_line(path):
+	with open(path, 'rb+') as f:
+		data = f.read()
+		if data and not data.endswith(b'\n'):
+			f.truncate(data.rfind(b'\n') + 1)
+
+
+def read_records(output_file):
+	with open(output_file) as f:
+		return [json.loads(line) for line in f]
+
+
+async def scrape_bills(bills, base_url=base + DEFAULT_SESSION, concurrency=8, rate=2.0, retries=3, backoff=1.0,
+					   timeout=60, log=None, store=None):
+	'''
+	Scrape a list of (bill_type, number) pairs.
+
+	concurrency: max requests in flight (also the size of the connection pool)
+	rate: max requests per second, on average
+	retries, backoff: retry a failed request up to retries times, waiting
+		backoff * 2^attempt seconds in between
+	log: optional ScrapeLog - bills it has already done are not fetched, and
+		every finished bill is written to it as soon as it is done
+	store: optional function called with (external_id, html) for every
+		fetched page
+
+	Returns the newly scraped records in the order of bills, without skipped
+	or failed bills
+	'''
+	if log is not None:
+		bills = [(bill_type, i) for bill_type, i in bills if '{} {}'.format(bill_type, i) not in log.done]
+
+	limiter = TokenBucket(rate)
+	semaphore = asyncio.Semaphore(concurrency)
+	connector = aiohttp.TCPConnector(limit=concurrency)
+	client_timeout = aiohttp.ClientTimeout(total=timeout)
+
+	async with aiohttp.ClientSession(connector=connector, timeout=client_timeout) as session:
+		tasks = [asyncio.ensure_future(scrape_bill(session, limiter, semaphore, base_url, bill_type, i, retries, backoff,
+											   store))
+				 for bill_type, i in bills]
+
+		start = time.time()
+		for done, task in enumerate(asyncio.as_completed(tasks), 1):
+			result = await task
+			if log is not None:
+				log.add(*result)
+			if done % 100 == 0:
+				print('{}/{} bills, {:.1f} bills/sec'.format(done, len(tasks), done / (time.time() - start)))
+
+		results = [t.result() for t in tasks]
+
+	return [record for _, status, record in results if status == 'kept']
+
+
+def session_bills(ranges=SESSION_RANGES[DEFAULT_SESSION]):
+	return [(bill_type, i) for bill_type, last in ranges for i in range(1, last + 1)]
+
+
+def session_output(output_dir, session):
+	return os.path.join(output_dir, 'ca_{}.jsonl'.format(session))
+
+
+def scrape_session(session, output_dir='.', ranges=None, base_url=base, archive=None, **kwargs):
+	'''
+	Resumably scrape one session into output_dir/ca_<session>.jsonl.
+
+	ranges: list of (bill type, last bill number), by default SESSION_RANGES
+	archive: optional PageArchive to keep the raw pages in
+	kwargs: passed on to scrape_bills
+
+	Returns number of bills still missing (failed) after this run
+	'''
+	if ranges is None:
+		if session not in SESSION_RANGES:
+			raise ValueError('No bill ranges known for session {}, pass them with --ranges'.format(session))
+		ranges = SESSION_RANGES[session]
+
+	bills = session_bills(ranges)
+	log = ScrapeLog(session_output(output_dir, session))
+	print('{}: {} of {} bills already done'.format(session, len(log.done), len(bills)))
+
+	store = None
+	if archive is not None:
+		store = lambda external_id, html: archive.put(session, external_id, html)
+
+	try:
+		asyncio.run(scrape_bills(bills, base_url + session, log=log, store=store, **kwargs))
+	finally:
+		log.close()
+
+	missing = len([b for b in bills if '{} {}'.format(*b) not in log.done])
+	print('{}: {} bills missing'.format(session, missing))
+	return missing
+
 
-			url = base + "AB{}".format(i)
+def export_pickle(output_file, pickle_file, ranges):
+	'''
+	Write the records of a session scrape as a pickled list in bill order
+	(the format of ca_senate_20152016.pkl).
+	'''
+	order = {'{} {}'.format(*b): n for n, b in enumerate(session_bills(ranges))}
+	data = sorted(read_records(output_file), key=lambda r: order.get(r['external_id'], len(order)))
 
-			r = session.get(url)
+	with open(pickle_file, 'wb') as f:
+		pickle.dump(data, f)
+	return len(data)
 
-			if '<strike/>' in str(r.html.find('#bill', first=True).raw_html):
-				print('too fancy')
-				continue
 
-			title = r.html.find('#title', first=True).text 
+def parse_ranges(values):
+	'''
+	Parse ['SB:1481', 'AB:2915'] into [('SB', 1481), ('AB', 2915)]
+	'''
+	ranges = []
+	for value in values:
+		bill_type, last = value.split(':')
+		ranges.append((bill_type, int(last)))
+	return ranges
 
-			summary = r.html.find('#digesttext', first=True).text 
 
-			text = r.html.find('#bill', first=True).text
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Scrape California bills')
+	parser.add_argument('--sessions', nargs='+', default=[DEFAULT_SESSION],
+						help='leginfo bill_id prefixes, e.g. 201520160')
+	parser.add_argument('--ranges', nargs='+',
+						help='Bill types and last bill numbers, e.g. SB:1481 AB:2915')
+	parser.add_argument('--output-dir', default='.')
+	parser.add_argument('--pickle', action='store_true',
+						help='Also export every session as a pickled list of records')
+	parser.add_argument('--archive',
+						help='Keep the raw pages in this page archive directory')
+	parser.add_argument('--base-url', default=base,
+						help='Bill page URL, without the session')
+	parser.add_argument('--concurrency', type=int, default=8,
+						help='Max requests in flight')
+	parser.add_argument('--rate', type=float, default=2.0,
+						help='Max requests per second')
+	parser.add_argument('--retries', type=int, default=3)
+	args = parser.parse_args()
 
-			text = text.replace(u'\xa0', u' ')
+	ranges = parse_ranges(args.ranges) if args.ranges else None
+	archive = PageArchive(args.archive) if args.archive else None
 
-			data.append({'summary': summary, 'text': text, 'title': title, 'external_id': 'AB {}'.format(i)})
+	for session in args.sessions:
+		scrape_session(session, args.output_dir, ranges, args.base_url, archive, concurrency=args.concurrency,
+					   rate=args.rate, retries=args.retries)
 
-		except KeyboardInterrupt:
-			raise KeyboardInterrupt
-		except:
-			print("bad bill", i)
+		if args.pickle:
+			output_file = session_output(args.output_dir, session)
+			n = export_pickle(output_file, os.path.splitext(output_file)[0] + '.pkl',
+							  ranges or SESSION_RANGES[session])
+			print('{}: exported {} bills'.format(session, n))
 
-finally:
-	pickle.dump(data, open('ca_senate_20152016.pkl', 'wb'))
\ No newline at end of file
+	if archive is not None:
+		archive.close()
@@ -0,0 +1,116 @@
+'''
+Manifest of the input files behind every prepared bill.
+
+prepare_dataset.py stores one manifest next to each session output, so that
+re-runs only prepare the bills whose metadata or latest text version changed.
+
+A manifest maps bill_dir -> entry, where entry is a dict with
+    files: [data file, text xml, text html] fingerprints, each [path, mtime, size, sha1] or None
+    bill_id: id of the resulting record
+    status: 'kept', 'skipped' or 'error' (with the message under 'error')
+    offset, length: byte span of the record in the session output (kept bills only)
+
+Next to the bills, the manifest records the size and sha1 of the output it
+was written with. A manifest whose output was since rewritten, e.g. by a
+non-incremental run, no longer matches and is ignored.
+'''
+import hashlib
+import json
+import os
+
+
+def manifest_path(output_file):
+    return os.path.splitext(output_file)[0] + '.manifest.json'
+
+
+def load_manifest(output_file, version):
+    '''
+    Load the manifest for a session output file.
+
+    Returns an empty manifest if there is none, if it was written by a
+    different version of the preparation code or if the output it describes
+    is gone or changed - all bills are then prepared again.
+    '''
+    path = manifest_path(output_file)
+    if not os.path.isfile(path) or not os.path.isfile(output_file):
+        return {}
+
+    with open(path) as f:
+        manifest = json.load(f)
+
+    if manifest.get('version') != version:
+        return {}
+    if manifest.get('output_size') != os.path.getsize(output_file):
+        return {}
+    if manifest.get('output_sha1') != file_sha1(output_file):
+        return {}
+    return manifest['bills']
+
+
+def save_manifest(output_file, bills, version):
+    '''
+    Write the manifest atomically, so an interrupted run never leaves a
+    manifest that disagrees with the output.
+    '''
+    path = manifest_path(output_file)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'version': version, 'output_size': os.path.getsize(output_file),
+                   'output_sha1': file_sha1(output_file), 'bills': bills}, f)
+    os.replace(tmp_path, path)
+
+
+def remove_manifest(output_file):
+    '''
+    Remove the manifest of an output that is about to be rewritten without one.
+    '''
+    try:
+        os.remove(manifest_path(output_file))
+    except FileNotFoundError:
+        pass
+
+
+def file_sha1(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def file_fingerprint(path, previous=None):
+    '''
+    Fingerprint a file as [path, mtime, size, sha1].
+
+    The content hash is only computed when the path, mtime or size differ
+    from the previous fingerprint - an unchanged file costs one stat call.
+    '''
+    st = os.stat(path)
+    if previous is not None and previous[:3] == [path, st.st_mtime, st.st_size]:
+        return previous
+
+    with open(path, 'rb') as f:
+        sha1 = hashlib.sha1(f.read()).hexdigest()
+    return [path, st.st_mtime, st.st_size, sha1]
+
+
+def fingerprint_files(paths, previous=None):
+    '''
+    Fingerprint a list of paths (None for a missing file), reusing hashes
+    from the matching previous fingerprints where possible.
+    '''
+    if previous is None or len(previous) != len(paths):
+        previous = [None] * len(paths)
+
+    return [None if p is None else file_fingerprint(p, prev)
+            for p, prev in zip(paths, previous)]
+
+
+def same_files(files, other):
+    '''
+    Two fingerprint lists describe the same inputs if paths and content match.
+    A touched but otherwise identical file does not count as a change.
+    '''
+    def key(fp):
+        return None if fp is None else (fp[0], fp[3])
+    return [key(f) for f in files] == [key(f) for f in other]
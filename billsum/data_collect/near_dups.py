@@ -0,0 +1,180 @@
+'''
+Near-duplicate detection for bill texts with MinHash and LSH.
+
+Bills are reintroduced across sessions with nearly identical texts. Every
+text is reduced to a MinHash signature of its word shingles, and the
+signatures are banded into LSH buckets, so that a new bill is only compared
+with the bills that share a bucket with it.
+
+The index is built incrementally: the first bill of a group of near
+duplicates is its canonical bill, and later bills point to it.
+'''
+import json
+import re
+import zlib
+
+import numpy as np
+
+WORD_RE = re.compile(r'\w+')
+
+# Prime modulus of the hash family - every hash value fits in 31 bits, so
+# a * x + b stays within uint64 for 32 bit shingle hashes
+PRIME = (1 << 31) - 1
+
+DEDUP_MODES = ('drop', 'tag', 'canonical')
+
+
+def shingle_hashes(text, k=5):
+    '''
+    32 bit hashes of the distinct k-word shingles of a text (lowercased).
+    '''
+    words = WORD_RE.findall(text.lower())
+    if len(words) < k:
+        words = words + [''] * (k - len(words))
+
+    shingles = set(' '.join(words[i:i + k]) for i in range(len(words) - k + 1))
+    return np.array([zlib.crc32(s.encode('utf-8')) for s in shingles], dtype=np.uint64)
+
+
+class MinHasher:
+    '''
+    MinHash signatures with num_perm hash functions of the form
+    (a * x + b) mod PRIME, drawn from a fixed seed so that signatures are
+    comparable across runs.
+    '''
+
+    def __init__(self, num_perm=128, k=5, seed=1):
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, PRIME, size=num_perm).astype(np.uint64)
+        self.b = rng.randint(0, PRIME, size=num_perm).astype(np.uint64)
+        self.num_perm = num_perm
+        self.k = k
+
+    def signature(self, text):
+        hashes = shingle_hashes(text, self.k)
+
+        # In chunks, to bound memory on very long bills
+        sig = np.full(self.num_perm, PRIME, dtype=np.uint64)
+        for i in range(0, len(hashes), 4096):
+            chunk = (np.outer(hashes[i:i + 4096], self.a) + self.b) % PRIME
+            sig = np.minimum(sig, chunk.min(axis=0))
+        return sig
+
+
+def estimate_similarity(sig1, sig2):
+    '''
+    Estimated Jaccard similarity of the shingle sets behind two signatures.
+    '''
+    return float(np.mean(sig1 == sig2))
+
+
+class NearDupIndex:
+    '''
+    LSH index of MinHash signatures.
+
+    threshold: estimated Jaccard similarity above which two bills are near
+        duplicates
+    bands: number of LSH bands - num_perm / bands rows each. Candidates from
+        the buckets are checked against the threshold, so bands only trades
+        speed against recall.
+    '''
+
+    def __init__(self, threshold=0.8, num_perm=128, bands=16, k=5, seed=1):
+        if num_perm % bands != 0:
+            raise ValueError('num_perm must be a multiple of bands')
+
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm, k, seed)
+
+        self.buckets = [{} for _ in range(bands)]
+        self.signatures = {}
+        self.canonical = {}
+
+    def _band_keys(self, sig):
+        return [sig[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def query(self, sig):
+        '''
+        Keys of the indexed bills whose estimated similarity to sig is at
+        least the threshold, in the order they were added.
+        '''
+        candidates = set()
+        for bucket, key in zip(self.buckets, self._band_keys(sig)):
+            candidates.update(bucket.get(key, ()))
+
+        order = sorted(candidates, key=lambda c: self.signatures[c][0])
+        return [c for c in order if estimate_similarity(sig, self.signatures[c][1]) >= self.threshold]
+
+    def add(self, key, text):
+        '''
+        Add a bill to the index.
+
+        Returns the key of its canonical bill - the key itself unless an
+        earlier bill is a near duplicate, in which case the canonical bill of
+        the earliest such bill.
+        '''
+        if key in self.canonical:
+            return self.canonical[key]
+
+        sig = self.hasher.signature(text)
+        matches = self.query(sig)
+        canonical = self.canonical[matches[0]] if matches else key
+
+        self.signatures[key] = (len(self.signatures), sig)
+        self.canonical[key] = canonical
+        for bucket, band_key in zip(self.buckets, self._band_keys(sig)):
+            bucket.setdefault(band_key, []).append(key)
+
+        return canonical
+
+    def clusters(self):
+        '''
+        dict of canonical key -> list of keys of its near duplicates (the
+        canonical key first), for groups with more than one bill.
+        '''
+        groups = {}
+        for key, canonical in self.canonical.items():
+            groups.setdefault(canonical, []).append(key)
+        return {c: keys for c, keys in groups.items() if len(keys) > 1}
+
+    def save(self, path):
+        '''
+        Write one [bill_id, canonical bill_id] line per bill.
+        '''
+        with open(path, 'w') as f:
+            for key, canonical in self.canonical.items():
+                f.write(json.dumps([key, canonical]) + '\n')
+
+
+def load_canonical(path):
+    '''
+    Read a file written by NearDupIndex.save into a dict of bill_id ->
+    canonical bill_id.
+    '''
+    with open(path) as f:
+        return dict(json.loads(line) for line in f)
+
+
+def apply_dedup(record, canonical, mode):
+    '''
+    Apply a dedup mode to a prepared record whose canonical bill is
+    canonical.
+
+    Returns the record to write, or None if it is dropped:
+        drop: near duplicates are dropped
+        tag: every record gets a cluster_id (the bill_id of its canonical bill)
+        canonical: near duplicates get a canonical_id pointing to their
+            canonical bill
+    '''
+    if mode not in DEDUP_MODES:
+        raise ValueError('Unknown dedup mode {}'.format(mode))
+
+    if mode == 'tag':
+        record['cluster_id'] = canonical
+    elif canonical != record['bill_id']:
+        if mode == 'drop':
+            return None
+        record['canonical_id'] = canonical
+    return record
@@ -0,0 +1,92 @@
+'''
+Content-addressed archive of raw scraped pages.
+
+An archive directory holds
+    objects/ab/cdef....html.gz  (one gzip file per distinct page, named by the sha1 of its bytes)
+    index.jsonl  (one [session, external_id, sha1] per fetched page, in fetch order)
+
+A page that is fetched again with the same content is stored once. If a
+bill is fetched several times, its last index entry wins.
+'''
+from collections import OrderedDict
+import gzip
+import hashlib
+import json
+import os
+
+
+class PageArchive:
+
+    def __init__(self, root):
+        self.root = root
+        self.index_file = os.path.join(root, 'index.jsonl')
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        self._index = None
+
+    def object_path(self, sha1):
+        return os.path.join(self.root, 'objects', sha1[:2], sha1[2:] + '.html.gz')
+
+    def put(self, session, external_id, html):
+        '''
+        Store the raw bytes of a page and record it in the index.
+
+        Returns the sha1 of the page
+        '''
+        sha1 = hashlib.sha1(html).hexdigest()
+        path = self.object_path(sha1)
+
+        if not os.path.isfile(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+            with open(tmp_path, 'wb') as f:
+                f.write(gzip.compress(html, mtime=0))
+            os.replace(tmp_path, path)
+
+        if self._index is None:
+            self._open_index()
+        self._index.write(json.dumps([session, external_id, sha1]) + '\n')
+        self._index.flush()
+
+        return sha1
+
+    def _open_index(self):
+        # Drop a partly written last line left by a crash before appending
+        if os.path.isfile(self.index_file):
+            with open(self.index_file, 'rb+') as f:
+                data = f.read()
+                if data and not data.endswith(b'\n'):
+                    f.truncate(data.rfind(b'\n') + 1)
+        self._index = open(self.index_file, 'a')
+
+    def get(self, sha1):
+        with open(self.object_path(sha1), 'rb') as f:
+            return gzip.decompress(f.read())
+
+    def pages(self, session=None):
+        '''
+        Latest page of every bill.
+
+        Returns OrderedDict of (session, external_id) -> sha1, in the order
+        the bills were first fetched
+        '''
+        pages = OrderedDict()
+        if not os.path.isfile(self.index_file):
+            return pages
+
+        with open(self.index_file) as f:
+            for line in f:
+                # A crash can leave a partly written last line
+                if not line.endswith('\n'):
+                    break
+                ses, external_id, sha1 = json.loads(line)
+                if session is None or ses == session:
+                    pages[(ses, external_id)] = sha1
+        return pages
+
+    def sessions(self):
+        return sorted(set(ses for ses, _ in self.pages()))
+
+    def close(self):
+        if self._index is not None:
+            self._index.close()
+            self._index = None
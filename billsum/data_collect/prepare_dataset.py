@@ -1,14 +1,34 @@
+import argparse
+from collections import Counter
 import json
 import jsonlines
-import numpy as np
+import multiprocessing
 import re
 import os
+import time
 import xml.etree.ElementTree as ET
 
+from billsum.data_collect.bill_catalog import open_catalog, select_bills
+from billsum.data_collect.manifest import fingerprint_files, load_manifest, remove_manifest, same_files, save_manifest
+from billsum.data_collect.near_dups import DEDUP_MODES, NearDupIndex, apply_dedup
+from billsum.data_collect.shards import ShardWriter
+from billsum.data_collect.text_versions import pick_latest_version
+
 # Text Length Cut-offs for the dataset
 MIN_TEXT_LENGTH = 2000
 MAX_TEXT_LENGTH = 20000
 
+# Bump whenever prepare_bill produces different records, so incremental runs
+# prepare every bill again
+PREPARE_VERSION = 2
+
+# Counted outcomes of a bill that are not errors
+OUTCOMES = ('kept', 'skipped', 'unchanged', 'duplicates')
+
+# Change to your prefix
+DATA_PATH = '/data/final_data/congress/{}/bills/'
+OUTPUT_PATH = '/data/final_data/final/final_data_{}.jsonl'
+
 
 cleanr = re.compile('<.*?>')
 def clean_html(raw_html):
@@ -45,7 +65,7 @@ def extract_data_xml(bill_data):
         bill_data = bill_data.find('bill')
 
     # First find the title 
-    latest_title = bill_data.find('titles').getchildren()[-1]
+    latest_title = list(bill_data.find('titles'))[-1]
     if latest_title.tag == 'item':
 
         title = latest_title.find('title').text
@@ -74,6 +94,117 @@ def extract_data_xml(bill_data):
     return {'title': title, 'summary': summary}
 
 
+def extract_data_xml_stream(source):
+    '''
+    Streaming version of extract_data_xml - same output, but reads the file
+    with iterparse and only keeps the latest title and the latest summary.
+    Every other element (actions, committees, ...) is dropped as soon as it
+    has been parsed, so memory stays flat however large the file is.
+
+    source: path or file object of a data.xml / billStatus file
+
+    Returns dict of title and summary
+    '''
+    stack = []
+    bill = None
+    titles = None
+    summary_elem = None
+    summaries = None
+    bill_summaries = None
+    summaries_has_children = False
+
+    # Items of titles / billSummaries are kept whole until they end, since
+    # we need their children. protected is the depth of the current item.
+    protected = None
+
+    bill_status = False
+    ended = set()
+    has_title = False
+    title = None
+    summary = None
+    latest_summary = None
+
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            parent = stack[-1] if stack else None
+            stack.append(elem)
+
+            if parent is None:
+                bill_status = elem.tag == 'billStatus'
+                if not bill_status:
+                    bill = elem
+            elif parent is stack[0] and bill is None and elem.tag == 'bill':
+                bill = elem
+            elif parent is bill:
+                if elem.tag == 'titles' and titles is None:
+                    titles = elem
+                elif elem.tag == 'summary' and summary_elem is None:
+                    summary_elem = elem
+                elif elem.tag == 'summaries' and summaries is None:
+                    summaries = elem
+            elif parent is titles:
+                protected = len(stack)
+            elif parent is summaries:
+                summaries_has_children = True
+                if elem.tag == 'billSummaries' and bill_summaries is None:
+                    bill_summaries = elem
+            elif parent is bill_summaries and elem.tag == 'item':
+                protected = len(stack)
+            continue
+
+        depth = len(stack)
+        stack.pop()
+        parent = stack[-1] if stack else None
+
+        if protected is not None and depth > protected:
+            continue
+
+        # titles and bill_summaries are None until found, like the parent of the root
+        if titles is not None and parent is titles:
+            if elem.tag == 'item':
+                t = elem.find('title')
+                title = t.text if t is not None else None
+            else:
+                title = elem.text
+            has_title = True
+            protected = None
+        elif bill_summaries is not None and parent is bill_summaries and elem.tag == 'item':
+            t = elem.find('text')
+            latest_summary = t.text if t is not None else None
+            protected = None
+        elif elem is summary_elem:
+            summary = elem.text
+
+        # Done with this element - drop it. Earlier siblings are already gone,
+        # so this is cheap.
+        if parent is not None:
+            parent.remove(elem)
+
+        # Stop reading as soon as nothing later in the file can change the
+        # result. billStatus files never have a summary element, so for them
+        # the titles and summaries are enough.
+        if elem is titles or elem is summary_elem or elem is summaries:
+            ended.add(elem.tag)
+            if 'titles' in ended and ('summary' in ended or
+                                      ('summaries' in ended and bill_status)):
+                break
+
+    if bill is None:
+        raise ValueError('No bill in data file')
+    if not has_title:
+        raise ValueError('No title for bill')
+
+    # Two possible structures - we check which one applies
+    if summary_elem is None and summaries_has_children:
+        summary = latest_summary
+
+    # Clean up summary
+    if summary is not None:
+        summary = clean_summary(summary)
+
+    return {'title': title, 'summary': summary}
+
+
 def extract_data_json(data):
     '''
     Extract latest summary from a bill data json.
@@ -104,17 +235,10 @@ def find_latest_text(bill_dir):
 
     Returns path to best subdir
     '''
-
-    house_order = ['ih', 'rth', 'rh', 'rfh','rch', 'eh', 'ath', 'pcs', 'hds', 'rds', 'rfs', 'rs', 'rs2', 'rcs', 'es', 'ats', 'cps', 'enr', 'pp']
-    senate_order = [ 'is',  'rds', 'rfs', 'rs', 'rs2', 'rcs', 'es', 'ats', 'cps', 'ih', 'rth', 'rh', 'rfh','rch', 'eh', 'ath', 'enr', 'pp']
-    
     versions = os.listdir(os.path.join(bill_dir, 'text-versions'))
+    best = pick_latest_version(versions, 'bills/h' in bill_dir)
 
-    cur_order = house_order if 'bills/h' in bill_dir else senate_order
-    idxs = [cur_order.index(d) if d in cur_order else -1 for d in versions]
-    best = np.argmax(idxs)
-
-    return os.path.join(bill_dir, 'text-versions', versions[best])
+    return os.path.join(bill_dir, 'text-versions', best)
 
 def prepare_html_text(html_text):
     '''
@@ -155,110 +279,578 @@ def prepare_html_text(html_text):
 
     return text
 
-def prepare_bill(bill_dir, session):
+# Marks the start of a section in texts prepared from the bill XML. clean_text
+# keeps it as is, instead of finding section headers with regexes.
+SECTION_MARK = '<SECTION-HEADER>'
+
+# Elements of the bill XML that are not part of the text
+XML_SKIP_TAGS = {'enum', 'toc', 'metadata', 'form'}
+
+# Elements whose text is one block of the bill text
+XML_BLOCK_TAGS = {'header', 'text', 'continuation-text', 'quoted-block-continuation-text', 'after-quoted-block'}
+
+
+def _local_name(tag):
+    # Strip the namespace of USLM style documents
+    return tag.rsplit('}', 1)[-1]
+
+
+def _xml_block_text(elem):
+    return ' '.join(''.join(elem.itertext()).split())
+
+
+def _xml_body_lines(elems, lines, quoted=False):
+    '''
+    Walk the body of a bill and collect its text, one line per block.
+
+    Every section starts with a SECTION_MARK line holding the section header.
+    Enumerations (section numbers and bullets) and tables of contents are left
+    out. Sections inside quoted blocks (quoted law) are not marked.
+    '''
+    for child in elems:
+        tag = _local_name(child.tag)
+        if tag in XML_SKIP_TAGS:
+            continue
+
+        if tag == 'section' and not quoted:
+            header = ''
+            for sub in child:
+                if _local_name(sub.tag) == 'header':
+                    header = _xml_block_text(sub)
+                    break
+
+            if header and not header.endswith('.'):
+                header += '.'
+            lines.append((SECTION_MARK + ' ' + header).strip())
+
+            _xml_body_lines([sub for sub in child if _local_name(sub.tag) != 'header'], lines, quoted)
+        elif tag in XML_BLOCK_TAGS or len(child) == 0:
+            block = _xml_block_text(child)
+            if block:
+                lines.append(block)
+        else:
+            _xml_body_lines(child, lines, quoted or tag == 'quoted-block')
+
+
+def prepare_xml_text(source):
+    '''
+    Takes in bill xml (document.xml) and prepares the final text block, with a
+    SECTION_MARK at the start of every section.
+
+    Only the body of the bill is used, so unlike the html there is no metadata
+    to cut off.
+    '''
+    root = ET.parse(source).getroot()
+
+    body = None
+    for elem in root.iter():
+        if _local_name(elem.tag) in ('legis-body', 'resolution-body'):
+            body = elem
+            break
+    if body is None:
+        raise ValueError('No body in bill XML')
+
+    lines = []
+    _xml_body_lines(body, lines)
+
+    text = '\n'.join(lines).strip()
+    if not text:
+        raise ValueError('No text in bill XML')
+    return text
+
+
+def version_text_files(version_dir):
+    '''
+    Paths of document.xml and document.html of a text version, with None for
+    a missing file.
+    '''
+    return [path if os.path.isfile(path) else None
+            for path in (os.path.join(version_dir, 'document.xml'), os.path.join(version_dir, 'document.html'))]
+
+
+def read_bill_data(data_file, open_file=open):
+    '''
+    Extract title and summary from a data.json or data.xml file.
+
+    open_file: function to open the file with, called as open_file(path, mode).
+        Lets the file come from somewhere else than the local disk.
+    '''
+    if data_file.endswith('.json'):
+        with open_file(data_file, 'r') as reader:
+            data = json.load(reader)
+        return extract_data_json(data)
+
+    with open_file(data_file, 'rb') as reader:
+        return extract_data_xml_stream(reader)
+
+
+def read_bill_text(text_file, open_file=open):
+    '''
+    Read a document.html or document.xml file and prepare the final text block.
+    '''
+    if text_file.endswith('.xml'):
+        with open_file(text_file, 'rb') as reader:
+            return prepare_xml_text(reader)
+
+    with open_file(text_file, 'r') as reader:
+        t = reader.read()
+        text = prepare_html_text(t)
+
+        # If to short or too long, dont return the text
+        # if len(text) < MIN_TEXT_LENGTH or len(text) > MAX_TEXT_LENGTH:
+
+        #     text = None
+
+    return text
+
+
+def read_latest_text(xml_file, html_file, open_file=open):
+    '''
+    Prepare the text of a bill from the xml of its latest version, falling
+    back to the html if there is no usable xml.
+    '''
+    if xml_file is not None:
+        try:
+            return read_bill_text(xml_file, open_file)
+        except (ET.ParseError, ValueError) as e:
+            if html_file is None:
+                raise ValueError('Bad bill XML') from e
+
+    if html_file is None:
+        raise ValueError('No text for bill')
+    return read_bill_text(html_file, open_file)
+
+
+def prepare_bill(bill_dir, session, bill_info=None):
     '''
     Take in a bill directory with all bill data and return a dict with the 
     bill_id, title, summary, text.
 
     Takes in session to make a more specific billid
+
+    bill_info: optional catalog entry of the bill (see bill_catalog.py). The
+        data and text files are then taken from the catalog instead of
+        being looked up in the bill directory.
     '''
     print(bill_dir)
-    # # Extract basic bill data
-    # if os.path.isfile(os.path.join(bill_dir, 'data.json')):
-    #     data = json.load(open(os.path.join(bill_dir, 'data.json')))
-    #     final_data = extract_data_json(data)
-
-    # elif os.path.isfile(os.path.join(bill_dir, 'data.xml')):
-    #     f = os.path.join(bill_dir, 'data.xml')
-    #     bill_data = ET.parse(f).getroot()
-    #     final_data = extract_data_xml(bill_data)
-    # else:
-    #     raise ValueError('No data file for bill ')
 
     final_data = {}
 
-    # Extract basic bill data
-    if os.path.isfile(os.path.join(bill_dir, 'data.json')):
-        data = json.load(open(os.path.join(bill_dir, 'data.json')))
-        final_data = extract_data_json(data)
+    if bill_info is not None:
+        data_file = bill_info['data_path']
+    elif os.path.isfile(os.path.join(bill_dir, 'data.json')):
+        data_file = os.path.join(bill_dir, 'data.json')
     elif os.path.isfile(os.path.join(bill_dir, 'data.xml')):
-        f = os.path.join(bill_dir, 'data.xml')
-        bill_data = ET.parse(f).getroot()
-        final_data = extract_data_xml(bill_data)
+        data_file = os.path.join(bill_dir, 'data.xml')
     else:
+        data_file = None
+
+    # Extract basic bill data
+    if data_file is None:
         raise ValueError('No data file for bill ')
+    final_data = read_bill_data(data_file)
 
     # Get the bill id from the path - its the final subfolder
     billid = os.path.basename(os.path.normpath(bill_dir))
     final_data['bill_id'] = str(session) + '_' + billid 
 
-    # Next get the text 
-    f = os.path.join(bill_dir, 'text-versions')
+    # Next get the text - from the xml of the latest version where there is one
+    if bill_info is not None:
+        if not bill_info['has_text_versions']:
+            raise ValueError('No text for bill')
+        xml_file = bill_info.get('text_xml_path')
+        text_file = bill_info['text_path']
+    else:
+        f = os.path.join(bill_dir, 'text-versions')
 
-    if not os.path.isdir(f):
-        raise ValueError('No text for bill')
+        if not os.path.isdir(f):
+            raise ValueError('No text for bill')
 
-    # Figure out which text version is the latest
-    latest_version = find_latest_text(bill_dir)
-    text_file = os.path.join(latest_version, 'document.html')
-    
-    if not os.path.isfile(text_file):
-        raise ValueError('No text for bill')
+        # Figure out which text version is the latest
+        latest_version = find_latest_text(bill_dir)
+        xml_file, text_file = version_text_files(latest_version)
 
-    with open(text_file) as reader:
-        t = reader.read()
-        text = prepare_html_text(t)
+    final_data['text'] = read_latest_text(xml_file, text_file)
 
-        # If to short or too long, dont return the text
-        # if len(text) < MIN_TEXT_LENGTH or len(text) > MAX_TEXT_LENGTH:
+    return final_data
 
-        #     text = None
 
-        final_data['text'] = text
+def list_bill_dirs(path):
+    '''
+    Yield every bill directory under a session's bills/ folder, in the order
+    the ingestion visits them. Resolutions are skipped.
+    '''
+    for btype in os.listdir(path):
+        if '.DS_Store' in btype:
+            continue
+        subpath = os.path.join(path, btype)
+        if 'res' in btype:
+            continue
+
+        for file in os.listdir(subpath):
+            billpath = os.path.join(subpath, file)
 
-    return final_data
+            if os.path.isdir(billpath):
+                yield billpath
 
 
-if __name__ == '__main__':
-    for ses in range(107, 113):
+def bill_input_files(bill_dir, bill_info=None):
+    '''
+    Paths of the metadata file and the latest text files (xml and html)
+    prepare_bill reads for a bill, with None for a file that is missing.
+    '''
+    if bill_info is not None:
+        return [bill_info['data_path'], bill_info.get('text_xml_path'), bill_info['text_path']]
+
+    data_file = None
+    for name in ('data.json', 'data.xml'):
+        if os.path.isfile(os.path.join(bill_dir, name)):
+            data_file = os.path.join(bill_dir, name)
+            break
+
+    text_files = [None, None]
+    if os.path.isdir(os.path.join(bill_dir, 'text-versions')):
+        try:
+            text_files = version_text_files(find_latest_text(bill_dir))
+        except ValueError:
+            # No versions at all
+            pass
+
+    return [data_file] + text_files
+
+
+def ingest_bill(task):
+    '''
+    Run prepare_bill on a (bill_dir, session, catalog entry or None) triple.
+    Picklable, so it can be used as a pool worker.
+
+    Returns (session, bill_dir, status, payload) where status is 'kept' (payload
+    is the record), 'skipped' (no summary or text) or 'error' (payload is the
+    error message).
+    '''
+    billpath, ses, bill_info = task
+    try:
+        bd = prepare_bill(billpath, ses, bill_info)
+    except ValueError as e:
+        return ses, billpath, 'error', str(e)
+
+    if bd.get('summary') is not None and bd.get('text') is not None:
+        return ses, billpath, 'kept', bd
+    return ses, billpath, 'skipped', None
+
+
+def ingest_bill_incremental(task):
+    '''
+    Same as ingest_bill, with the previous manifest entry of the bill as a
+    fourth item of the task, but the bill is only prepared if its input files changed since the
+    previous run. Unchanged bills come back with status 'unchanged'.
+
+    Returns (session, bill_dir, status, payload, entry) where entry is the new
+    manifest entry of the bill.
+    '''
+    billpath, ses, bill_info, previous = task
+    files = fingerprint_files(bill_input_files(billpath, bill_info),
+                              previous['files'] if previous else None)
+
+    if previous is not None and same_files(files, previous['files']):
+        entry = dict(previous, files=files)
+        return ses, billpath, 'unchanged', None, entry
+
+    ses, billpath, status, payload = ingest_bill((billpath, ses, bill_info))
+
+    billid = os.path.basename(os.path.normpath(billpath))
+    entry = {'files': files, 'bill_id': str(ses) + '_' + billid, 'status': status}
+    if status == 'error':
+        entry['error'] = payload
 
-        # Change to your prefix
-        path = '/data/final_data/congress/{}/bills/'.format(ses)
+    return ses, billpath, status, payload, entry
 
-        final_dataset = []
-        i = 0
-        j = 0
-        z = 0
-        for btype in os.listdir(path):
-            if '.DS_Store' in btype:
-                continue
-            subpath = os.path.join(path, btype)
-            if 'res' in btype:
-                continue
 
-            for file in os.listdir(subpath):
-                
-                billpath = os.path.join(subpath, file)
+class SessionOutput:
+    '''
+    The jsonl output of one session.
+
+    In incremental mode the records are first written to a temporary file,
+    which replaces the previous output (together with the new manifest) once
+    the session is complete. Records of unchanged bills are copied over from
+    the previous output as raw bytes.
 
-                if  os.path.isdir(billpath):
-                    try:
-                        bd = prepare_bill(billpath, ses)
-                        if bd.get('summary') is not None and bd.get('text') is not None:
-                            final_dataset.append(bd)
-                            i += 1
+    With shard_size set the records go to compressed shards with a bill_id
+    index instead (see shards.py), named after the output file.
+    '''
 
-                        else:
-                            j += 1
-                    except ValueError as e:
-                        print(e, file)
-                        z += 1
+    def __init__(self, output_file, incremental=False, previous_manifest=None, shard_size=None):
+        self.output_file = output_file
+        self.incremental = incremental
+        self.manifest = {}
+        self.previous = None
+        self.shards = None
+
+        if shard_size is not None:
+            # Rejected up front by ingest_sessions
+            assert not incremental, 'Incremental runs can not write sharded outputs'
+            self.shards = ShardWriter(os.path.splitext(output_file)[0], shard_size)
+            return
+
+        if incremental:
+            self.f = open(output_file + '.tmp', 'wb')
+            if previous_manifest:
+                self.previous = open(output_file, 'rb')
+        else:
+            # The manifest of a previous incremental run no longer describes it
+            remove_manifest(output_file)
+            self.f = open(output_file, 'wb')
+
+        self.writer = jsonlines.Writer(self.f)
+
+    def write(self, billpath, record, entry=None):
+        if self.shards is not None:
+            if record is not None:
+                self.shards.write(record)
+            return
+
+        offset = self.f.tell()
+        if record is not None:
+            self.writer.write(record)
+        elif entry is not None and entry['status'] == 'kept':
+            self.previous.seek(entry['offset'])
+            self.f.write(self.previous.read(entry['length']))
+
+        if entry is not None:
+            if entry['status'] == 'kept':
+                entry['offset'] = offset
+                entry['length'] = self.f.tell() - offset
+            self.manifest[billpath] = entry
+
+    def close(self):
+        if self.shards is not None:
+            self.shards.close()
+            return
+
+        self.writer.close()
+        self.f.close()
+        if self.previous is not None:
+            self.previous.close()
+
+        if self.incremental:
+            os.replace(self.output_file + '.tmp', self.output_file)
+            save_manifest(self.output_file, self.manifest, PREPARE_VERSION)
+
+
+def ingest_sessions(sessions, data_path=DATA_PATH, output_path=OUTPUT_PATH,
+                    workers=1, chunksize=16, incremental=False, catalog=None,
+                    shard_size=None, dedup=None, dedup_path=None):
+    '''
+    Prepare every bill of the given sessions and stream the usable records into
+    one jsonl file per session.
 
-        print(j, i, z)
+    With workers > 1 the bills of all sessions are fanned out over a process
+    pool. Results are consumed in submission order, so the files are identical
+    to the ones written by a serial run.
 
-        with open('/data/final_data/final/final_data_{}.jsonl'.format(ses), 'w') as f:
+    With incremental=True a manifest of the input files of every bill is kept
+    next to each output (see manifest.py). Bills whose metadata and latest text
+    version did not change since the last run are not prepared again, their
+    records are copied from the previous output.
 
-            writer = jsonlines.Writer(f)
-            writer.write_all(final_dataset)
+    catalog: optional path to a bill catalog (see bill_catalog.py). The bills
+    and their files are then taken from the catalog instead of listing the
+    data directories.
 
+    shard_size: write compressed shards of this many records with a bill_id
+        index instead of one jsonl per session (see shards.py)
 
-                    
+    dedup: 'drop', 'tag' or 'canonical' to find near-duplicate texts across
+        all sessions while ingesting (see near_dups.py) and drop them, tag
+        every record with a cluster_id or point duplicates to their
+        canonical bill with a canonical_id
+    dedup_path: optional path to save the bill_id -> canonical bill_id map to
+
+    Returns dict of session -> Counter with 'kept', 'skipped', 'unchanged',
+    'duplicates' and one entry per error message.
+    '''
+    # Checked before any bill is listed or the pool started
+    if incremental and dedup is not None:
+        # Unchanged records are copied without being read, so they can not be
+        # compared
+        raise ValueError('Incremental runs can not deduplicate')
+    if incremental and shard_size is not None:
+        # Unchanged records are copied from the previous jsonl output
+        raise ValueError('Incremental runs can not write sharded outputs')
+
+    if catalog is not None:
+        # Read up front - the pool feeds tasks from another thread, which
+        # can not use the sqlite connection
+        conn = open_catalog(catalog)
+        bills = [(info['bill_dir'], ses, info) for ses in sessions
+                 for info in select_bills(conn, session=ses)]
+        conn.close()
+    else:
+        bills = ((billpath, ses, None) for ses in sessions
+                 for billpath in list_bill_dirs(data_path.format(ses)))
+
+    if incremental:
+        manifests = {ses: load_manifest(output_path.format(ses), PREPARE_VERSION)
+                     for ses in sessions}
+        tasks = ((billpath, ses, bill_info, manifests[ses].get(billpath))
+                 for billpath, ses, bill_info in bills)
+        worker = ingest_bill_incremental
+    else:
+        manifests = {}
+        tasks = bills
+        worker = ingest_bill
+
+    return run_ingestion(worker, tasks, sessions, output_path, workers, chunksize,
+                         incremental, manifests, shard_size, dedup, dedup_path)
+
+
+def run_ingestion(worker, tasks, sessions, output_path, workers=1, chunksize=16,
+                  incremental=False, manifests=None, shard_size=None, dedup=None, dedup_path=None):
+    '''
+    Run worker over the tasks, on a process pool if workers > 1, and stream
+    the results into one jsonl per session.
+
+    worker: returns results in the format of ingest_bill (or
+        ingest_bill_incremental in incremental mode)
+    tasks: must be ordered by session, in the same order as sessions
+    manifests: dict of session -> previous manifest, for incremental mode
+    shard_size: write sharded outputs, see ingest_sessions
+    dedup, dedup_path: near-duplicate handling, see ingest_sessions
+
+    Returns dict of session -> Counter of outcomes
+    '''
+    if manifests is None:
+        manifests = {}
+
+    index = None
+    if dedup is not None:
+        if dedup not in DEDUP_MODES:
+            raise ValueError('Unknown dedup mode {}'.format(dedup))
+        index = NearDupIndex()
+
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap(worker, tasks, chunksize)
+    else:
+        results = map(worker, tasks)
+
+    stats = {ses: Counter() for ses in sessions}
+    pending = list(sessions)
+    cur_ses = None
+    output = None
+    total = 0
+    start = time.time()
+
+    def open_session(ses):
+        return SessionOutput(output_path.format(ses), incremental, manifests.get(ses), shard_size)
+
+    def finish_session():
+        if output is not None:
+            output.close()
+            counts = stats[cur_ses]
+            errors = sum(v for k, v in counts.items() if k not in OUTCOMES)
+            print(cur_ses, 'skipped:', counts['skipped'], 'kept:', counts['kept'], 'errors:', errors,
+                  'unchanged:', counts['unchanged'], 'duplicates:', counts['duplicates'])
+
+    try:
+        for result in results:
+            ses, billpath, status, payload = result[:4]
+            entry = result[4] if incremental else None
+
+            # Sessions come back in order - move the output to the next one.
+            # Sessions without any bills still get an (empty) file.
+            while ses != cur_ses:
+                finish_session()
+                cur_ses = pending.pop(0)
+                output = open_session(cur_ses)
+
+            if status == 'unchanged':
+                stats[ses]['unchanged'] += 1
+                status = entry['status']
+                payload = entry.get('error')
+
+            if status == 'kept':
+                # Unchanged bills come with no payload and are copied from the
+                # previous output - dedup never runs in incremental mode
+                write = True
+                if index is not None:
+                    canonical = index.add(payload['bill_id'], payload['text'])
+                    if canonical != payload['bill_id']:
+                        stats[ses]['duplicates'] += 1
+                    write = apply_dedup(payload, canonical, dedup) is not None
+
+                # Dropped duplicates are only counted under 'duplicates'
+                if write:
+                    output.write(billpath, payload, entry)
+                    stats[ses]['kept'] += 1
+            elif status == 'skipped':
+                output.write(billpath, None, entry)
+                stats[ses]['skipped'] += 1
+            else:
+                output.write(billpath, None, entry)
+                print(payload, os.path.basename(billpath))
+                stats[ses][payload] += 1
+
+            total += 1
+            if total % 1000 == 0:
+                print('Processed {} bills, {:.1f} bills/sec'.format(total, total / (time.time() - start)))
+
+        finish_session()
+        output = None
+        for ses in pending:
+            open_session(ses).close()
+    except BaseException:
+        # Do not wait for the bills still queued on the pool
+        if pool is not None:
+            pool.terminate()
+        raise
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    elapsed = time.time() - start
+    print('Processed {} bills in {:.1f}s ({:.1f} bills/sec)'.format(
+        total, elapsed, total / max(elapsed, 1e-9)))
+
+    errors = Counter()
+    for counts in stats.values():
+        errors.update({k: v for k, v in counts.items() if k not in OUTCOMES})
+    for msg, count in errors.most_common():
+        print('Error "{}": {}'.format(msg, count))
+
+    if index is not None:
+        print('Near duplicates: {} clusters'.format(len(index.clusters())))
+        if dedup_path is not None:
+            index.save(dedup_path)
+
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the final per-session bill datasets')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes used to prepare bills')
+    parser.add_argument('--chunksize', type=int, default=16,
+                        help='Bills sent to a worker at a time')
+    parser.add_argument('--data-path', default=DATA_PATH,
+                        help='Path to bills/ directory, with {} for the session')
+    parser.add_argument('--output-path', default=OUTPUT_PATH,
+                        help='Output jsonl path, with {} for the session')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only prepare bills whose files changed since the last run')
+    parser.add_argument('--catalog',
+                        help='Bill catalog to take the bills from, see bill_catalog.py')
+    parser.add_argument('--shard-size', type=int,
+                        help='Write compressed shards of this many bills with a bill_id index')
+    parser.add_argument('--dedup', choices=DEDUP_MODES,
+                        help='Drop, tag or point to their canonical bill the near-duplicate bills')
+    parser.add_argument('--dedup-path',
+                        help='Save the bill_id -> canonical bill_id map of --dedup here')
+    args = parser.parse_args()
+
+    ingest_sessions(range(107, 113), args.data_path, args.output_path,
+                    workers=args.workers, chunksize=args.chunksize,
+                    incremental=args.incremental, catalog=args.catalog,
+                    shard_size=args.shard_size, dedup=args.dedup, dedup_path=args.dedup_path)
@@ -0,0 +1,146 @@
+'''
+Sharded, compressed jsonl datasets with a bill_id index.
+
+A dataset with prefix PREFIX is stored as
+    PREFIX-00000.jsonl.gz, PREFIX-00001.jsonl.gz, ...  (fixed number of records each)
+    PREFIX.index.jsonl  (one [bill_id, shard name, byte offset, byte length] per record)
+
+Every record is compressed as its own gzip member. A shard is still a
+normal .jsonl.gz file that can be read from start to end (e.g. one shard
+per worker), and a single record can be read by decompressing only its
+byte range.
+'''
+import glob
+import gzip
+import json
+import os
+
+
+def shard_path(prefix, i):
+    return '{}-{:05d}.jsonl.gz'.format(prefix, i)
+
+
+def index_path(prefix):
+    return prefix + '.index.jsonl'
+
+
+class ShardWriter:
+    '''
+    Write records into shards of records_per_shard records each. The index
+    is written on close.
+    '''
+
+    def __init__(self, prefix, records_per_shard=1000):
+        self.prefix = prefix
+        self.records_per_shard = records_per_shard
+        self.index = []
+        self.n_shards = 0
+        self.f = None
+        self.count = 0
+
+        # Drop shards from an earlier, larger version of the dataset
+        for path in glob.glob(prefix + '-[0-9]*.jsonl.gz'):
+            os.remove(path)
+
+    def write(self, record):
+        if self.f is None or self.count == self.records_per_shard:
+            self._next_shard()
+
+        data = gzip.compress((json.dumps(record) + '\n').encode('utf-8'), mtime=0)
+        offset = self.f.tell()
+        self.f.write(data)
+        self.count += 1
+
+        name = os.path.basename(shard_path(self.prefix, self.n_shards - 1))
+        self.index.append([record['bill_id'], name, offset, len(data)])
+
+    def write_all(self, records):
+        for record in records:
+            self.write(record)
+
+    def _next_shard(self):
+        if self.f is not None:
+            self.f.close()
+        self.f = open(shard_path(self.prefix, self.n_shards), 'wb')
+        self.n_shards += 1
+        self.count = 0
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+        tmp_path = index_path(self.prefix) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for entry in self.index:
+                f.write(json.dumps(entry) + '\n')
+        os.replace(tmp_path, index_path(self.prefix))
+
+
+def read_index(prefix):
+    '''
+    Returns dict of bill_id -> (shard name, offset, length)
+    '''
+    index = {}
+    with open(index_path(prefix)) as f:
+        for line in f:
+            bill_id, name, offset, length = json.loads(line)
+            index[bill_id] = (name, offset, length)
+    return index
+
+
+def list_shards(prefix):
+    '''
+    Paths of all the shards of a dataset, in order.
+    '''
+    return sorted(glob.glob(prefix + '-[0-9]*.jsonl.gz'))
+
+
+def iter_shard(path):
+    '''
+    Read all records of one shard.
+    '''
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def iter_dataset(prefix):
+    for path in list_shards(prefix):
+        for record in iter_shard(path):
+            yield record
+
+
+def read_records(prefix, bill_ids, index=None):
+    '''
+    Read a subset of records, in the order of bill_ids. Only the byte
+    ranges of the requested records are read and decompressed.
+
+    index: result of read_index, to avoid reloading it for every call
+    '''
+    if index is None:
+        index = read_index(prefix)
+
+    shard_dir = os.path.dirname(prefix)
+    records = []
+    handles = {}
+    try:
+        for bill_id in bill_ids:
+            if bill_id not in index:
+                raise KeyError('No record for bill {}'.format(bill_id))
+
+            name, offset, length = index[bill_id]
+            if name not in handles:
+                handles[name] = open(os.path.join(shard_dir, name), 'rb')
+            f = handles[name]
+            f.seek(offset)
+            records.append(json.loads(gzip.decompress(f.read(length)).decode('utf-8')))
+    finally:
+        for f in handles.values():
+            f.close()
+
+    return records
+
+
+def read_record(prefix, bill_id, index=None):
+    return read_records(prefix, [bill_id], index)[0]
@@ -0,0 +1,70 @@
+'''
+A local stand-in for leginfo, to try ca_scraper.py without the real site.
+
+Serves canned pages from a directory: a request for
+/faces/billTextClient.xhtml?bill_id=ID returns PAGES_DIR/ID.html, or a 404
+if there is no such page. --fail-every N answers every Nth request with a
+503, to exercise the scraper's retries.
+
+Usage:
+	python billsum/data_collect/standin_server.py PAGES_DIR [--port 8000] [--fail-every N]
+	python billsum/data_collect/ca_scraper.py --base-url "http://localhost:8000/faces/billTextClient.xhtml?bill_id="
+'''
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import threading
+from urllib.parse import parse_qs, urlparse
+
+
+def make_handler(pages_dir, fail_every=0):
+	lock = threading.Lock()
+	counter = [0]
+
+	class PageHandler(BaseHTTPRequestHandler):
+
+		def do_GET(self):
+			with lock:
+				counter[0] += 1
+				n = counter[0]
+
+			if fail_every and n % fail_every == 0:
+				self.send_error(503)
+				return
+
+			bill_id = parse_qs(urlparse(self.path).query).get('bill_id', [''])[0]
+			path = os.path.join(pages_dir, os.path.basename(bill_id) + '.html')
+			if not bill_id or not os.path.isfile(path):
+				self.send_error(404)
+				return
+
+			with open(path, 'rb') as f:
+				body = f.read()
+
+			self.send_response(200)
+			self.send_header('Content-Type', 'text/html; charset=utf-8')
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		def log_message(self, format, *args):
+			pass
+
+	return PageHandler
+
+
+def make_server(pages_dir, port=8000, fail_every=0):
+	return ThreadingHTTPServer(('localhost', port), make_handler(pages_dir, fail_every))
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Serve canned bill pages')
+	parser.add_argument('pages_dir')
+	parser.add_argument('--port', type=int, default=8000)
+	parser.add_argument('--fail-every', type=int, default=0,
+						help='Answer every Nth request with a 503')
+	args = parser.parse_args()
+
+	server = make_server(args.pages_dir, args.port, args.fail_every)
+	print('Serving {} on port {}'.format(args.pages_dir, server.server_address[1]))
+	server.serve_forever()
@@ -0,0 +1,33 @@
+'''
+Precedence of the bill text versions in the congress data.
+'''
+import numpy as np
+
+# Order of text versions from earliest to latest, by the chamber the bill
+# started in
+HOUSE_ORDER = ['ih', 'rth', 'rh', 'rfh','rch', 'eh', 'ath', 'pcs', 'hds', 'rds', 'rfs', 'rs', 'rs2', 'rcs', 'es', 'ats', 'cps', 'enr', 'pp']
+SENATE_ORDER = [ 'is',  'rds', 'rfs', 'rs', 'rs2', 'rcs', 'es', 'ats', 'cps', 'ih', 'rth', 'rh', 'rfh','rch', 'eh', 'ath', 'enr', 'pp']
+
+
+def is_house_type(bill_type):
+    '''
+    House bill types (h, hr, hres, hjres, hconres) all start with h.
+    '''
+    return bill_type.startswith('h')
+
+
+def version_rank(version, house):
+    '''
+    Precedence of a text version - higher is later. Unknown versions get -1.
+    '''
+    cur_order = HOUSE_ORDER if house else SENATE_ORDER
+    return cur_order.index(version) if version in cur_order else -1
+
+
+def pick_latest_version(versions, house):
+    '''
+    Pick the latest of a list of text versions. Ties go to the version listed
+    first.
+    '''
+    idxs = [version_rank(d, house) for d in versions]
+    return versions[np.argmax(idxs)]
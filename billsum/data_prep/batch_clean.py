@@ -0,0 +1,148 @@
+'''
+Clean jsonl corpora on all cores.
+
+Records are streamed from the input file in chunks, cleaned with clean_text
+in a pool of worker processes and written out in input order, with a
+clean_<field> next to every cleaned field. Only a bounded number of chunks
+is in flight at any time, so memory does not grow with the corpus.
+
+With --cache, cleaned texts are kept in a clean_cache database shared by
+the workers, so texts cleaned before (in this run or earlier ones) are not
+cleaned again.
+
+Usage:
+    python billsum/data_prep/batch_clean.py INPUT.jsonl OUTPUT.jsonl
+        [--fields text summary title] [--workers N] [--chunk-size 64]
+        [--cache PATH] [--cache-size BYTES]
+'''
+import argparse
+from collections import deque
+import json
+import multiprocessing
+import os
+import time
+
+from billsum.data_prep import clean_cache
+from billsum.data_prep.clean_text import clean_text
+
+FIELDS = ['text', 'summary', 'title']
+
+
+def clean_record(record, fields=FIELDS):
+    '''
+    Add clean_<field> for every field of the record in fields
+    '''
+    for field in fields:
+        if field in record:
+            doc_id = '{}/{}'.format(record.get('bill_id'), field)
+            record['clean_' + field] = clean_text(record[field], doc_id)
+    return record
+
+
+def clean_chunk(task):
+    '''
+    task: (list of jsonl lines, fields)
+
+    Returns (the cleaned records as one block of jsonl, cache hits, cache
+    misses)
+    '''
+    lines, fields = task
+    cache = clean_cache.active_cache()
+    hits, misses = (cache.hits, cache.misses) if cache else (0, 0)
+
+    out = []
+    for line in lines:
+        out.append(json.dumps(clean_record(json.loads(line), fields)) + '\n')
+
+    if cache:
+        return ''.join(out), cache.hits - hits, cache.misses - misses
+    return ''.join(out), 0, 0
+
+
+def _init_worker(cache_path, cache_size):
+    if cache_path is not None:
+        clean_cache.use_cache(cache_path, cache_size)
+
+
+def read_chunks(input_file, chunk_size):
+    '''
+    Yield lists of up to chunk_size non-empty lines
+    '''
+    chunk = []
+    with open(input_file) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            chunk.append(line)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def clean_file(input_file, output_file, fields=FIELDS, workers=None, chunk_size=64, window=None,
+               cache_path=None, cache_size=clean_cache.DEFAULT_MAX_BYTES):
+    '''
+    Clean every record of input_file into output_file, in order.
+
+    window: max number of chunks queued or being cleaned (default: 4 per
+        worker)
+    cache_path: clean_cache database to use, if any
+
+    Returns the number of records
+    '''
+    workers = workers or os.cpu_count()
+    window = window or 4 * workers
+
+    count = 0
+    hits = misses = 0
+    start = time.time()
+    pending = deque()
+    tmp_file = output_file + '.tmp'
+
+    def write_next():
+        nonlocal hits, misses
+        size, result = pending.popleft()
+        text, chunk_hits, chunk_misses = result.get()
+        out.write(text)
+        hits += chunk_hits
+        misses += chunk_misses
+        return size
+
+    with multiprocessing.Pool(workers, _init_worker, (cache_path, cache_size)) as pool, open(tmp_file, 'w') as out:
+        for i, chunk in enumerate(read_chunks(input_file, chunk_size)):
+            if len(pending) >= window:
+                count += write_next()
+            pending.append((len(chunk), pool.apply_async(clean_chunk, ((chunk, fields),))))
+
+            if i % 100 == 99:
+                print('Cleaned {} records ({:.1f} records/sec)'.format(count, count / (time.time() - start)))
+        while pending:
+            count += write_next()
+    os.replace(tmp_file, output_file)
+
+    elapsed = time.time() - start
+    print('Cleaned {} records in {:.1f}s ({:.1f} records/sec)'.format(count, elapsed, count / max(elapsed, 1e-9)))
+    if cache_path is not None:
+        print('Cache: {} hits, {} misses'.format(hits, misses))
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Clean the fields of a jsonl corpus on all cores')
+    parser.add_argument('input', help='jsonl file of records')
+    parser.add_argument('output', help='jsonl file to write the records with clean_* fields to')
+    parser.add_argument('--fields', nargs='+', default=FIELDS)
+    parser.add_argument('--workers', type=int,
+                        help='Number of processes (default: all cores)')
+    parser.add_argument('--chunk-size', type=int, default=64,
+                        help='Records per task')
+    parser.add_argument('--cache',
+                        help='clean_cache database of cleaned texts to use')
+    parser.add_argument('--cache-size', type=int, default=clean_cache.DEFAULT_MAX_BYTES,
+                        help='Max bytes of cleaned texts kept in the cache')
+    args = parser.parse_args()
+
+    clean_file(args.input, args.output, args.fields, args.workers, args.chunk_size,
+               cache_path=args.cache, cache_size=args.cache_size)
@@ -0,0 +1,156 @@
+'''
+A persistent cache of cleaned texts.
+
+Entries are keyed by the sha1 of the input text and the version of the
+cleaning function, and kept in a sqlite database. When the cached texts
+grow past max_bytes, the least recently used ones are evicted.
+
+The cleaners in clean_text.py are wrapped with cached(), and consult the
+cache once it is opened with use_cache(path):
+
+    from billsum.data_prep import clean_cache, clean_text
+    clean_cache.use_cache('clean_cache.sqlite')
+    clean_text.clean_text(text)
+'''
+import functools
+import hashlib
+import sqlite3
+import time
+
+from billsum.data_prep import clean_engine
+
+DEFAULT_MAX_BYTES = 1 << 30
+
+# Check the size of the cache every this many writes
+EVICT_EVERY = 100
+
+
+class CleanCache:
+    '''
+    Cleaned texts in a sqlite database, with size-based LRU eviction.
+
+    hits and misses count the lookups of this process.
+    '''
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+
+        # Several processes can share the cache (e.g. batch_clean workers)
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS entries (digest TEXT, version TEXT, cleaned TEXT, '
+                        'size INTEGER, last_used REAL, PRIMARY KEY (digest, version))')
+        self.db.execute('CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)')
+
+    def get(self, digest, version):
+        '''
+        The cached text, or None
+        '''
+        row = self.db.execute('SELECT cleaned FROM entries WHERE digest = ? AND version = ?',
+                              (digest, version)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.db.execute('UPDATE entries SET last_used = ? WHERE digest = ? AND version = ?',
+                        (time.time(), digest, version))
+        return row[0]
+
+    def put(self, digest, version, cleaned):
+        self.db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)',
+                        (digest, version, cleaned, len(cleaned.encode('utf-8')), time.time()))
+        self._writes += 1
+        if self._writes % EVICT_EVERY == 0:
+            self.evict()
+
+    def size(self):
+        '''
+        Total bytes of the cached texts
+        '''
+        return self.db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def evict(self):
+        '''
+        Drop the least recently used entries until the cache fits in
+        max_bytes. Returns the number of entries dropped.
+        '''
+        excess = self.size() - self.max_bytes
+        if excess <= 0:
+            return 0
+
+        drop = []
+        for digest, version, size in self.db.execute(
+                'SELECT digest, version, size FROM entries ORDER BY last_used'):
+            drop.append((digest, version))
+            excess -= size
+            if excess <= 0:
+                break
+        self.db.executemany('DELETE FROM entries WHERE digest = ? AND version = ?', drop)
+        return len(drop)
+
+    def stats(self):
+        entries = self.db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries, 'bytes': self.size()}
+
+    def close(self):
+        self.evict()
+        self.db.close()
+
+
+_cache = None
+
+
+def use_cache(path, max_bytes=DEFAULT_MAX_BYTES):
+    '''
+    Open the cache at path for all cached cleaners (None to stop caching).
+    Returns the CleanCache.
+    '''
+    global _cache
+    if _cache is not None:
+        _cache.close()
+    _cache = CleanCache(path, max_bytes) if path is not None else None
+    return _cache
+
+
+def active_cache():
+    return _cache
+
+
+def text_digest(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def cached(version):
+    '''
+    Decorator for a cleaning function of a text. version names the function
+    and must change whenever its output may change. Texts for which a
+    cleaner used a fallback (see clean_engine.py) are not cached.
+    '''
+    def decorate(fn):
+        def wrapper(text, *args, **kwargs):
+            if _cache is None:
+                return fn(text, *args, **kwargs)
+
+            digest = text_digest(text)
+            cleaned = _cache.get(digest, version)
+            if cleaned is None:
+                n_fallbacks = clean_engine.n_fallbacks
+                cleaned = fn(text, *args, **kwargs)
+                # A text cleaned with fallbacks depends on the time it got -
+                # clean it again next time
+                if clean_engine.n_fallbacks == n_fallbacks:
+                    _cache.put(digest, version, cleaned)
+            return cleaned
+
+        # Not the __dict__ - fn may be a Cleaner, whose attributes (e.g.
+        # budget) should be set on fn itself
+        functools.update_wrapper(wrapper, fn, updated=())
+        wrapper.version = version
+        return wrapper
+    return decorate
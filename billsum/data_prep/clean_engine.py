@@ -0,0 +1,239 @@
+'''
+A small engine for the text cleaners in clean_text.py.
+
+A cleaner is declared as an ordered list of stages:
+    literal(old, new)          str.replace(old, new)
+    sub(pattern, repl)         pattern.sub(repl, text)
+    step(fn)                   any function of the text. Returning None stops
+                               the cleaner, which then returns ''.
+
+Every stage is timed on every call, so that Cleaner.report() shows where
+the time goes.
+
+Stages whose pattern can backtrack badly on malformed input are given a
+fallback - a linear-time function with the same result, or a simpler rule.
+A cleaner runs them under a time budget per document (signal.setitimer, so
+only in the main thread of a process); a stage that runs out of time is
+interrupted and its fallback used instead. Every stage that ran out of time
+is printed and kept in Cleaner.fallbacks. The budget is then used up, so the
+guarded stages after it are not tried and go straight to their fallbacks;
+they are kept apart in Cleaner.skipped, and printed once per document.
+
+With fuse_literals, runs of adjacent literal replacements are fused into one
+regex pass when that can not change the result (see can_fuse). It is off by
+default: str.replace is a fast C loop that returns its input untouched when
+there is nothing to replace, and a fused pass with a Python callback per
+match measured about twice as slow on the bill corpus.
+'''
+from collections import namedtuple
+import hashlib
+import re
+import signal
+import threading
+import time
+
+# Seconds per document, for the stages with a fallback
+TIME_BUDGET = 10.0
+
+# Fallbacks used by all cleaners of the process, ran out of time or skipped
+n_fallbacks = 0
+
+Stage = namedtuple('Stage', ['name', 'fn', 'fallback'], defaults=(None,))
+Literal = namedtuple('Literal', ['old', 'new'])
+
+
+def literal(old, new):
+    return Literal(old, new)
+
+
+def sub(pattern, repl, name=None, fallback=None):
+    if name is None:
+        name = 'sub ' + pattern.pattern.replace('\n', '\\n').replace('\t', '\\t')[:40]
+    return Stage(name, lambda text: pattern.sub(repl, text), fallback)
+
+
+def step(fn, name=None, fallback=None):
+    return Stage(name or fn.__name__, fn, fallback)
+
+
+class OutOfTime(Exception):
+    pass
+
+
+def _out_of_time(signum, frame):
+    raise OutOfTime()
+
+
+def _can_use_timer():
+    return hasattr(signal, 'setitimer') and threading.current_thread() is threading.main_thread()
+
+
+def _overlap(a, b):
+    '''
+    True if a suffix of a is a proper prefix of b, or b is inside a
+    '''
+    if b in a:
+        return True
+    return any(a.endswith(b[:k]) for k in range(1, len(b)))
+
+
+def can_fuse(first, second):
+    '''
+    Can a literal replacement `second` run together with an earlier one
+    `first`, in a single left-to-right scan, with the same result as running
+    them one after the other?
+
+    That holds if `second.old` can neither overlap text written by `first`
+    (nor text around a deletion), nor overlap occurrences of `first.old`.
+    '''
+    if not first.new and len(second.old) > 1:
+        # A deletion can join the text around it into a new match
+        return False
+    if _overlap(first.new, second.old) or _overlap(second.old, first.new):
+        return False
+    if _overlap(first.old, second.old) or _overlap(second.old, first.old):
+        return False
+    return True
+
+
+def _fused_stage(literals):
+    '''
+    One stage for a run of literals that can be fused.
+    '''
+    name = 'literals ' + ' '.join(repr(l.old) for l in literals)
+
+    if len(literals) == 1:
+        old, new = literals[0]
+        return Stage(name, lambda text: text.replace(old, new))
+
+    mapping = {l.old: l.new for l in literals}
+    pattern = re.compile('|'.join(re.escape(l.old) for l in literals))
+    return Stage(name, lambda text: pattern.sub(lambda m: mapping[m.group()], text))
+
+
+def _plain_stages(literals):
+    return [Stage('literal ' + repr(l.old), lambda text, l=l: text.replace(l.old, l.new)) for l in literals]
+
+
+def compile_stages(stages, fuse_literals=False):
+    '''
+    Turn a stage list into Stages, fusing runs of adjacent literals.
+    '''
+    compiled = []
+    run = []
+
+    def flush():
+        if run:
+            compiled.extend([_fused_stage(run)] if fuse_literals else _plain_stages(run))
+            del run[:]
+
+    for stage in stages:
+        if isinstance(stage, Literal):
+            if fuse_literals and not all(can_fuse(prev, stage) for prev in run):
+                compiled.append(_fused_stage(run))
+                del run[:]
+            run.append(stage)
+        else:
+            flush()
+            compiled.append(stage)
+    flush()
+
+    return compiled
+
+
+class Cleaner:
+    '''
+    A cleaning function made of stages, with per-stage timing.
+
+    budget: seconds per document for the stages with a fallback, None for
+        no limit
+    '''
+
+    def __init__(self, name, stages, fuse_literals=False, budget=TIME_BUDGET):
+        self.name = name
+        self.stages = compile_stages(stages, fuse_literals)
+        self.budget = budget
+        # [calls, seconds] of every stage
+        self.timings = [[0, 0.0] for _ in self.stages]
+        # (stage name, doc id) of every stage that ran out of time
+        self.fallbacks = []
+        # (stage name, doc id) of every stage not tried, the budget being used up
+        self.skipped = []
+
+    def __call__(self, text, doc_id=None):
+        if self.budget is None or not _can_use_timer():
+            return self._run(text, doc_id, None)
+
+        handler = signal.signal(signal.SIGALRM, _out_of_time)
+        try:
+            return self._run(text, doc_id, time.perf_counter() + self.budget)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, handler)
+
+    def _run(self, text, doc_id, deadline):
+        if deadline is not None and doc_id is None:
+            doc_id = hashlib.sha1(text.encode('utf-8')).hexdigest()[:10]
+
+        exhausted = False
+        for stage, timing in zip(self.stages, self.timings):
+            start = time.perf_counter()
+            if deadline is None or stage.fallback is None:
+                text = stage.fn(text)
+            elif exhausted:
+                self.skipped.append((stage.name, doc_id))
+                text = self._fallback(stage, text)
+            else:
+                text, exhausted = self._run_limited(stage, text, doc_id, deadline - start)
+            timing[0] += 1
+            timing[1] += time.perf_counter() - start
+
+            if text is None:
+                return ''
+        return text
+
+    def _run_limited(self, stage, text, doc_id, seconds):
+        '''
+        (result, whether the budget is used up)
+        '''
+        if seconds <= 0:
+            print('{}: time budget used up on document {} before {}, using the fallbacks of the remaining stages'
+                  .format(self.name, doc_id, stage.name))
+            self.skipped.append((stage.name, doc_id))
+            return self._fallback(stage, text), True
+
+        signal.setitimer(signal.ITIMER_REAL, seconds)
+        try:
+            # Not in a finally - the timer may go off right after fn
+            # returns, which must still be caught here
+            result = stage.fn(text)
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            return result, False
+        except OutOfTime:
+            pass
+
+        print('{}: {} ran out of time on document {}, using its fallback and those of the remaining stages'
+              .format(self.name, stage.name, doc_id))
+        self.fallbacks.append((stage.name, doc_id))
+        return self._fallback(stage, text), True
+
+    def _fallback(self, stage, text):
+        global n_fallbacks
+        n_fallbacks += 1
+        return stage.fallback(text)
+
+    def reset_timings(self):
+        for timing in self.timings:
+            timing[0] = 0
+            timing[1] = 0.0
+
+    def report(self):
+        '''
+        Print the calls and total time of every stage, slowest first.
+        '''
+        total = sum(t for _, t in self.timings)
+        print('{}: {:.3f}s'.format(self.name, total))
+        rows = sorted(zip(self.stages, self.timings), key=lambda row: -row[1][1])
+        for stage, (calls, seconds) in rows:
+            print('  {:7.3f}s {:5.1f}%  {:6d} calls  {}'.format(
+                seconds, 100 * seconds / max(total, 1e-12), calls, stage.name))
@@ -0,0 +1,120 @@
+'''
+Reference outputs of the cleaning functions in clean_text.py.
+
+The cleaners run over a fixed corpus from test_data (bill texts, the
+university policies and their summaries), and the sha1 of every output is
+compared against test_data/clean_reference.jsonl. Any change to the
+cleaning code has to keep these byte-identical, or come with a new
+reference (and a reason).
+
+Usage:
+    python billsum/data_prep/clean_reference.py check [--timing]
+    python billsum/data_prep/clean_reference.py write
+'''
+import argparse
+import hashlib
+import json
+import os
+
+from billsum.data_prep import clean_text as ct
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'test_data')
+REFERENCE_PATH = os.path.join(TEST_DATA, 'clean_reference.jsonl')
+
+UNIVERSITIES = ['cmu', 'cu', 'dayton', 'psu', 'uoregon']
+
+CLEANERS = [ct.clean_bill_text, ct.clean_structured_text,
+            ct.clean_cmu.__wrapped__, ct.clean_cu.__wrapped__, ct.clean_dayton.__wrapped__]
+
+
+def _read_jsonl(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def _read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def reference_cases(data_dir=TEST_DATA):
+    '''
+    Yield (cleaner name, case id, input text) for the whole corpus, in a
+    fixed order.
+    '''
+    for i, bill in enumerate(_read_jsonl(os.path.join(data_dir, 'clean_corpus', 'bills.jsonl'))):
+        yield 'clean_text', 'bills/{}/text'.format(i), bill['text']
+
+    for i, bill in enumerate(_read_jsonl(os.path.join(data_dir, 'data_final', 'test1.jsonl'))):
+        for field in ('text', 'summary', 'title'):
+            yield 'clean_text', 'test1/{}/{}'.format(i, field), bill[field]
+
+    policies = {uni: _read_json(os.path.join(data_dir, 'data_uni_sep', uni + '.json')) for uni in UNIVERSITIES}
+    for uni in UNIVERSITIES:
+        for i, doc in enumerate(policies[uni]):
+            for field in ('policy', 'summary'):
+                yield 'clean_text', '{}/{}/{}'.format(uni, i, field), doc[field]
+
+    for uni in ('cmu', 'cu', 'dayton'):
+        for i, doc in enumerate(policies[uni]):
+            yield 'clean_' + uni, '{}/{}/policy'.format(uni, i), doc['policy']
+
+
+def _digest(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def run_cases(data_dir=TEST_DATA):
+    '''
+    Clean the corpus. Returns list of [cleaner name, case id, sha1, length]
+    '''
+    results = []
+    for name, case_id, text in reference_cases(data_dir):
+        out = getattr(ct, name)(text)
+        results.append([name, case_id, _digest(out), len(out)])
+    return results
+
+
+def write_reference(path=REFERENCE_PATH, data_dir=TEST_DATA):
+    results = run_cases(data_dir)
+    with open(path, 'w') as f:
+        for row in results:
+            f.write(json.dumps(row) + '\n')
+    print('Wrote {} reference outputs to {}'.format(len(results), path))
+
+
+def check_reference(path=REFERENCE_PATH, data_dir=TEST_DATA):
+    '''
+    Returns list of (cleaner name, case id) whose output differs from the
+    reference
+    '''
+    expected = {(row[0], row[1]): row for row in _read_jsonl(path)}
+    results = run_cases(data_dir)
+
+    mismatches = [(row[0], row[1]) for row in results if expected.get((row[0], row[1])) != row]
+    missing = set(expected) - set((row[0], row[1]) for row in results)
+    mismatches.extend(sorted(missing))
+
+    print('Checked {} outputs, {} mismatches'.format(len(results), len(mismatches)))
+    for name, case_id in mismatches[:20]:
+        print('  {} {}'.format(name, case_id))
+    return mismatches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the cleaners against their reference outputs')
+    parser.add_argument('action', choices=['check', 'write'])
+    parser.add_argument('--timing', action='store_true',
+                        help='Print the time spent in every stage of every cleaner')
+    args = parser.parse_args()
+
+    if args.action == 'write':
+        write_reference()
+        raise SystemExit
+
+    mismatches = check_reference()
+    if args.timing:
+        for cleaner in CLEANERS:
+            cleaner.report()
+    if mismatches:
+        raise SystemExit(1)
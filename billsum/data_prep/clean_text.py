@@ -8,6 +8,11 @@ import pandas as pd
 import pickle
 import re
 
+from billsum.data_prep import split_universities
+from billsum.data_prep.clean_cache import cached, text_digest
+from billsum.data_prep.clean_engine import Cleaner, literal, step, sub
+from billsum.data_prep.multi_pattern import pattern_set
+
 
 def replace_semicolon(text, threshold=10):
     '''
@@ -47,67 +52,165 @@ FIX_PERIOD = re.compile('\.([A-Za-z])')
 SECTION_HEADER_RE = re.compile(
     'SECTION [0-9]{1,2}\.|\nSEC\.* [0-9]{1,2}\.|Sec\.* [0-9]{1,2}\.')
 
+# Part of the clean_cache keys - bump whenever the output of a cleaner changes
+CLEAN_VERSION = 1
 
-def clean_text(text):
-    """
-    Borrowed from the FNDS text processing with additional logic added in.
-    Note: we do not take care of token breaking - assume SPACY's tokenizer
-    will handle this for us.
-    """
+# Section marker of texts prepared from the bill xml
+SECTION_MARK = '<SECTION-HEADER>'
 
-    # Indicate section headers, we need them for features
-    text = SECTION_HEADER_RE.sub('SECTION-HEADER', text)
-    # For simplicity later, remove '.' from most common acronym
-    text = text.replace("U.S.", "US")
-    text = text.replace('SEC.', 'Section')
-    text = text.replace('Sec.', 'Section')
-    text = USC_re.sub('USC', text)
 
-    # Remove parantheticals because they are almost always references to laws
-    # We could add a special tag, but we just remove for now
-    # Note we dont get rid of nested parens because that is a complex re
-    # text = PAREN_re.sub('LAWREF', text)
-    text = PAREN_re.sub('', text)
+def remove_parens(text):
+    '''
+    Same as PAREN_re.sub('', text), in linear time - a match runs from a '('
+    to the last ')' before the next '(', if there is a space in between
+    (with at least one character on either side of it).
+    '''
+    pieces = []
+    pos = 0
+    i = text.find('(')
+    while i != -1:
+        nxt = text.find('(', i + 1)
+        end = text.rfind(')', i + 1, len(text) if nxt == -1 else nxt)
+        if end != -1 and text.find(' ', i + 2, end - 1) != -1:
+            pieces.append(text[pos:i])
+            pos = end + 1
+        i = nxt
+    pieces.append(text[pos:])
+    return ''.join(pieces)
+
+
+def remove_html_tags(text):
+    '''
+    Same as HTML_RE.sub('', text), in linear time - a tag runs from a '<' to
+    the next '>', if there is no newline in between.
+    '''
+    n = len(text)
+    close = nl = -1
+    pieces = []
+    pos = 0
+    i = text.find('<')
+    while i != -1:
+        if close != n and close <= i:
+            close = text.find('>', i + 1)
+            close = n if close == -1 else close
+        if nl != n and nl <= i:
+            nl = text.find('\n', i + 1)
+            nl = n if nl == -1 else nl
+
+        if close < nl:
+            pieces.append(text[pos:i])
+            pos = close + 1
+            i = text.find('<', pos)
+        else:
+            i = text.find('<', i + 1)
+    pieces.append(text[pos:])
+    return ''.join(pieces)
 
-    # get rid of HTML tags
-    text = HTML_RE.sub('', text)
 
-    # Get rid of enums as bullets or ` as bullets
-    text = BULLET_RE.sub(' ', text)
+def _paren_by_line(text):
+    # One block per line - without bullets between them, parens can be far
+    # apart and PAREN_re gets slow on long spans
+    return '\n'.join(PAREN_re.sub('', line) for line in text.split('\n'))
 
-    # Clean html
-    text = text.replace('&lt;all&gt;', '')
 
-    # Remove annoying punctuation, that's not relevant
-    text = BAD_PUNCT_RE.sub('', text)
+def _remove_parens_by_line(text):
+    return '\n'.join(remove_parens(line) for line in text.split('\n'))
 
-    # Get rid of long sequences of dashes - these are formating
-    text = DASH_RE.sub(' ', text)
 
+# The end of every cleaner: sentence and punctuation fixes
+SENTENCE_STAGES = [
     # removing newlines, tabs, and extra spaces.
-    text = WHITESPACE_RE.sub(' ', text)
-
+    sub(WHITESPACE_RE, ' '),
     # If we ended up with "empty" sentences - get rid of them.
-    text = EMPTY_SENT_RE.sub('.', text)
-
+    sub(EMPTY_SENT_RE, '.'),
     # Attempt to create sentences from bullets
-    text = replace_semicolon(text)
-
-    # Fix weird period issues + start of text weirdness
-    # text = re.sub('\.(?=[A-Z])', '  . ', text)
+    step(replace_semicolon),
     # Get rid of anything thats not a word from the start of the text
-    text = FIX_START_RE.sub('', text)
+    sub(FIX_START_RE, ''),
     # Sometimes periods get formatted weird, make sure there is a space between periods and start of sent
-    text = FIX_PERIOD.sub(". \g<1>", text)
-
+    sub(FIX_PERIOD, ". \g<1>"),
     # Fix quotes
-    text = text.replace('``', '"')
-    text = text.replace('\'\'', '"')
-
+    literal('``', '"'),
+    literal('\'\'', '"'),
     # Add special punct back in
-    text = text.replace('SECTION-HEADER', '<SECTION-HEADER>')
+    literal('SECTION-HEADER', '<SECTION-HEADER>'),
+]
 
-    return text
+
+def _bill_stages(structured):
+    """
+    Borrowed from the FNDS text processing with additional logic added in.
+
+    Texts prepared from the bill xml already have their section headers
+    marked and contain no tags or bullets, so those passes are left out.
+    """
+    stages = []
+    if not structured:
+        # Indicate section headers, we need them for features
+        stages.append(sub(SECTION_HEADER_RE, 'SECTION-HEADER'))
+
+    stages += [
+        # For simplicity later, remove '.' from most common acronym
+        literal("U.S.", "US"),
+        literal('SEC.', 'Section'),
+        literal('Sec.', 'Section'),
+        sub(USC_re, 'USC'),
+        # Remove parantheticals because they are almost always references to laws
+        # We could add a special tag, but we just remove for now
+        # Note we dont get rid of nested parens because that is a complex re
+        (step(_paren_by_line, 'paren by line', fallback=_remove_parens_by_line) if structured
+         else sub(PAREN_re, '', fallback=remove_parens)),
+    ]
+
+    if not structured:
+        stages += [
+            # get rid of HTML tags
+            sub(HTML_RE, '', fallback=remove_html_tags),
+            # Get rid of enums as bullets or ` as bullets
+            sub(BULLET_RE, ' '),
+        ]
+
+    stages += [
+        # Clean html
+        literal('&lt;all&gt;', ''),
+        # Remove annoying punctuation, that's not relevant
+        sub(BAD_PUNCT_RE, ''),
+        # Get rid of long sequences of dashes - these are formating
+        sub(DASH_RE, ' '),
+    ]
+    return stages + SENTENCE_STAGES
+
+
+clean_bill_text = Cleaner('clean_text', _bill_stages(structured=False))
+clean_structured_text = Cleaner('clean_text (xml)', _bill_stages(structured=True))
+
+
+@cached('clean_text:{}'.format(CLEAN_VERSION))
+def clean_text(text, doc_id=None):
+    """
+    Borrowed from the FNDS text processing with additional logic added in.
+    Note: we do not take care of token breaking - assume SPACY's tokenizer
+    will handle this for us.
+
+    Texts prepared from the bill xml (with SECTION_MARK) go through
+    clean_structured_text, all others through clean_bill_text. doc_id names
+    the text in fallback reports.
+    """
+    if SECTION_MARK in text:
+        return clean_structured_text(text, doc_id)
+    return clean_bill_text(text, doc_id)
+
+
+# Replacements of unicode punctuation, used by several universities
+UNICODE_STAGES = [
+    literal("\u200b", ""),
+    literal("\u00a0", " "),
+    literal("\u2022", ""),
+    literal("\u2019", "'"),
+    literal("\u2013", "-"),
+    literal("\u201c", "\""),
+    literal("\u201d", '"'),
+]
 
 
 CMU_re = {
@@ -155,13 +258,13 @@ def get_title_cmu(text):
     return title
 
 
-def clean_cmu(text):
+def extract_cmu(text):
     start_idx = find_start_cmu(text)
     end_idx = find_end_cmu(text)
     title = get_title_cmu(text)
 
     if start_idx == None:
-        return ""
+        return None
 
     text = text[start_idx:end_idx].strip() + "."
 
@@ -171,41 +274,20 @@ def clean_cmu(text):
     if title != None:
         text = "SECTION-HEADER " + title + ". " + text
 
-    # make sure there is a period before each line break
-    text = CMU_re["FIX_SENT"].sub("\g<1>.\n", text)
+    return text
 
-    # normalize university names
-    text = CMU_re["UNIVERSITY"].sub('The University', text)
 
+clean_cmu = cached('clean_cmu:{}'.format(CLEAN_VERSION))(Cleaner('clean_cmu', [
+    step(extract_cmu),
+    # make sure there is a period before each line break
+    sub(CMU_re["FIX_SENT"], "\g<1>.\n"),
+    # normalize university names
+    sub(CMU_re["UNIVERSITY"], 'The University'),
     # remove bullets
-    text = CMU_re["BULLET"].sub(" ", text)
-
+    sub(CMU_re["BULLET"], " "),
     # Remove annoying punctuation, that's not relevant
-    text = BAD_PUNCT_RE.sub('', text)
-
-    # removing newlines, tabs, and extra spaces.
-    text = WHITESPACE_RE.sub(' ', text)
-
-    # If we ended up with "empty" sentences - get rid of them.
-    text = EMPTY_SENT_RE.sub('.', text)
-
-    # Attempt to create sentences from bullets
-    text = replace_semicolon(text)
-
-    # Get rid of anything thats not a word from the start of the text
-    text = FIX_START_RE.sub('', text)
-
-    # Sometimes periods get formatted weird, make sure there is a space between periods and start of sent
-    text = FIX_PERIOD.sub(". \g<1>", text)
-
-    # Fix quotes
-    text = text.replace('``', '"')
-    text = text.replace('\'\'', '"')
-
-    # Add special punct back in
-    text = text.replace('SECTION-HEADER', '<SECTION-HEADER>')
-
-    return text
+    sub(BAD_PUNCT_RE, ''),
+] + SENTENCE_STAGES))
 
 
 CU_re = {
@@ -218,84 +300,159 @@ CU_re = {
     "FIX_SENT": re.compile("([a-zA-Z0-9]|\))\s*\n")
 }
 
-inline_defs = set()
-
-
-def remove_inline_defs(text):
-    matches = CU_re["INLINE_DEF"].findall(text)
-    for m in matches:
-        # print(m)
+def find_inline_defs(text):
+    """
+    The inline definitions ("term" glued to its definition) in a CU policy
+    """
+    defs = set()
+    for m in CU_re["INLINE_DEF"].findall(text):
         if "tPathways" not in m[0] + m[1]:
             term = m[1]
             defn = m[2] + m[3]
-            inline_defs.add(term + defn)
-    for defn in inline_defs:
-        text = text.replace(defn, "")
-    return text
+            defs.add(term + defn)
+    return defs
 
 
-def clean_cu(text):
-    text = text.replace("\u200b", "")
-    text = text.replace("\u00a0", " ")
-    text = text.replace("\u2022", "")
-    text = text.replace("\u2019", "'")
-    text = text.replace("\u2013", "-")
-    text = text.replace("\u201c", "\"")
-    text = text.replace("\u201d", '"')
+def remove_inline_defs(text, dictionary=None):
+    """
+    Remove the inline definitions of the text, and those of the dictionary
+    (see build_inline_dictionary), in one pass.
+    """
+    defs = frozenset(find_inline_defs(text))
+    if dictionary is not None:
+        defs = dictionary if defs <= dictionary else dictionary | defs
+    return pattern_set(defs).remove(text)
 
-    match = CU_re["TITLE"].search(text)
-    title = None
-    if match != None:
-        title = match.group(1)
 
-    match = CU_re["POLICY"].search(text)
+def _remove_dictionary_defs(dictionary):
+    # Fallback of remove_inline_defs - CU_re["INLINE_DEF"] can take very long
+    # on long lines, so only remove the dictionary, if any
+    return lambda text: pattern_set(dictionary or frozenset()).remove(text)
+
+
+CU_POLICY_HEADING_re = re.compile("(POLICY STATEMENTS?|Policy Statements?)\s")
+CU_POLICY_ENDS = ["III.", "Related Policies, Procedures, Forms, Guidelines, and Other Resources", "History", "Definitions"]
+
+
+def find_cu_policy(text):
+    """
+    Same as CU_re["POLICY"].search(text).group(3).strip(), in linear time.
+    The policy runs from the first heading to the newline before the last
+    section that may follow it (the greedy .+), or there is none.
+    """
+    match = CU_POLICY_HEADING_re.search(text)
     if match == None:
-        return ""
+        return None
+
+    end = max(text.rfind("\n" + e) for e in CU_POLICY_ENDS)
+    # \s+ and .+ need at least one character each
+    if end < match.end(1) + 2:
+        return None
+    return text[match.end(1):end].strip()
+
+
+CU_TITLE_START_re = re.compile("APS [0-9]+ ?- ?(?=[A-Z0-9])")
+# Any whitespace but a space ends the title
+CU_TITLE_LINE_END_re = re.compile("[^\S ]")
+CU_TITLE_LAST_CHARS = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789)")
+
 
-    text = match.group(3).strip()
+def find_cu_title(text):
+    """
+    Same as CU_re["TITLE"].search(text).group(1), in linear time. The title
+    runs from an "APS N - " to the last " |" of its line that follows a
+    letter, digit or ")", or there is none.
+    """
+    line_end = -1
+    last = -1
+    for match in CU_TITLE_START_re.finditer(text):
+        start = match.end()
+        if start > line_end:
+            # First title start on this line - find the last " |" that can end one
+            end = CU_TITLE_LINE_END_re.search(text, start)
+            line_end = end.start() if end != None else len(text)
+            last = text.rfind(" |", start, line_end)
+            while last != -1 and text[last - 1] not in CU_TITLE_LAST_CHARS:
+                last = text.rfind(" |", start, last)
+        # [\S ]+ needs at least one character between the first and the last
+        if last >= start + 3:
+            return text[start:last]
+    return None
+
+
+def extract_cu(text, find_policy=None, find_title=None):
+    if find_title != None:
+        title = find_title(text)
+    else:
+        match = CU_re["TITLE"].search(text)
+        title = None
+        if match != None:
+            title = match.group(1)
+
+    if find_policy != None:
+        text = find_policy(text)
+        if text == None:
+            return None
+    else:
+        match = CU_re["POLICY"].search(text)
+        if match == None:
+            return None
+        text = match.group(3).strip()
 
     text = "SECTION-HEADER Policy Statement. " + text
 
     if title != None:
         text = "SECTION-HEADER " + title + ". " + text
 
-    text = remove_inline_defs(text)
-
-    # get rid of bullets
-    text = CU_re["BULLET"].sub(" ", text)
+    return text
 
-    # normalize university names
-    text = CU_re["UNIVERSITY"].sub('The University', text)
 
-    # make sure there is a period before each line break
-    text = CU_re["FIX_SENT"].sub("\g<1>.\n", text)
+EXTRACT_CU_STAGE = step(extract_cu, fallback=lambda text: extract_cu(text, find_cu_policy, find_cu_title))
 
-    # Remove annoying punctuation, that's not relevant
-    text = BAD_PUNCT_RE.sub('', text)
+extract_cu_policy = Cleaner('extract_cu', UNICODE_STAGES + [EXTRACT_CU_STAGE])
 
-    # removing newlines, tabs, and extra spaces.
-    text = WHITESPACE_RE.sub(' ', text)
 
-    # If we ended up with "empty" sentences - get rid of them.
-    text = EMPTY_SENT_RE.sub('.', text)
+def build_inline_dictionary(texts):
+    """
+    The inline definitions of a whole corpus of CU policies, to remove from
+    every policy with make_clean_cu(dictionary).
+    """
+    dictionary = set()
+    for text in texts:
+        dictionary |= find_inline_defs(extract_cu_policy(text))
+    return frozenset(dictionary)
 
-    # Attempt to create sentences from bullets
-    text = replace_semicolon(text)
 
-    # Get rid of anything thats not a word from the start of the text
-    text = FIX_START_RE.sub('', text)
+def make_clean_cu(dictionary=None):
+    """
+    The CU cleaner. Without a dictionary each policy only loses its own
+    inline definitions.
+    """
+    version = 'clean_cu:{}'.format(CLEAN_VERSION)
+    if dictionary is not None:
+        version += ':' + text_digest('\n'.join(sorted(dictionary)))
 
-    # Sometimes periods get formatted weird, make sure there is a space between periods and start of sent
-    text = FIX_PERIOD.sub(". \g<1>", text)
+    if dictionary is None:
+        remove_defs = step(remove_inline_defs, fallback=_remove_dictionary_defs(None))
+    else:
+        remove_defs = step(lambda text: remove_inline_defs(text, dictionary), 'remove_inline_defs (dictionary)',
+                           fallback=_remove_dictionary_defs(dictionary))
 
-    # Fix quotes
-    text = text.replace('``', '"')
-    text = text.replace('\'\'', '"')
+    return cached(version)(Cleaner('clean_cu', UNICODE_STAGES + [
+        EXTRACT_CU_STAGE,
+        remove_defs,
+        # get rid of bullets
+        sub(CU_re["BULLET"], " "),
+        # normalize university names
+        sub(CU_re["UNIVERSITY"], 'The University'),
+        # make sure there is a period before each line break
+        sub(CU_re["FIX_SENT"], "\g<1>.\n"),
+        # Remove annoying punctuation, that's not relevant
+        sub(BAD_PUNCT_RE, ''),
+    ] + SENTENCE_STAGES))
 
-    # Add special punct back in
-    text = text.replace('SECTION-HEADER', '<SECTION-HEADER>')
 
-    return text
+clean_cu = make_clean_cu()
 
 
 DAYTON_re = {
@@ -307,15 +464,7 @@ DAYTON_re = {
 }
 
 
-def clean_dayton(text):
-    text = text.replace("\u200b", "")
-    text = text.replace("\u00a0", " ")
-    text = text.replace("\u2022", "")
-    text = text.replace("\u2019", "'")
-    text = text.replace("\u2013", "-")
-    text = text.replace("\u201c", "\"")
-    text = text.replace("\u201d", '"')
-
+def extract_dayton(text):
     title = None
     match = DAYTON_re["TITLE"].search(text)
     if match != None:
@@ -323,7 +472,7 @@ def clean_dayton(text):
 
     match = DAYTON_re["START"].findall(text)
     if match == []:
-        return ""
+        return None
     start_idx = text.find(match[-1])
 
     end_idx = len(text)
@@ -336,35 +485,16 @@ def clean_dayton(text):
     if title != None:
         text = "SECTION-HEADER " + title + ". " + text
 
-    # make sure there is a period before each line break
-    text = DAYTON_re["FIX_SENT"].sub("\g<1>.\n", text)
-
-    # Remove annoying punctuation, that's not relevant
-    text = BAD_PUNCT_RE.sub('', text)
-
-    # removing newlines, tabs, and extra spaces.
-    text = WHITESPACE_RE.sub(' ', text)
-
-    # If we ended up with "empty" sentences - get rid of them.
-    text = EMPTY_SENT_RE.sub('.', text)
-
-    # Attempt to create sentences from bullets
-    text = replace_semicolon(text)
-
-    # Get rid of anything thats not a word from the start of the text
-    text = FIX_START_RE.sub('', text)
-
-    # Sometimes periods get formatted weird, make sure there is a space between periods and start of sent
-    text = FIX_PERIOD.sub(". \g<1>", text)
-
-    # Fix quotes
-    text = text.replace('``', '"')
-    text = text.replace('\'\'', '"')
+    return text
 
-    # Add special punct back in
-    text = text.replace('SECTION-HEADER', '<SECTION-HEADER>')
 
-    return text
+clean_dayton = cached('clean_dayton:{}'.format(CLEAN_VERSION))(Cleaner('clean_dayton', UNICODE_STAGES + [
+    step(extract_dayton),
+    # make sure there is a period before each line break
+    sub(DAYTON_re["FIX_SENT"], "\g<1>.\n"),
+    # Remove annoying punctuation, that's not relevant
+    sub(BAD_PUNCT_RE, ''),
+] + SENTENCE_STAGES))
 
 
 PSU_re = {
@@ -388,20 +518,14 @@ def clean_uoregon(text):
     raise Exception("unimplemented")
 
 
-def split_by_university(data):
-    uni_data = {"cmu": pd.DataFrame(columns=['university', 'name', 'policy', 'summary']),
-                "cu": pd.DataFrame(columns=['university', 'name', 'policy', 'summary']),
-                "dayton": pd.DataFrame(columns=['university', 'name', 'policy', 'summary']),
-                "psu": pd.DataFrame(columns=['university', 'name', 'policy', 'summary']),
-                "uoregon": pd.DataFrame(columns=['university', 'name', 'policy', 'summary'])}
-
-    for idx, row in data.iterrows():
-        uni = row["university"]
-        uni_data[uni] = uni_data[uni].append(row, ignore_index=True)
-
-    for uni in uni_data.keys():
-        save_path = os.path.join(prefix, "data_uni_sep", uni + ".json")
-        uni_data[uni].to_json(save_path, orient='records')
+def split_by_university(data, output_dir=None):
+    """
+    Split a DataFrame of all policies into output_dir/<university>.json
+    (default: $SUM_DATA/data_uni_sep), see split_universities.py
+    """
+    if output_dir is None:
+        output_dir = os.path.join(os.environ['SUM_DATA'], "data_uni_sep")
+    split_universities.split_by_university(data.to_dict('records'), output_dir)
 
 
 if __name__ == '__main__':
@@ -1,65 +1,310 @@
 '''
 Methods to prepare sentences for extractive sentences training.
 '''
+from collections import deque, namedtuple, OrderedDict
 import jsonlines
+import multiprocessing
 import os
 import pickle
 import re
-from rouge import Rouge
 import spacy
+import time
 
-nlp = spacy.load('en')
-rouge = Rouge()
+from billsum.utils import batch_rouge
+from billsum.utils.sentence_store import DOC_FIELDS, write_store
+from billsum.utils.sentence_utils import Word
+
+# An annotation profile: the spacy components it does not need, and the
+# fields of utils.sentence_utils.Word it fills in (the others are None).
+# Without the parser, sentences come from the sentencizer; without the
+# tagger, lemmas are spacy's lookup lemmas.
+Profile = namedtuple('Profile', ['disable', 'fields'])
+
+PROFILES = OrderedDict([
+    ('lemma', Profile(['tagger', 'parser', 'ner'], ['text', 'i', 'lemma_'])),
+    ('tag', Profile(['parser', 'ner'], ['text', 'i', 'lemma_', 'pos_'])),
+    ('ner', Profile(['parser'], ['text', 'i', 'lemma_', 'ent_type_', 'ent_iob_', 'pos_'])),
+    ('full', Profile([], list(Word._fields))),
+])
+
+DEFAULT_PROFILE = 'full'
+
+
+_pipelines = {}
+
+
+def load_nlp(profile):
+    '''
+    The en pipeline without the components the profile does not need
+    (loaded once per process)
+    '''
+    if profile not in _pipelines:
+        nlp = spacy.load('en', disable=PROFILES[profile].disable)
+        if 'parser' in PROFILES[profile].disable:
+            nlp.add_pipe(nlp.create_pipe('sentencizer'))
+        _pipelines[profile] = nlp
+    return _pipelines[profile]
+
+
+current_profile = DEFAULT_PROFILE
+nlp = load_nlp(current_profile)
 
 section_pattern = re.compile('(SECTION)|(Sec)|(Section) [0-9]+')
 
 
-def spacy_to_tuple(doc):
-    text_feats = [(w.string, w.i, w.lemma_, w.ent_type_, w.ent_iob_, w.pos_, w.dep_, w.head.i)
-                                    for w in doc]
-    return text_feats
+def use_profile(name):
+    '''
+    Switch the pipeline used by this module to another profile
+    '''
+    global current_profile, nlp
+    if name not in PROFILES:
+        raise ValueError('Unknown annotation profile {}, expected one of {}'.format(name, ', '.join(PROFILES)))
+    if name != current_profile:
+        nlp = load_nlp(name)
+        current_profile = name
+
+
+_WORD_VALUES = {
+    'text': lambda w: w.string,
+    'i': lambda w: w.i,
+    'lemma_': lambda w: w.lemma_,
+    'ent_type_': lambda w: w.ent_type_,
+    'ent_iob_': lambda w: w.ent_iob_,
+    'pos_': lambda w: w.pos_,
+    'dep_': lambda w: w.dep_,
+    'head': lambda w: w.head.i,
+}
+
+
+def spacy_to_tuple(doc, fields=None):
+    '''
+    The Word tuples of a doc or span. Fields not in fields (default: those
+    of the current profile) are None.
+    '''
+    if fields is None:
+        fields = PROFILES[current_profile].fields
+    if len(fields) == len(Word._fields):
+        return [(w.string, w.i, w.lemma_, w.ent_type_, w.ent_iob_, w.pos_, w.dep_, w.head.i)
+                for w in doc]
 
-def prepare_summary(bill_data):
-    
-    final_summary_data = {}
-    i = 0
+    values = [_WORD_VALUES[f] if f in fields else None for f in Word._fields]
+    return [tuple(v(w) if v is not None else None for v in values) for w in doc]
 
-    for _, bill in bill_data.iterrows():
 
-        bill_id = bill['bill_id']
+def read_bills(path):
+    '''
+    Stream the bills of a jsonl file as dicts
+    '''
+    with jsonlines.open(path) as reader:
+        for bill in reader:
+            yield bill
 
-        # Keep track of progress
-        i += 1
-        if i % 100 == 0:
-            print("Processed {} summaries".format(i))
 
-        text_nlp = nlp(bill['summary'])
+def keep_fields(bills, fields, kept):
+    '''
+    Pass the bills through, recording the given fields of each in kept,
+    by bill_id
+    '''
+    for bill in bills:
+        kept[bill['bill_id']] = {f: bill.get(f) for f in fields}
+        yield bill
+
+
+def _iter_bills(bill_data):
+    # A DataFrame, or any iterable of dicts
+    if hasattr(bill_data, 'iterrows'):
+        return (bill for _, bill in bill_data.iterrows())
+    return iter(bill_data)
+
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def summary_sents(doc):
+    '''
+    Features of every sentence of a parsed summary
+    '''
+    return [spacy_to_tuple(sent) for sent in doc.sents]
 
-        doc_data = []
 
-        for sent in text_nlp.sents:
+def label_sents(doc, summary, min_sent_words=5, metrics=None):
+    '''
+    (sentence, features, rouge scores against the summary) of every sentence
+    of a parsed text with more than min_sent_words words
+
+    metrics: rouge metrics to score (default: all three)
+    '''
+    sent_data = []
+    if len(summary) == 0:
+        return sent_data
+
+    # The summary is tokenized once, for all sentences
+    metrics = metrics or batch_rouge.METRICS
+    reference = batch_rouge.Reference(summary, metrics)
+
+    for sent in doc.sents:
+
+        # Skip sents with less than 5 words
+        if len(sent) > min_sent_words:
+
             # Store key features from each sentence
             text_feats = spacy_to_tuple(sent)
-            doc_data.append(text_feats)
-            
-        final_summary_data[bill_id] = doc_data
 
-    return final_summary_data
+            # Create rouge scores
+            if len(sent.string) == 0:
+                continue
+
+            rscores = reference.score(sent.string, metrics)
+
+            sent_data.append((sent.string, text_feats, rscores))
 
+    return sent_data
 
-def prepare_labels(bill_data,  min_sent_words=5):
+
+KIND_NAMES = {'labels': 'texts', 'summary': 'summaries', 'both': 'texts and summaries'}
+
+
+def annotate_chunk(task):
+    '''
+    task: (kind, list of (bill_id, clean_text, clean_summary, summary),
+        batch_size, min_sent_words, profile, metrics)
+        kind is 'labels', 'summary' or 'both' - the fields a kind does not
+        use may be None
+
+    Returns list of (bill_id, data, number of docs, number of tokens), data
+    as in prepare_labels or prepare_summary, or a pair of both
+    '''
+    kind, bills, batch_size, min_sent_words, task_profile, metrics = task
+    use_profile(task_profile)
+
+    # Texts and summaries go through one stream of batches
+    texts = []
+    for _, text, _, summary in bills:
+        if kind != 'summary':
+            texts.append(text)
+        if kind != 'labels':
+            texts.append(summary)
+    docs = iter(nlp.pipe(texts, batch_size=batch_size))
+
+    results = []
+    for bill_id, _, clean_summary, _ in bills:
+        n_docs = n_tokens = 0
+        if kind != 'summary':
+            doc = next(docs)
+            labels = label_sents(doc, clean_summary, min_sent_words, metrics)
+            n_docs += 1
+            n_tokens += len(doc)
+        if kind != 'labels':
+            doc = next(docs)
+            sums = summary_sents(doc)
+            n_docs += 1
+            n_tokens += len(doc)
+
+        data = labels if kind == 'labels' else sums if kind == 'summary' else (labels, sums)
+        results.append((bill_id, data, n_docs, n_tokens))
+    return results
+
+
+def _bill_task_fields(bill, kind):
+    if kind == 'labels':
+        return bill['bill_id'], bill['clean_text'], bill['clean_summary'], None
+    if kind == 'summary':
+        return bill['bill_id'], None, None, bill['summary']
+    return bill['bill_id'], bill['clean_text'], bill['clean_summary'], bill['summary']
+
+
+def annotate_bills(kind, bills, batch_size=32, n_process=1, min_sent_words=5, chunk_size=None, profile=None,
+                   metrics=None):
+    '''
+    Parse the bills with nlp.pipe, in n_process processes. Chunks of
+    chunk_size bills (default: 4 batches) are sent to the processes, and a
+    bounded number of them is in flight, so bills can be streamed.
+
+    kind: 'labels', 'summary' or 'both'
+    profile: annotation profile (default: the current one)
+    metrics: rouge metrics of the sentence labels (default: all three)
+
+    Returns dict of bill_id -> data, and prints the throughput in docs/sec
+    and tokens/sec
+    '''
+    chunk_size = chunk_size or 4 * batch_size
+    profile = profile or current_profile
+
+    tasks = ((kind, [_bill_task_fields(bill, kind) for bill in chunk], batch_size, min_sent_words, profile, metrics)
+             for chunk in _chunks(_iter_bills(bills), chunk_size))
+
+    final_data = {}
+    n_docs = n_tokens = 0
+    start = time.time()
+
+    def add(results):
+        nonlocal n_docs, n_tokens
+        for bill_id, data, docs, tokens in results:
+            final_data[bill_id] = data
+            n_docs += docs
+            n_tokens += tokens
+            if len(final_data) % 100 == 0:
+                print("Processed {} bills".format(len(final_data)))
+
+    if n_process == 1:
+        previous = current_profile
+        try:
+            for task in tasks:
+                add(annotate_chunk(task))
+        finally:
+            use_profile(previous)
+    else:
+        pending = deque()
+        with multiprocessing.Pool(n_process) as pool:
+            for task in tasks:
+                if len(pending) >= 2 * n_process:
+                    add(pending.popleft().get())
+                pending.append(pool.apply_async(annotate_chunk, (task,)))
+            while pending:
+                add(pending.popleft().get())
+
+    elapsed = max(time.time() - start, 1e-9)
+    print("Parsed {} {} of {} bills in {:.1f}s ({:.1f} docs/sec, {:.0f} tokens/sec)".format(
+        n_docs, KIND_NAMES[kind], len(final_data), elapsed, n_docs / elapsed, n_tokens / elapsed))
+    return final_data
+
+
+def prepare_summary(bill_data, batch_size=32, n_process=1, profile=None):
+    '''
+    Take in bills (a DataFrame or iterable of dicts with a bill_id and
+    summary), and return dict of bill-id - list of the spacy annotations of
+    every sentence of the summary.
+    '''
+    return annotate_bills('summary', bill_data, batch_size, n_process, profile=profile)
+
+
+def prepare_labels(bill_data, min_sent_words=5, batch_size=32, n_process=1, profile=None, metrics=None):
     '''
     Take in a list of data for bills 
 
     and returns a per sentence score for
     every sentence in each document.
 
-    bill_data: list of dicts where each dict 
-            has a summary, bill_id and text field
+    bill_data: list of dicts (or a DataFrame) where each dict 
+            has a clean_summary, bill_id and clean_text field
     
     min_sent_words: skip sentences in text with
         less words.
 
+    batch_size, n_process: texts per nlp.pipe batch, number of processes
+
+    profile: annotation profile, see PROFILES (default: the current one)
+
+    metrics: rouge metrics to score, e.g. ['rouge-2'] (default: all three)
+
     Output: dict of bill-id - list of sent data 
         where sent data is a three tuple of original sentence, list of word 
         with spacy annotations and the rscores of that sentence relative to the summary.
@@ -67,48 +312,43 @@ def prepare_labels(bill_data,  min_sent_words=5):
         The annotations follow the format of utils.sentence_utils.Word
 
     '''
+    return annotate_bills('labels', bill_data, batch_size, n_process, min_sent_words, profile=profile,
+                          metrics=metrics)
 
-    final_scores = {}
-    i = 0
-
-    for _, bill in bill_data.iterrows():
-
-        bill_id = bill['bill_id']
 
-        # Keep track of progress
-        if i % 100 == 0:
-            print(i, len(final_scores))
-
-        i += 1
-
-        text_nlp = nlp(bill['clean_text'])
-
-        sent_data = []
-
-        for sent in text_nlp.sents:
-
-            # Skip sents with less than 5 words
-            if len(sent) > min_sent_words:
-            
-                # Store key features from each sentence
-                text_feats = spacy_to_tuple(sent)
-            
-                # Create rouge scores                  
-                if len(sent.string) == 0 or len(bill['clean_summary']) == 0:
-                    continue
-                
-                rscores = rouge.get_scores([sent.string],[bill['clean_summary']])[0]
+def prepare_split(bill_data, min_sent_words=5, batch_size=32, n_process=1, profile=None, metrics=None):
+    '''
+    prepare_labels and prepare_summary in a single pass: every bill is read
+    once, and its text and summary are parsed in the same batches.
 
-                sent_data.append((sent.string, text_feats, rscores))
+    Returns (sentence labels, summary sentences), as the two functions do
+    '''
+    both = annotate_bills('both', bill_data, batch_size, n_process, min_sent_words, profile=profile,
+                          metrics=metrics)
 
+    sent_scores = {}
+    sum_sents = {}
+    for bill_id, (labels, sums) in both.items():
+        sent_scores[bill_id] = labels
+        sum_sents[bill_id] = sums
+    return sent_scores, sum_sents
 
-        final_scores[bill_id] = sent_data
 
-    return final_scores
+if __name__ == '__main__':
+    import argparse
 
+    parser = argparse.ArgumentParser(description='Parse and label the sentences of every split')
+    parser.add_argument('--batch-size', type=int, default=32,
+                        help='Texts per nlp.pipe batch')
+    parser.add_argument('--n-process', type=int, default=1,
+                        help='Number of processes parsing')
+    parser.add_argument('--profile', choices=list(PROFILES), default=DEFAULT_PROFILE,
+                        help='Annotations to compute and store (lemma < tag < ner < full)')
+    parser.add_argument('--metrics', nargs='+', choices=batch_rouge.METRICS,
+                        help='Rouge metrics of the sentence labels (default: all three)')
+    args = parser.parse_args()
 
-if __name__ == '__main__':
-    import pandas as pd 
+    use_profile(args.profile)
 
     prefix = os.environ['BILLSUM_PREFIX']
 
@@ -117,30 +357,16 @@ if __name__ == '__main__':
 
     #os.mkdir(prefix + 'sent_data/')
 
-    print("Preparing US Train")
-    data = pd.read_json(prefix + 'clean_final/us_train_data_final.jsonl', lines=True)
-    sent_scores = prepare_labels(data)
-    pickle.dump(sent_scores, open(prefix + 'sent_data/us_train_sent_scores.pkl', 'wb'))
-
-    sum_sents = prepare_summary(data)
-    pickle.dump(sum_sents, open(prefix + 'sent_data/us_train_sum_sents.pkl', 'wb'))
-
-
-    print("Preparing US Test")
-    data = pd.read_json(prefix + 'clean_final/us_test_data_final.jsonl', lines=True)
-    sent_scores = prepare_labels(data)
-    pickle.dump(sent_scores, open(prefix + 'sent_data/us_test_sent_scores.pkl', 'wb'))
-
-    sum_sents = prepare_summary(data)
-    pickle.dump(sum_sents, open(prefix + 'sent_data/us_test_sum_sents.pkl', 'wb'))
-
-
-    print("Preparing CA Test")
-    data = pd.read_json(prefix + 'clean_final/ca_test_data_final.jsonl', lines=True)
-    sent_scores = prepare_labels(data)
-    pickle.dump(sent_scores, open(prefix + 'sent_data/ca_test_sent_scores.pkl', 'wb'))
-
-    sum_sents = prepare_summary(data)
-    pickle.dump(sum_sents, open(prefix + 'sent_data/ca_test_sum_sents.pkl', 'wb'))
-
-
+    for name, locality, split in [('US Train', 'us', 'train'), ('US Test', 'us', 'test'), ('CA Test', 'ca', 'test')]:
+        print("Preparing", name)
+        data_path = prefix + 'clean_final/{}_{}_data_final.jsonl'.format(locality, split)
+
+        # The summaries and titles stored with the sentences, kept while the bills are read
+        docs = {}
+        sent_scores, sum_sents = prepare_split(keep_fields(read_bills(data_path), DOC_FIELDS, docs),
+                                               batch_size=args.batch_size, n_process=args.n_process,
+                                               metrics=args.metrics)
+        write_store(prefix + 'sent_data/{}_{}_sent_scores.store'.format(locality, split),
+                    ((bill_id, sents, docs[bill_id]) for bill_id, sents in sent_scores.items()),
+                    DOC_FIELDS)
+        pickle.dump(sum_sents, open(prefix + 'sent_data/{}_{}_sum_sents.pkl'.format(locality, split), 'wb'))
@@ -0,0 +1,389 @@
+'''
+Label a split in shards, resumably, with any number of workers.
+
+The bills of the input jsonl file are cut into shards of --shard-size bills,
+always the same for the same input. A worker claims a shard by creating
+WORK_DIR/shard_NNNNN.claim (with O_EXCL, so only one worker gets it), labels
+its bills and writes the shard's outputs:
+
+    shard_NNNNN.store           sentence store of its bills (sentence_store.py)
+    shard_NNNNN_sum_sents.pkl   its summary sentences
+    shard_NNNNN.done            written last - the shard is finished
+
+Every output is written to a temporary name and renamed, so an interrupted
+worker leaves no partial shard behind. Finished shards are skipped, so
+rerunning the same command resumes the run. Several workers, on one machine
+or on several sharing WORK_DIR, can run at once and split the shards between
+them. A worker keeps the mtime of its claim fresh from a background thread
+while it works; the claim of a worker that died is taken over once it is
+older than --reclaim-after seconds. A worker only ever removes a claim that
+still holds its own id, and stops writing a shard's outputs once its claim
+was taken over.
+
+Once all shards are done, merge assembles the final sentence store and
+summary sentence pickle, in the order of the input.
+
+Usage:
+    python billsum/data_prep/label_shards.py work INPUT.jsonl WORK_DIR [--shard-size 500]
+        [--batch-size 32] [--n-process 1] [--profile full] [--metrics ...] [--reclaim-after 600]
+    python billsum/data_prep/label_shards.py status WORK_DIR
+    python billsum/data_prep/label_shards.py merge WORK_DIR SENT_SCORES.store SUM_SENTS.pkl
+'''
+import argparse
+import json
+import os
+import pickle
+import socket
+import threading
+import time
+
+from billsum.data_prep import label_sentences
+from billsum.utils.sentence_store import DOC_FIELDS, SentenceStore, write_store
+
+DEFAULT_SHARD_SIZE = 500
+
+# Seconds after which the claim of a worker that stopped touching it is taken over
+DEFAULT_RECLAIM_AFTER = 600
+
+# Touch the claim every this many seconds - well below --reclaim-after
+HEARTBEAT_SECONDS = 30
+
+MANIFEST = 'shards.json'
+
+
+def worker_id():
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+def _shard_path(work_dir, shard, suffix):
+    return os.path.join(work_dir, 'shard_{:05d}{}'.format(shard, suffix))
+
+
+def _write_atomic(path, data, mode='w'):
+    tmp_path = '{}.tmp.{}'.format(path, worker_id())
+    with open(tmp_path, mode) as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def plan_shards(input_file, shard_size):
+    '''
+    Byte offset of the first bill of every shard, and the number of bills
+    '''
+    offsets = []
+    n_bills = 0
+    with open(input_file, 'rb') as f:
+        offset = 0
+        for line in f:
+            if line.strip():
+                if n_bills % shard_size == 0:
+                    offsets.append(offset)
+                n_bills += 1
+            offset += len(line)
+    return offsets, n_bills
+
+
+def load_manifest(work_dir, input_file=None, shard_size=None, settings=None):
+    '''
+    The manifest of the run in work_dir. The first worker plans the shards
+    and writes it; the others check that they were started the same way.
+    '''
+    path = os.path.join(work_dir, MANIFEST)
+    if not os.path.exists(path):
+        if input_file is None:
+            raise ValueError('{} has no {} - start a worker on it first'.format(work_dir, MANIFEST))
+
+        offsets, n_bills = plan_shards(input_file, shard_size)
+        manifest = {'input': os.path.abspath(input_file), 'input_size': os.path.getsize(input_file),
+                    'input_mtime': os.path.getmtime(input_file), 'shard_size': shard_size, 'n_bills': n_bills,
+                    'offsets': offsets, 'settings': settings}
+        tmp_path = '{}.tmp.{}'.format(path, worker_id())
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        try:
+            # Fails if another worker wrote it first
+            os.link(tmp_path, path)
+        except FileExistsError:
+            pass
+        os.remove(tmp_path)
+
+    with open(path) as f:
+        manifest = json.load(f)
+
+    if input_file is not None:
+        # The offsets are only good for the same file, unchanged
+        expected = {'input': os.path.abspath(input_file), 'input_size': os.path.getsize(input_file),
+                    'input_mtime': os.path.getmtime(input_file), 'shard_size': shard_size, 'settings': settings}
+        for key, value in expected.items():
+            if manifest.get(key) != value:
+                raise ValueError('{} was started with {} {}, not {} - use another work directory'.format(
+                    work_dir, key, manifest.get(key), value))
+    return manifest
+
+
+def read_shard(manifest, shard):
+    '''
+    The bills of a shard, as dicts
+    '''
+    bills = []
+    with open(manifest['input'], 'rb') as f:
+        f.seek(manifest['offsets'][shard])
+        for line in f:
+            if not line.strip():
+                continue
+            bills.append(json.loads(line))
+            if len(bills) == manifest['shard_size']:
+                break
+    return bills
+
+
+def is_done(work_dir, shard):
+    return os.path.exists(_shard_path(work_dir, shard, '.done'))
+
+
+class ClaimLost(Exception):
+    pass
+
+
+def _claim_owner(path):
+    # The worker id in a claim file, None if there is none
+    try:
+        with open(path) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def claim_shard(work_dir, shard, reclaim_after=DEFAULT_RECLAIM_AFTER):
+    '''
+    Try to claim a shard for this worker. Returns True if it got it.
+    '''
+    path = _shard_path(work_dir, shard, '.claim')
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        owner = _claim_owner(path)
+        try:
+            age = time.time() - os.path.getmtime(path)
+        except FileNotFoundError:
+            # Just released
+            return False
+        if owner is None or reclaim_after is None or age < reclaim_after:
+            return False
+
+        # Stale: move it out of the way - only one worker can - and claim again
+        stale = '{}.stale.{}'.format(path, worker_id())
+        try:
+            os.rename(path, stale)
+        except FileNotFoundError:
+            return False
+        if _claim_owner(stale) != owner:
+            # Another worker took the shard over first, and this is its new
+            # claim - put it back
+            try:
+                os.link(stale, path)
+            except FileExistsError:
+                pass
+            os.remove(stale)
+            return False
+        os.remove(stale)
+        print('Taking over shard {} (claim not touched for {:.0f}s)'.format(shard, age))
+        return claim_shard(work_dir, shard, None)
+
+    with os.fdopen(fd, 'w') as f:
+        f.write(worker_id())
+    return True
+
+
+def owns_claim(work_dir, shard):
+    '''
+    True if the claim of a shard is held by this worker
+    '''
+    return _claim_owner(_shard_path(work_dir, shard, '.claim')) == worker_id()
+
+
+def release_shard(work_dir, shard):
+    # The claim may have been taken over by another worker meanwhile
+    if not owns_claim(work_dir, shard):
+        return
+    try:
+        os.remove(_shard_path(work_dir, shard, '.claim'))
+    except FileNotFoundError:
+        pass
+
+
+def _heartbeat(work_dir, shard, stop, lost):
+    # Keep the claim fresh until stop is set, or set lost once it is taken over
+    while not stop.wait(HEARTBEAT_SECONDS):
+        try:
+            if owns_claim(work_dir, shard):
+                os.utime(_shard_path(work_dir, shard, '.claim'))
+                continue
+        except FileNotFoundError:
+            pass
+        print('Claim of shard {} was taken over'.format(shard))
+        lost.set()
+        return
+
+
+def label_shard(work_dir, manifest, shard, batch_size=32, n_process=1):
+    '''
+    Label the bills of a claimed shard and write its outputs.
+
+    Returns the number of bills. Raises ClaimLost, without writing any more
+    outputs, once another worker took the shard over.
+    '''
+    settings = manifest['settings']
+    bills = read_shard(manifest, shard)
+
+    stop = threading.Event()
+    lost = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(work_dir, shard, stop, lost), daemon=True)
+    heartbeat.start()
+
+    def check_claim():
+        if lost.is_set() or not owns_claim(work_dir, shard):
+            raise ClaimLost('Shard {} was taken over by another worker'.format(shard))
+
+    try:
+        sent_scores, sum_sents = label_sentences.prepare_split(
+            bills, settings['min_sent_words'], batch_size, n_process, settings['profile'], settings['metrics'])
+
+        # A worker that took over the shard may be writing the same store
+        check_claim()
+        store_path = _shard_path(work_dir, shard, '.store')
+        write_store(store_path, ((bill['bill_id'], sent_scores[bill['bill_id']], bill) for bill in bills),
+                    DOC_FIELDS, '{}.tmp.{}'.format(store_path, worker_id()))
+        check_claim()
+        _write_atomic(_shard_path(work_dir, shard, '_sum_sents.pkl'), pickle.dumps(sum_sents), 'wb')
+        check_claim()
+        _write_atomic(_shard_path(work_dir, shard, '.done'),
+                      json.dumps({'bills': len(bills), 'worker': worker_id(), 'finished': time.time()}))
+    finally:
+        stop.set()
+        heartbeat.join()
+    return len(bills)
+
+
+def run_worker(input_file, work_dir, shard_size=DEFAULT_SHARD_SIZE, batch_size=32, n_process=1,
+               profile=None, metrics=None, min_sent_words=5, reclaim_after=DEFAULT_RECLAIM_AFTER):
+    '''
+    Label every shard that is neither done nor claimed by another worker.
+
+    Returns the number of shards this worker labeled
+    '''
+    os.makedirs(work_dir, exist_ok=True)
+    settings = {'profile': profile or label_sentences.DEFAULT_PROFILE, 'metrics': metrics,
+                'min_sent_words': min_sent_words}
+    manifest = load_manifest(work_dir, input_file, shard_size, settings)
+    n_shards = len(manifest['offsets'])
+
+    labeled = 0
+    for shard in range(n_shards):
+        if is_done(work_dir, shard) or not claim_shard(work_dir, shard, reclaim_after):
+            continue
+        try:
+            # Finished by another worker between the two checks
+            if is_done(work_dir, shard):
+                continue
+            start = time.time()
+            try:
+                n = label_shard(work_dir, manifest, shard, batch_size, n_process)
+            except ClaimLost as e:
+                print(e)
+                continue
+            labeled += 1
+            print('Shard {}/{}: labeled {} bills in {:.1f}s'.format(shard + 1, n_shards, n, time.time() - start))
+        finally:
+            release_shard(work_dir, shard)
+
+    print_status(work_dir)
+    return labeled
+
+
+def shard_status(work_dir):
+    '''
+    (done, claimed, waiting) shard numbers
+    '''
+    manifest = load_manifest(work_dir)
+    done, claimed, waiting = [], [], []
+    for shard in range(len(manifest['offsets'])):
+        if is_done(work_dir, shard):
+            done.append(shard)
+        elif os.path.exists(_shard_path(work_dir, shard, '.claim')):
+            claimed.append(shard)
+        else:
+            waiting.append(shard)
+    return done, claimed, waiting
+
+
+def print_status(work_dir):
+    done, claimed, waiting = shard_status(work_dir)
+    print('{}: {} shards done, {} being labeled, {} waiting'.format(work_dir, len(done), len(claimed), len(waiting)))
+
+
+def merge_shards(work_dir, store_path, sum_sents_path):
+    '''
+    Assemble the sentence store and summary sentences of all shards, in
+    input order. Every shard must be done.
+
+    Returns the number of bills
+    '''
+    done, claimed, waiting = shard_status(work_dir)
+    if claimed or waiting:
+        raise ValueError('{} shards of {} are not done yet'.format(len(claimed) + len(waiting), work_dir))
+
+    def items():
+        for shard in done:
+            store = SentenceStore(_shard_path(work_dir, shard, '.store'))
+            for bill_id in store:
+                yield bill_id, store[bill_id], {f: store.doc_field(bill_id, f) for f in store.doc_fields}
+
+    n = write_store(store_path, items(), DOC_FIELDS)
+
+    sum_sents = {}
+    for shard in done:
+        with open(_shard_path(work_dir, shard, '_sum_sents.pkl'), 'rb') as f:
+            sum_sents.update(pickle.load(f))
+    _write_atomic(sum_sents_path, pickle.dumps(sum_sents), 'wb')
+
+    print('Merged {} bills from {} shards'.format(n, len(done)))
+    return n
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Label a split in resumable shards')
+    commands = parser.add_subparsers(dest='command')
+
+    work = commands.add_parser('work', help='Label the shards that are left')
+    work.add_argument('input', help='jsonl file of bills with bill_id, clean_text, clean_summary and summary')
+    work.add_argument('work_dir')
+    work.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE,
+                      help='Bills per shard (must be the same for every worker)')
+    work.add_argument('--batch-size', type=int, default=32,
+                      help='Texts per nlp.pipe batch')
+    work.add_argument('--n-process', type=int, default=1,
+                      help='Number of processes parsing')
+    work.add_argument('--profile', choices=list(label_sentences.PROFILES), default=label_sentences.DEFAULT_PROFILE)
+    work.add_argument('--metrics', nargs='+', choices=label_sentences.batch_rouge.METRICS)
+    work.add_argument('--reclaim-after', type=float, default=DEFAULT_RECLAIM_AFTER,
+                      help='Seconds after which the claim of a stopped worker is taken over')
+
+    status = commands.add_parser('status', help='Count the shards done')
+    status.add_argument('work_dir')
+
+    merge = commands.add_parser('merge', help='Assemble the outputs of all shards')
+    merge.add_argument('work_dir')
+    merge.add_argument('store', help='sentence store to write')
+    merge.add_argument('sum_sents', help='summary sentence pickle to write')
+    args = parser.parse_args()
+
+    if args.command == 'work':
+        run_worker(args.input, args.work_dir, args.shard_size, args.batch_size, args.n_process,
+                   args.profile, args.metrics, reclaim_after=args.reclaim_after)
+    elif args.command == 'status':
+        print_status(args.work_dir)
+    elif args.command == 'merge':
+        merge_shards(args.work_dir, args.store, args.sum_sents)
+    else:
+        parser.print_help()
@@ -0,0 +1,83 @@
+'''
+Find or remove many literal strings in one pass over a text.
+
+PatternSet puts the strings in a trie and compiles the trie into a single
+regex, so that at every position of the text the regex engine follows at
+most one branch per character, instead of trying every string in turn.
+Matches are leftmost-longest and do not overlap, like an Aho-Corasick scan
+that keeps the longest match at every start.
+'''
+from functools import lru_cache
+import re
+
+
+def _trie(patterns):
+    root = {}
+    for pattern in patterns:
+        node = root
+        for ch in pattern:
+            node = node.setdefault(ch, {})
+        # end of a pattern
+        node[''] = None
+    return root
+
+
+def _trie_regex(node):
+    alts = []
+    for ch, child in sorted(node.items()):
+        if not ch:
+            continue
+        # Follow chains without branches iteratively, patterns can be long
+        chain = [ch]
+        while len(child) == 1 and '' not in child:
+            (ch, child), = child.items()
+            chain.append(ch)
+        alts.append(re.escape(''.join(chain)) + _trie_regex(child))
+    if not alts:
+        return ''
+
+    ends = '' in node
+    if len(alts) == 1 and not ends:
+        return alts[0]
+
+    # Greedy - the longer patterns are tried first
+    return '(?:' + '|'.join(alts) + ')' + ('?' if ends else '')
+
+
+class PatternSet:
+    '''
+    A set of literal strings, compiled into one regex.
+    '''
+
+    def __init__(self, patterns):
+        self.patterns = sorted(set(p for p in patterns if p))
+        self.regex = re.compile(_trie_regex(_trie(self.patterns))) if self.patterns else None
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def find(self, text):
+        '''
+        Leftmost-longest non-overlapping occurrences, as (start, end) in order
+        '''
+        if self.regex is None:
+            return []
+        return [m.span() for m in self.regex.finditer(text)]
+
+    def remove(self, text):
+        '''
+        text without the occurrences found by find
+        '''
+        if self.regex is None:
+            return text
+        return self.regex.sub('', text)
+
+
+@lru_cache(maxsize=256)
+def pattern_set(patterns):
+    '''
+    PatternSet of a frozenset of strings, cached - building it costs more
+    than a scan, and the same set (e.g. a corpus dictionary) is used again
+    and again.
+    '''
+    return PatternSet(patterns)
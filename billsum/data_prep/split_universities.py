@@ -0,0 +1,191 @@
+'''
+Split the combined university policy data into one file per university.
+
+The combined data is read once, as a stream of records, and every record
+is appended to data_uni_sep/<university>.json as soon as it is read. The
+files are written in the same format as DataFrame.to_json(orient='records'),
+so they read back with pd.read_json as before. Universities are taken from
+the records, there is no fixed list.
+
+Usage:
+    python billsum/data_prep/split_universities.py POLICIES [--output-dir DIR]
+
+POLICIES is a jsonl file of records, or a json array of records (such as the
+files written here). Both are streamed, so memory stays bounded by the
+largest record.
+'''
+import argparse
+import json
+import os
+import time
+
+# Always written, even if they have no policies
+UNIVERSITIES = ['cmu', 'cu', 'dayton', 'psu', 'uoregon']
+
+
+# Characters read at a time from a json array
+READ_SIZE = 1 << 16
+
+
+def _read_json_array(f):
+    '''
+    Yield the elements of the json array in f, whose '[' was already read,
+    without loading the whole array. A read that ends inside an element is
+    followed by a larger one, so a long element is decoded O(log n) times.
+    '''
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+    need_comma = False
+    after_comma = False
+
+    while True:
+        while pos < len(buf) and buf[pos].isspace():
+            pos += 1
+        if pos == len(buf):
+            if eof:
+                raise ValueError('Unterminated json array')
+            buf = f.read(READ_SIZE)
+            pos = 0
+            eof = not buf
+            continue
+
+        if buf[pos] == ']' and not after_comma:
+            return
+        if need_comma:
+            if buf[pos] != ',':
+                raise ValueError('Expected , or ] in json array, got {!r}'.format(buf[pos]))
+            pos += 1
+            need_comma = False
+            after_comma = True
+            continue
+
+        try:
+            value, end = decoder.raw_decode(buf, pos)
+            # A number may go on past the end of the buffer (2.5|e3)
+            if not eof and buf[pos] not in '{["tfn' and (end == len(buf) or buf[end] not in ' \t\r\n,]'):
+                raise ValueError('Incomplete element')
+        except ValueError:
+            if eof:
+                raise
+            more = f.read(max(READ_SIZE, len(buf) - pos))
+            buf = buf[pos:] + more
+            pos = 0
+            eof = not more
+            continue
+
+        yield value
+        pos = end
+        need_comma = True
+        after_comma = False
+
+
+def read_policies(path):
+    '''
+    Yield the records of a jsonl file, or of a json array - both are
+    streamed.
+    '''
+    with open(path) as f:
+        first = f.read(1)
+        while first.isspace():
+            first = f.read(1)
+
+        if first == '[':
+            for record in _read_json_array(f):
+                yield record
+            return
+
+        f.seek(0)
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def to_records_json(record):
+    '''
+    Serialize a record like DataFrame.to_json: no spaces, '/' escaped
+    '''
+    return json.dumps(record, separators=(',', ':')).replace('/', '\\/')
+
+
+class UniversityWriter:
+    '''
+    Appends records to a json array file per university. Files are written
+    to <uni>.json.tmp and renamed when closed.
+    '''
+
+    def __init__(self, output_dir, universities=UNIVERSITIES):
+        self.output_dir = output_dir
+        self.files = {}
+        self.counts = {}
+        for uni in universities:
+            self._open(uni)
+
+    def _path(self, uni):
+        return os.path.join(self.output_dir, uni + '.json')
+
+    def _open(self, uni):
+        f = open(self._path(uni) + '.tmp', 'w')
+        f.write('[')
+        self.files[uni] = f
+        self.counts[uni] = 0
+        return f
+
+    def write(self, record):
+        uni = record['university']
+        f = self.files.get(uni) or self._open(uni)
+        if self.counts[uni]:
+            f.write(',')
+        f.write(to_records_json(record))
+        self.counts[uni] += 1
+
+    def close(self):
+        for uni, f in self.files.items():
+            f.write(']')
+            f.close()
+            os.replace(self._path(uni) + '.tmp', self._path(uni))
+        self.files = {}
+
+    def abort(self):
+        '''
+        Remove the unfinished files, leaving earlier outputs in place
+        '''
+        for uni, f in self.files.items():
+            f.close()
+            os.remove(self._path(uni) + '.tmp')
+        self.files = {}
+
+
+def split_by_university(records, output_dir):
+    '''
+    Write every record to output_dir/<record['university']>.json, keeping
+    their order.
+
+    Returns dict of university -> number of policies
+    '''
+    start = time.time()
+    writer = UniversityWriter(output_dir)
+    try:
+        for record in records:
+            writer.write(record)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+
+    print('Split {} policies into {} universities in {:.1f}s'.format(
+        sum(writer.counts.values()), len(writer.counts), time.time() - start))
+    return writer.counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Split the combined policy data by university')
+    parser.add_argument('policies', help='jsonl file or json array of policy records')
+    parser.add_argument('--output-dir',
+                        help='Default: $SUM_DATA/data_uni_sep')
+    args = parser.parse_args()
+
+    output_dir = args.output_dir or os.path.join(os.environ['SUM_DATA'], 'data_uni_sep')
+    os.makedirs(output_dir, exist_ok=True)
+    split_by_university(read_policies(args.policies), output_dir)
@@ -8,8 +8,8 @@ from billsum.post_process import greedy_summarize, mmr_selection
 import os
 import pandas as pd 
 import pickle 
-from rouge import Rouge
-rouge = Rouge()
+from billsum.utils import batch_rouge
+from billsum.utils.sentence_store import SentenceStore
 
 
 prefix = os.environ['BILLSUM_PREFIX']
@@ -39,7 +39,7 @@ for locality in ['us', 'ca']:
 
     # Load in the sentence data
 
-    sent_data = pickle.load(open(prefix + 'sent_data/{}_test_sent_scores.pkl'.format(locality), 'rb'))
+    sent_data = SentenceStore(prefix + 'sent_data/{}_test_sent_scores.store'.format(locality))
 
     docs = pd.read_json(prefix + 'clean_final/{}_test_data_final.jsonl'.format(locality), lines=True)
     docs.set_index('bill_id', inplace=True)
@@ -72,7 +72,7 @@ for locality in ['us', 'ca']:
 
         final_sum = ' '.join(mmr_selection(mysents, Y))
         
-        rscore = rouge.get_scores([docs.loc[bill_id].clean_summary], [final_sum])[0]
+        rscore = batch_rouge.score(docs.loc[bill_id].clean_summary, final_sum)
         all_scores[bill_id] = rscore
  
 
@@ -9,7 +9,7 @@ import numpy as np
 import os
 import pickle
 
-from rouge import Rouge
+from billsum.utils import batch_rouge
 
 from sumy.parsers.plaintext import PlaintextParser
 from sumy.nlp.tokenizers import Tokenizer
@@ -27,8 +27,6 @@ ALL_SUMMARIZERS = [('sumbasic', SumBasicSummarizer),
                    ('kl', KLSummarizer),
                    ('lsa', LsaSummarizer)]
 
-rouge = Rouge()
-
 LANGUAGE = 'en'
 stemmer = Stemmer(LANGUAGE)
 
@@ -83,7 +81,7 @@ for file in os.listdir(os.path.join(prefix, 'clean_final')):
                 summary_len = 2000
                 final_sents = greedy_summarize(*zip(*sent_scores), summary_len=summary_len)
                 final_sum = ' '.join(final_sents)
-                score = rouge.get_scores([summary], [final_sum])[0]
+                score = batch_rouge.score(summary, final_sum)
                 all_scores[bill_id][name] = score
             
             except KeyboardInterrupt:
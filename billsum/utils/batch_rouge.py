@@ -0,0 +1,210 @@
+'''
+ROUGE scores, as computed by the rouge package (rouge.Rouge().get_scores),
+to the last bit: rouge-1 and rouge-2 over the sets of n-grams, and
+summary-level rouge-l over the union of the longest common subsequences.
+Every script scores through this module:
+
+    from billsum.utils import batch_rouge
+    batch_rouge.score(hyp, ref)                   # one pair
+    batch_rouge.score_sentences(sents, summary)   # many hypotheses, one reference
+
+The reference is split, tokenized and counted once (Reference) for all the
+hypotheses scored against it. Rouge-l runs a bit-parallel LCS over integer
+codes of the words (lcs_words) instead of a table of every pair of words;
+see rouge_benchmark.py. Only the metrics asked for are computed, e.g.
+metrics=['rouge-2'].
+'''
+
+METRICS = ['rouge-1', 'rouge-2', 'rouge-l']
+STATS = ['f', 'p', 'r']
+
+
+def split_sentences(text):
+    '''
+    The sentences of a text as the rouge package sees them: split on '.',
+    with runs of whitespace collapsed to one space
+    '''
+    return [' '.join(s.split()) for s in text.split('.') if len(s) > 0]
+
+
+def _words(sentences):
+    words = []
+    for s in sentences:
+        words.extend(s.split(' '))
+    return words
+
+
+def _ngrams(words, n):
+    if n == 1:
+        return set(words)
+    return set(zip(*[words[i:] for i in range(n)]))
+
+
+def _check_metrics(metrics, stats):
+    for m in metrics:
+        if m not in METRICS:
+            raise ValueError("Unknown metric '%s'" % m)
+    for s in stats:
+        if s not in STATS:
+            raise ValueError("Unknown stat '%s'" % s)
+
+
+def _f_r_p_rouge_n(evaluated_count, reference_count, overlapping_count):
+    # Same operations as rouge.rouge_score.f_r_p_rouge_n
+    precision = 0.0 if evaluated_count == 0 else overlapping_count / evaluated_count
+    recall = 0.0 if reference_count == 0 else overlapping_count / reference_count
+    f1_score = 2.0 * ((precision * recall) / (precision + recall + 1e-8))
+    return {'f': f1_score, 'p': precision, 'r': recall}
+
+
+def _f_r_p_rouge_l(llcs, m, n):
+    # Same operations as rouge.rouge_score.rouge_l_summary_level
+    r_lcs = llcs / m
+    p_lcs = llcs / n
+    beta = p_lcs / (r_lcs + 1e-12)
+    num = (1 + (beta**2)) * r_lcs * p_lcs
+    denom = r_lcs + ((beta**2) * p_lcs)
+    f_lcs = num / (denom + 1e-12)
+    return {'f': f_lcs, 'p': p_lcs, 'r': r_lcs}
+
+
+def _masks(codes):
+    '''
+    Bitmask of the positions of every code in a sequence
+    '''
+    masks = {}
+    for j, code in enumerate(codes):
+        masks[code] = masks.get(code, 0) | (1 << j)
+    return masks
+
+
+def lcs_words(x, y, y_masks=None):
+    '''
+    The words of the longest common subsequence of x and y that the rouge
+    package picks (rouge_score._recon_lcs), as a set.
+
+    Which subsequence is picked matters, as only its words are counted: the
+    table is traced back from the end, taking a match when the words are
+    equal, else going up when that keeps a longer subsequence, else left.
+
+    The table is computed a row at a time, as a bit vector over y (Hyyrö's
+    bit-parallel LCS): bit j of row i is 0 where table[i][j + 1] is one more
+    than table[i][j]. That is all the traceback needs - without a match,
+    going up keeps a longer subsequence exactly when going left loses one.
+
+    x, y: sequences of words, or of integer codes
+    y_masks: _masks(y), if already known
+    '''
+    if y_masks is None:
+        y_masks = _masks(y)
+    full = (1 << len(y)) - 1
+
+    rows = [full]
+    v = full
+    for word in x:
+        u = v & y_masks.get(word, 0)
+        v = ((v + u) | (v - u)) & full
+        rows.append(v)
+
+    words = set()
+    i, j = len(x), len(y)
+    while i > 0 and j > 0:
+        if x[i - 1] == y[j - 1]:
+            words.add(x[i - 1])
+            i -= 1
+            j -= 1
+        elif (rows[i] >> (j - 1)) & 1:
+            j -= 1
+        else:
+            i -= 1
+    return words
+
+
+class Reference:
+    '''
+    A summary, split and tokenized once, with what every metric needs of it.
+    '''
+
+    def __init__(self, text, metrics=METRICS):
+        self.text = text
+        self.sentences = split_sentences(text)
+        if len(self.sentences) == 0:
+            raise ValueError('Collections must contain at least 1 sentence.')
+
+        words = _words(self.sentences)
+        self.ngrams = {}
+        if 'rouge-1' in metrics:
+            self.ngrams[1] = _ngrams(words, 1)
+        if 'rouge-2' in metrics:
+            self.ngrams[2] = _ngrams(words, 2)
+        if 'rouge-l' in metrics:
+            # Words as integer codes, for the LCS kernel
+            self.vocab = {}
+            self.sentence_codes = [[self.vocab.setdefault(w, len(self.vocab)) for w in s.split(' ')]
+                                   for s in self.sentences]
+            self.sentence_sets = [set(codes) for codes in self.sentence_codes]
+            self.n_unique = len(self.vocab)
+
+    def rouge_n(self, words, n):
+        evaluated = _ngrams(words, n)
+        reference = self.ngrams[n]
+        return _f_r_p_rouge_n(len(evaluated), len(reference), len(evaluated & reference))
+
+    def rouge_l(self, sentences, words):
+        '''
+        Summary-level rouge-l of the split sentences of a hypothesis
+        '''
+        # Words not in the summary are -1, and match nothing
+        hyp_codes = [[self.vocab.get(w, -1) for w in s.split(' ')] for s in sentences]
+        hyp_masks = [_masks(codes) for codes in hyp_codes]
+
+        union = set()
+        for ref_codes, ref_set in zip(self.sentence_codes, self.sentence_sets):
+            for codes, masks in zip(hyp_codes, hyp_masks):
+                # No common word, no common subsequence
+                if ref_set.isdisjoint(masks):
+                    continue
+                union |= lcs_words(ref_codes, codes, masks)
+
+        return _f_r_p_rouge_l(len(union), self.n_unique, len(set(words)))
+
+    def score(self, hyp, metrics=METRICS, stats=STATS):
+        '''
+        The scores of hyp against this reference, in the layout of
+        Rouge.get_scores: {metric: {stat: value}}
+        '''
+        sentences = split_sentences(hyp)
+        if len(sentences) == 0:
+            raise ValueError('Collections must contain at least 1 sentence.')
+        words = _words(sentences)
+
+        scores = {}
+        for m in metrics:
+            if m == 'rouge-l':
+                sc = self.rouge_l(sentences, words)
+            else:
+                sc = self.rouge_n(words, 1 if m == 'rouge-1' else 2)
+            scores[m] = {s: sc[s] for s in stats}
+        return scores
+
+
+def score_sentences(sents, summary, metrics=None, stats=None):
+    '''
+    Scores of every sentence (hypothesis) against the summary (reference),
+    as rouge.Rouge(metrics, stats).get_scores([sent], [summary])[0] for each.
+
+    summary: text, or a Reference built with at least these metrics
+    '''
+    metrics = METRICS if metrics is None else [m.lower() for m in metrics]
+    stats = STATS if stats is None else [s.lower() for s in stats]
+    _check_metrics(metrics, stats)
+
+    reference = summary if isinstance(summary, Reference) else Reference(summary, metrics)
+    return [reference.score(sent, metrics, stats) for sent in sents]
+
+
+def score(hyp, ref, metrics=None, stats=None):
+    '''
+    rouge.Rouge(metrics, stats).get_scores([hyp], [ref])[0]
+    '''
+    return score_sentences([hyp], ref, metrics, stats)[0]
@@ -2,8 +2,7 @@ import os
 import pandas as pd 
 import pickle
 
-from rouge import Rouge
-rouge = Rouge()
+from billsum.utils import batch_rouge
 
 prefix = os.environ['BILLSUM_PREFIX']
 
@@ -27,7 +26,7 @@ for locality in ['us', 'ca']:
 		if len(row['my_sum']) > 2000:
 			raise ValueError("Your summary is too long for bill {}".format(row['bill_id']))
 		# Find relevant summary in docs and compute rouge
-		rscore = rouge.get_scores([docs.loc[row['bill_id']].clean_summary], [row['my_sum']])[0]
+		rscore = batch_rouge.score(docs.loc[row['bill_id']].clean_summary, row['my_sum'])
 
 		all_rscores.append(rscore)
 
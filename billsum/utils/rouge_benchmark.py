@@ -0,0 +1,114 @@
+'''
+Benchmark batch_rouge against the rouge package on long pairs.
+
+Every pair is a summary of --summary-chars characters against a bill of
+--text-chars characters (2,000 and 20,000 by default), scored both ways
+round. Summaries and bills are cut from the records of a jsonl file,
+joining consecutive records when one is too short. Records without the
+summary field lend their text instead.
+
+Prints the time per pair of both implementations, for rouge-l alone and for
+all three metrics, and checks that their scores are equal.
+
+Usage:
+    python billsum/utils/rouge_benchmark.py [BILLS.jsonl] [--pairs 5]
+        [--summary-chars 2000] [--text-chars 20000]
+        [--text-field clean_text] [--summary-field clean_summary]
+'''
+import argparse
+import json
+import time
+
+from rouge import Rouge
+
+from billsum.utils import batch_rouge
+
+
+def read_records(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def cut_texts(texts, chars, count, start=0):
+    '''
+    count texts of chars characters, from consecutive texts from index
+    start on (wrapping around)
+    '''
+    texts = [t for t in texts if t]
+    if not texts:
+        raise ValueError('No texts to cut')
+
+    out = []
+    k = start
+    for _ in range(count):
+        parts = []
+        length = 0
+        while length < chars:
+            parts.append(texts[k % len(texts)])
+            length += len(parts[-1]) + 1
+            k += 1
+        out.append(' '.join(parts)[:chars])
+    return out
+
+
+def time_pairs(fn, pairs):
+    '''
+    (seconds per pair, scores) of fn over (hyp, ref) pairs
+    '''
+    scores = []
+    start = time.perf_counter()
+    for hyp, ref in pairs:
+        try:
+            scores.append(fn(hyp, ref))
+        except RecursionError:
+            # rouge traces the lcs back recursively
+            scores.append('RecursionError')
+    return (time.perf_counter() - start) / len(pairs), scores
+
+
+def benchmark(summaries, texts):
+    '''
+    Time both implementations on summary/text and text/summary pairs.
+
+    Returns dict of (order, metrics, implementation) -> seconds per pair
+    '''
+    results = {}
+    orders = [('summary vs bill', list(zip(summaries, texts))),
+              ('bill vs summary', list(zip(texts, summaries)))]
+    for order, pairs in orders:
+        for metrics in (['rouge-l'], batch_rouge.METRICS):
+            rouge = Rouge(metrics=metrics)
+            package_secs, expected = time_pairs(lambda hyp, ref: rouge.get_scores([hyp], [ref])[0], pairs)
+            batch_secs, scores = time_pairs(lambda hyp, ref: batch_rouge.score(hyp, ref, metrics), pairs)
+            if scores != expected:
+                raise AssertionError('Scores differ on {} ({})'.format(order, ', '.join(metrics)))
+
+            name = ', '.join(metrics)
+            results[order, name, 'rouge'] = package_secs
+            results[order, name, 'batch_rouge'] = batch_secs
+            print('{:16s} {:26s} rouge {:8.1f} ms/pair   batch_rouge {:7.2f} ms/pair   x{:.0f}'.format(
+                order, name, 1000 * package_secs, 1000 * batch_secs, package_secs / max(batch_secs, 1e-12)))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark batch_rouge against the rouge package')
+    parser.add_argument('bills', nargs='?', default='test_data/clean_corpus/bills.jsonl',
+                        help='jsonl file of records')
+    parser.add_argument('--pairs', type=int, default=5)
+    parser.add_argument('--summary-chars', type=int, default=2000)
+    parser.add_argument('--text-chars', type=int, default=20000)
+    parser.add_argument('--text-field', default='clean_text',
+                        help='Field of the bill texts (falls back to text)')
+    parser.add_argument('--summary-field', default='clean_summary')
+    args = parser.parse_args()
+
+    records = read_records(args.bills)
+    texts = [r.get(args.text_field) or r.get('text') for r in records]
+    summaries = [r.get(args.summary_field) or r.get(args.text_field) or r.get('text') for r in records]
+
+    print('{} pairs of {} character summaries and {} character bills'.format(
+        args.pairs, args.summary_chars, args.text_chars))
+    # Start the summaries half way, so that they are not cut from the same text as the bills
+    benchmark(cut_texts(summaries, args.summary_chars, args.pairs, len(records) // 2),
+              cut_texts(texts, args.text_chars, args.pairs))
@@ -0,0 +1,475 @@
+'''
+A columnar on-disk store of labeled sentence data, read through memory maps.
+
+It holds the same data as the sent_scores pickles of label_sentences.py -
+dict of bill_id -> list of (sentence text, list of Word tuples, rouge
+scores) - as flat arrays in a directory:
+
+    meta.json               counts, token fields, score columns, dtypes
+    bill_ids.json           bill_ids in document order
+    docs.bin                int64 sentence offset of every document (+ end)
+    sents.bin               int64 token offset of every sentence (+ end)
+    sent_text.bin           utf-8 text of all sentences
+    sent_text_offsets.bin   int64 byte offset of every sentence text (+ end)
+    tok_<field>.bin         one column per Word field: the strings as codes
+                            into vocab_<field>.json, i and head as ints, -1
+                            for None
+    score_<metric>_<stat>.bin  float32 score of every sentence
+    doc_<field>.bin, doc_<field>_offsets.bin
+                            utf-8 text and byte offsets of a field of every
+                            document (clean_summary, clean_title), if stored
+
+Opening a store reads meta.json and the bill_ids only; the columns are
+memory-mapped when first used, so the pages are read on demand and shared
+between processes reading the same store.
+
+    store = SentenceStore(prefix + 'sent_data/us_train_sent_scores.store')
+    sents = store['bill_id']      # as in the pickle
+    for bill_id, sents in store.items():
+        ...
+
+store.bill(bill_id) and store.bills() return whole bills - sentences,
+annotations, scores, summary and title - in the format the models of
+classifiers/classifier_scorer.py take.
+
+Scores are float32. They are read back rounded to 7 decimals, so that
+ratios such as 1/10 compare to thresholds (0.1) as they did before; labels()
+compares the float32 columns directly.
+
+Convert a pickle with
+    python billsum/utils/sentence_store.py convert us_train_sent_scores.pkl us_train_sent_scores.store
+        [--bills clean_final/us_train_data_final.jsonl]
+(--bills to take the summaries and titles from)
+'''
+import json
+import os
+import pickle
+import shutil
+
+import numpy as np
+
+from billsum.utils.sentence_utils import Word
+
+STORE_VERSION = 1
+
+STRING_FIELDS = ['text', 'lemma_', 'ent_type_', 'ent_iob_', 'pos_', 'dep_']
+
+# Few distinct values, 16 bit codes
+SMALL_FIELDS = ['ent_type_', 'ent_iob_', 'pos_', 'dep_']
+
+# Fields of the bill records kept for every document
+DOC_FIELDS = ['clean_summary', 'clean_title']
+
+
+def _dtype(field):
+    return np.int16 if field in SMALL_FIELDS else np.int32
+
+
+def _score_name(metric, stat):
+    return 'score_{}_{}'.format(metric, stat)
+
+
+class SentenceStoreWriter:
+    '''
+    Writes documents to a store one at a time, without keeping them in
+    memory. The store is written to <path>.tmp and moved to path when
+    closed.
+
+    doc_fields: fields of the bill records to keep, see add
+    tmp_path: directory to write to instead of <path>.tmp, for writers
+        that may run at the same time for the same path
+    '''
+
+    def __init__(self, path, doc_fields=(), tmp_path=None):
+        self.path = path
+        self.tmp_path = tmp_path or path.rstrip('/') + '.tmp'
+        if os.path.exists(self.tmp_path):
+            shutil.rmtree(self.tmp_path)
+        os.makedirs(self.tmp_path)
+
+        self.bill_ids = []
+        self.fields = None
+        self.scores = None
+        self.vocabs = {f: {} for f in STRING_FIELDS}
+        self.n_sents = 0
+        self.n_tokens = 0
+        self.n_text_bytes = 0
+        self.doc_fields = list(doc_fields)
+        self.doc_bytes = {f: 0 for f in self.doc_fields}
+        self.files = {}
+
+        self._write('docs', np.array([0], dtype=np.int64))
+        self._write('sents', np.array([0], dtype=np.int64))
+        self._write('sent_text_offsets', np.array([0], dtype=np.int64))
+        for field in self.doc_fields:
+            self._write('doc_{}_offsets'.format(field), np.array([0], dtype=np.int64))
+
+    def _write(self, name, data):
+        '''
+        Append an array, or bytes, to a column file
+        '''
+        if name not in self.files:
+            self.files[name] = open(os.path.join(self.tmp_path, name + '.bin'), 'wb')
+        if isinstance(data, bytes):
+            self.files[name].write(data)
+        else:
+            data.tofile(self.files[name])
+
+    def _code(self, field, value):
+        if value is None:
+            return -1
+        vocab = self.vocabs[field]
+        return vocab.setdefault(value, len(vocab))
+
+    def _set_columns(self, sents):
+        # The fields and scores are those of the first sentence
+        text, words, scores = sents[0]
+        self.fields = [f for f, v in zip(Word._fields, words[0]) if v is not None] if words else list(Word._fields)
+        self.scores = [(m, s) for m in sorted(scores) for s in sorted(scores[m])]
+
+    def add(self, bill_id, sents, doc=None):
+        '''
+        Append a document: a list of (sentence text, list of Word tuples,
+        rouge scores) as in the pickles.
+
+        doc: the bill record (a dict), for the doc_fields. Missing fields
+            are stored as ''.
+        '''
+        if self.fields is None and sents:
+            self._set_columns(sents)
+
+        self.bill_ids.append(bill_id)
+        texts = []
+        text_offsets = []
+        sent_offsets = []
+        columns = {f: [] for f in Word._fields}
+        scores = {name: [] for name in self.scores or []}
+
+        for text, words, rscores in sents:
+            encoded = text.encode('utf-8')
+            texts.append(encoded)
+            self.n_text_bytes += len(encoded)
+            text_offsets.append(self.n_text_bytes)
+
+            for k, field in enumerate(Word._fields):
+                column = columns[field]
+                if field in STRING_FIELDS:
+                    column.extend(self._code(field, w[k]) for w in words)
+                else:
+                    column.extend(-1 if w[k] is None else w[k] for w in words)
+            self.n_tokens += len(words)
+            sent_offsets.append(self.n_tokens)
+
+            try:
+                for m, s in scores:
+                    scores[m, s].append(rscores[m][s])
+            except KeyError:
+                raise ValueError('Sentence of {} does not have the {} scores of the first sentence'.format(
+                    bill_id, ', '.join(m + ' ' + s for m, s in self.scores)))
+
+        self.n_sents += len(sents)
+        self._write('docs', np.array([self.n_sents], dtype=np.int64))
+        self._write('sents', np.array(sent_offsets, dtype=np.int64))
+        self._write('sent_text', b''.join(texts))
+        self._write('sent_text_offsets', np.array(text_offsets, dtype=np.int64))
+        for field in self.fields or []:
+            self._write('tok_' + field, np.array(columns[field], dtype=_dtype(field)))
+        for (m, s), values in scores.items():
+            self._write(_score_name(m, s), np.array(values, dtype=np.float32))
+
+        for field in self.doc_fields:
+            encoded = ((doc or {}).get(field) or '').encode('utf-8')
+            self.doc_bytes[field] += len(encoded)
+            self._write('doc_' + field, encoded)
+            self._write('doc_{}_offsets'.format(field), np.array([self.doc_bytes[field]], dtype=np.int64))
+
+    def close(self):
+        for field in SMALL_FIELDS:
+            if len(self.vocabs[field]) > np.iinfo(np.int16).max:
+                raise ValueError('Too many distinct {} values for a 16 bit column'.format(field))
+
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+        fields = self.fields or []
+        meta = {'version': STORE_VERSION, 'n_docs': len(self.bill_ids), 'n_sents': self.n_sents,
+                'n_tokens': self.n_tokens, 'fields': fields, 'scores': self.scores or [],
+                'dtypes': {f: np.dtype(_dtype(f)).name for f in fields}, 'doc_fields': self.doc_fields}
+        self._dump('meta', meta)
+        self._dump('bill_ids', self.bill_ids)
+        for field in STRING_FIELDS:
+            if field in fields:
+                # Codes are assigned in insertion order
+                self._dump('vocab_' + field, list(self.vocabs[field]))
+
+        # Move an older store out of the way first, so the store at path is
+        # never a mix of two
+        old_path = self.tmp_path.rstrip('/') + '.old'
+        try:
+            os.rename(self.path, old_path)
+        except FileNotFoundError:
+            old_path = None
+        os.rename(self.tmp_path, self.path)
+        if old_path is not None:
+            shutil.rmtree(old_path)
+
+    def abort(self):
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+        shutil.rmtree(self.tmp_path)
+
+    def _dump(self, name, data):
+        with open(os.path.join(self.tmp_path, name + '.json'), 'w') as f:
+            json.dump(data, f)
+
+
+def write_store(path, items, doc_fields=(), tmp_path=None):
+    '''
+    Write (bill_id, list of sentence data) pairs, or (bill_id, list of
+    sentence data, bill record) triples, to a store at path.
+
+    Returns the number of documents
+    '''
+    writer = SentenceStoreWriter(path, doc_fields, tmp_path)
+    try:
+        for item in items:
+            writer.add(*item)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+    return len(writer.bill_ids)
+
+
+class SentenceStore:
+    '''
+    A store written by SentenceStoreWriter, read through memory maps.
+
+    Reads like the dict of the pickles: store[bill_id], bill_id in store,
+    iteration over the bill_ids in document order, items().
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        if self.meta['version'] != STORE_VERSION:
+            raise ValueError('{} is a version {} sentence store, expected {}'.format(
+                path, self.meta['version'], STORE_VERSION))
+
+        with open(os.path.join(path, 'bill_ids.json')) as f:
+            self.bill_ids = json.load(f)
+        self.index = {bill_id: k for k, bill_id in enumerate(self.bill_ids)}
+
+        self.fields = self.meta['fields']
+        # Stores written before documents had fields have none
+        self.doc_fields = self.meta.get('doc_fields', [])
+        self.score_names = [tuple(name) for name in self.meta['scores']]
+        self._columns = {}
+        self._vocabs = {}
+
+    def __len__(self):
+        return len(self.bill_ids)
+
+    def __contains__(self, bill_id):
+        return bill_id in self.index
+
+    def __iter__(self):
+        return iter(self.bill_ids)
+
+    def keys(self):
+        return list(self.bill_ids)
+
+    def column(self, name, dtype=np.int64):
+        '''
+        The memory map of a column (e.g. 'tok_lemma_', 'docs')
+        '''
+        if name not in self._columns:
+            path = os.path.join(self.path, name + '.bin')
+            if os.path.getsize(path) == 0:
+                # mmap can not map an empty file
+                self._columns[name] = np.zeros(0, dtype=dtype)
+            else:
+                self._columns[name] = np.memmap(path, dtype=dtype, mode='r')
+        return self._columns[name]
+
+    def vocab(self, field):
+        if field not in self._vocabs:
+            with open(os.path.join(self.path, 'vocab_' + field + '.json')) as f:
+                self._vocabs[field] = json.load(f)
+        return self._vocabs[field]
+
+    def token_column(self, field):
+        return self.column('tok_' + field, np.dtype(self.meta['dtypes'][field]))
+
+    def score_column(self, metric, stat):
+        '''
+        float32 scores of all sentences, in document order
+        '''
+        return self.column(_score_name(metric, stat), np.float32)
+
+    def labels(self, metric='rouge-2', stat='p', threshold=0.1):
+        '''
+        Boolean array of score > threshold over all sentences. The threshold
+        is compared in float32, like the scores.
+        '''
+        return self.score_column(metric, stat) > np.float32(threshold)
+
+    def sentence_range(self, bill_id):
+        '''
+        (first, end) sentence numbers of a document
+        '''
+        k = self.index[bill_id]
+        docs = self.column('docs')
+        return int(docs[k]), int(docs[k + 1])
+
+    def _texts(self, name, first, end):
+        '''
+        Texts first to end (exclusive) of a utf-8 column and its offsets
+        '''
+        offsets = self.column(name + '_offsets')[first:end + 1].tolist()
+        blob = self.column(name, np.uint8)
+        data = bytes(blob[offsets[0]:offsets[-1]]) if offsets[-1] > offsets[0] else b''
+        start = offsets[0]
+        return [data[a - start:b - start].decode('utf-8') for a, b in zip(offsets, offsets[1:])]
+
+    def sentence_texts(self, bill_id):
+        first, end = self.sentence_range(bill_id)
+        return self._texts('sent_text', first, end)
+
+    def doc_field(self, bill_id, field):
+        '''
+        A field of the bill record (e.g. clean_summary), None if the store
+        does not have it
+        '''
+        if field not in self.doc_fields:
+            return None
+        k = self.index[bill_id]
+        return self._texts('doc_' + field, k, k + 1)[0]
+
+    def tokens(self, bill_id):
+        '''
+        The Word tuples of every sentence of a document
+        '''
+        first, end = self.sentence_range(bill_id)
+        offsets = self.column('sents')[first:end + 1].tolist()
+        if not offsets or offsets[-1] == offsets[0]:
+            return [[] for _ in range(end - first)]
+
+        lo, hi = offsets[0], offsets[-1]
+        values = []
+        for field in Word._fields:
+            if field not in self.fields:
+                values.append([None] * (hi - lo))
+                continue
+            codes = self.token_column(field)[lo:hi].tolist()
+            if field in STRING_FIELDS:
+                vocab = self.vocab(field)
+                values.append([vocab[c] if c >= 0 else None for c in codes])
+            else:
+                values.append([c if c >= 0 else None for c in codes])
+        words = list(zip(*values))
+
+        return [words[a - lo:b - lo] for a, b in zip(offsets, offsets[1:])]
+
+    def scores(self, bill_id):
+        '''
+        The rouge scores of every sentence of a document, as dicts
+        {metric: {stat: value}}
+        '''
+        first, end = self.sentence_range(bill_id)
+        scores = [{} for _ in range(end - first)]
+        for m, s in self.score_names:
+            for sc, value in zip(scores, self.score_column(m, s)[first:end].tolist()):
+                sc.setdefault(m, {})[s] = round(value, 7)
+        return scores
+
+    def __getitem__(self, bill_id):
+        '''
+        The sentence data of a document as in the pickles: list of (text,
+        list of Word tuples, rouge scores)
+        '''
+        return list(zip(self.sentence_texts(bill_id), self.tokens(bill_id), self.scores(bill_id)))
+
+    def items(self):
+        '''
+        Lazily yield (bill_id, sentence data) in document order
+        '''
+        for bill_id in self.bill_ids:
+            yield bill_id, self[bill_id]
+
+    def bill(self, bill_id):
+        '''
+        A bill as the models take it: dict with the bill_id, the Word tuples
+        of every sentence ('doc'), their 'scores' and texts ('sent_texts'),
+        the clean summary ('sum_text') and title ('title') - None if not in
+        the store
+        '''
+        return {'bill_id': bill_id, 'doc': self.tokens(bill_id), 'scores': self.scores(bill_id),
+                'sent_texts': self.sentence_texts(bill_id), 'sum_text': self.doc_field(bill_id, 'clean_summary'),
+                'title': self.doc_field(bill_id, 'clean_title')}
+
+    def bills(self, bill_ids=None):
+        '''
+        Lazily yield the bill of every bill_id in bill_ids (default: all of
+        them, in document order)
+        '''
+        for bill_id in self.bill_ids if bill_ids is None else bill_ids:
+            yield self.bill(bill_id)
+
+
+def read_doc_fields(bills_path, doc_fields=DOC_FIELDS):
+    '''
+    dict of bill_id -> dict of the doc_fields, of a jsonl file of bills
+    '''
+    docs = {}
+    with open(bills_path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            bill = json.loads(line)
+            # CA data may have an external_id instead
+            bill_id = bill.get('bill_id', bill.get('external_id'))
+            docs[bill_id] = {field: bill.get(field) for field in doc_fields}
+    return docs
+
+
+def convert_pickle(pickle_path, store_path, bills_path=None):
+    '''
+    Write the sent_scores pickle at pickle_path as a store, with the
+    DOC_FIELDS of the bills in the jsonl file bills_path, if given
+    '''
+    with open(pickle_path, 'rb') as f:
+        sent_data = pickle.load(f)
+    if bills_path is None:
+        return write_store(store_path, sent_data.items())
+
+    docs = read_doc_fields(bills_path)
+    return write_store(store_path, ((bill_id, sents, docs.get(bill_id)) for bill_id, sents in sent_data.items()),
+                       DOC_FIELDS)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Sentence stores')
+    commands = parser.add_subparsers(dest='command')
+    convert = commands.add_parser('convert', help='Convert a sent_scores pickle into a store')
+    convert.add_argument('pickle')
+    convert.add_argument('store')
+    convert.add_argument('--bills',
+                         help='jsonl file of the bills, to store their clean summaries and titles')
+    info = commands.add_parser('info', help='Print the size of a store')
+    info.add_argument('store')
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        n = convert_pickle(args.pickle, args.store, args.bills)
+        print('Wrote {} documents to {}'.format(n, args.store))
+    elif args.command == 'info':
+        store = SentenceStore(args.store)
+        print(json.dumps(store.meta, indent=2))
+    else:
+        parser.print_help()
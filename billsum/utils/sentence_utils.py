@@ -33,6 +33,33 @@ def spacy_to_tuple(doc):
     return text_feats
 
 
+def available_fields(sents):
+    '''
+    The Word fields filled in (not None) in sentence data - a Doc, or a list
+    of sentences of Word tuples. None if there are no words.
+    '''
+    for sent in sents:
+        for word in sent:
+            return set(f for f, v in zip(Word._fields, word) if v is not None)
+    return None
+
+
+def check_fields(required, docs, user):
+    '''
+    Raise a ValueError if any of docs lacks a field in required - the data
+    was annotated with a profile that does not provide it. user names what
+    needs the fields, for the error.
+    '''
+    for doc in docs:
+        fields = available_fields(doc)
+        if fields is None:
+            continue
+        missing = [f for f in required if f not in fields]
+        if missing:
+            raise ValueError('{} needs the {} annotations, which the sentence data does not have. '
+                             'Label the sentences with a profile that provides them'.format(user, ', '.join(missing)))
+
+
 def list_to_doc(input_sents):
     '''
     Takes in a list of sentence data and wraps everything in the classes
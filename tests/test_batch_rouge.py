@@ -0,0 +1,104 @@
+'''
+batch_rouge must give the scores of rouge.Rouge().get_scores, to the last bit.
+
+    python -m pytest tests
+'''
+import random
+import unittest
+
+from rouge import Rouge
+
+from billsum.utils import batch_rouge
+
+SUMMARY = 'The bill amends the tax code. It extends the credit for research to small firms.'
+
+SENTENCES = [
+    'The bill amends the tax code',
+    'the the the the bill bill',
+    'It extends the credit. The credit for research is extended to firms that are small.',
+    'Nothing in common here',
+    'tax',
+    '  The   bill\tamends  the code . ',
+]
+
+
+def _long_text(n_words, seed):
+    # Few distinct words, so that the longest common subsequences are long
+    rng = random.Random(seed)
+    words = 'the bill tax credit code research firms small amends extends of to'.split()
+    sentences = []
+    while n_words > 0:
+        length = min(n_words, rng.randint(40, 150))
+        sentences.append(' '.join(rng.choice(words) for _ in range(length)))
+        n_words -= length
+    return '. '.join(sentences) + '.'
+
+
+class TestScores(unittest.TestCase):
+
+    def assertSameScores(self, hyp, ref, metrics=None):
+        expected = Rouge(metrics=metrics).get_scores([hyp], [ref])[0]
+        self.assertEqual(batch_rouge.score(hyp, ref, metrics), expected)
+
+    def test_pairs(self):
+        for hyp in SENTENCES:
+            self.assertSameScores(hyp, SUMMARY)
+            self.assertSameScores(SUMMARY, hyp)
+
+    def test_repeated_tokens(self):
+        self.assertSameScores('a a a b b a.', 'a b a b a a a.')
+        self.assertSameScores('a a a a.', 'a.')
+        self.assertSameScores('x y x y x y. y x y x.', 'y y x x. x y.')
+
+    def test_longer_than_64_words(self):
+        # More than 64 words per sentence takes several machine words per row of the lcs
+        for seed, (n_hyp, n_ref) in enumerate([(65, 70), (200, 130), (300, 1000), (64, 129)]):
+            hyp = _long_text(n_hyp, seed)
+            ref = _long_text(n_ref, seed + 100)
+            self.assertSameScores(hyp, ref)
+            self.assertSameScores(ref, hyp)
+
+    def test_single_metrics(self):
+        for metric in batch_rouge.METRICS:
+            self.assertSameScores(SENTENCES[2], SUMMARY, [metric])
+            self.assertSameScores(_long_text(150, 7), _long_text(90, 8), [metric])
+
+    def test_empty(self):
+        for hyp, ref in [('', SUMMARY), (SUMMARY, ''), ('', ''), ('...', SUMMARY)]:
+            with self.assertRaises(ValueError):
+                Rouge().get_scores([hyp], [ref])
+            with self.assertRaises(ValueError):
+                batch_rouge.score(hyp, ref)
+
+    def test_blank_sentences(self):
+        # Whitespace between the dots still makes sentences, of one empty word
+        for hyp, ref in [(' . ', SUMMARY), (SUMMARY, ' . '), ('a . . b', 'a b. '), (' ', ' ')]:
+            self.assertSameScores(hyp, ref)
+
+
+class TestScoreSentences(unittest.TestCase):
+
+    def test_same_as_get_scores(self):
+        rouge = Rouge()
+        sents = SENTENCES + [_long_text(100, 1), _long_text(65, 2)]
+        for summary in [SUMMARY, _long_text(250, 3)]:
+            expected = [rouge.get_scores([sent], [summary])[0] for sent in sents]
+            self.assertEqual(batch_rouge.score_sentences(sents, summary), expected)
+
+            reference = batch_rouge.Reference(summary)
+            self.assertEqual(batch_rouge.score_sentences(sents, reference), expected)
+
+    def test_metrics_and_stats(self):
+        rouge = Rouge(metrics=['rouge-2', 'rouge-l'], stats=['p'])
+        expected = [rouge.get_scores([sent], [SUMMARY])[0] for sent in SENTENCES]
+        self.assertEqual(batch_rouge.score_sentences(SENTENCES, SUMMARY, ['rouge-2', 'rouge-l'], ['p']), expected)
+
+    def test_empty_sentence(self):
+        with self.assertRaises(ValueError):
+            batch_rouge.score_sentences(['a b.', ''], SUMMARY)
+        with self.assertRaises(ValueError):
+            batch_rouge.score_sentences(['a b.'], '')
+
+
+if __name__ == '__main__':
+    unittest.main()
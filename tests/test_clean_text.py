@@ -0,0 +1,47 @@
+'''
+The linear-time fallbacks of the CU cleaner must match the regexes they
+stand in for.
+
+    python -m pytest tests
+'''
+import random
+import time
+import unittest
+
+from billsum.data_prep.clean_text import CU_re, find_cu_title
+
+TITLES = [
+    'APS 5008 - Policy on Policies | Office of Policy',
+    'Header\nAPS 1 -Title (Draft) | CU | more\nPolicy Statement',
+    'APS 2 - A | no title here\tAPS 3 - B) | x',
+    'APS 12 - ab |',
+    'APS 4 - x | APS 5 - Real Title |',
+    'no title at all',
+]
+
+
+class TestFindCuTitle(unittest.TestCase):
+
+    def assertSameTitle(self, text):
+        match = CU_re['TITLE'].search(text)
+        self.assertEqual(find_cu_title(text), match.group(1) if match else None, repr(text))
+
+    def test_titles(self):
+        for text in TITLES:
+            self.assertSameTitle(text)
+
+    def test_random_texts(self):
+        rng = random.Random(0)
+        pieces = ['APS ', '1', '12', ' ', '-', ' |', '|', 'A', 'b', ')', '.', '\n', '\t', '\xa0', 'APS 3 - T']
+        for _ in range(20000):
+            self.assertSameTitle(''.join(rng.choice(pieces) for _ in range(rng.randint(0, 25))))
+
+    def test_linear_time(self):
+        # CU_re['TITLE'] takes seconds on this
+        start = time.perf_counter()
+        self.assertIsNone(find_cu_title('APS 1 - A ' * 40000))
+        self.assertLess(time.perf_counter() - start, 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
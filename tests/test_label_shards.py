@@ -0,0 +1,196 @@
+'''
+Shard planning, resuming, claims and merging of label_shards.py, with the
+labeling itself (label_sentences.prepare_split) stubbed out.
+
+    python -m pytest tests
+'''
+import json
+import os
+import pickle
+import sys
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+# label_sentences loads a spaCy model when imported. prepare_split is
+# stubbed, so spaCy is never used - import it with a placeholder.
+_spacy = types.ModuleType('spacy')
+_spacy.load = lambda *args, **kwargs: None
+_real_spacy = sys.modules.get('spacy')
+sys.modules['spacy'] = _spacy
+try:
+    from billsum.data_prep import label_shards
+finally:
+    if _real_spacy is None:
+        del sys.modules['spacy']
+    else:
+        sys.modules['spacy'] = _real_spacy
+from billsum.utils.sentence_store import SentenceStore
+from billsum.utils.sentence_utils import Word
+
+N_BILLS = 7
+SHARD_SIZE = 3
+
+
+def fake_prepare_split(bills, min_sent_words=5, batch_size=32, n_process=1, profile=None, metrics=None):
+    fake_prepare_split.calls += 1
+    sent_scores = {}
+    sum_sents = {}
+    for bill in bills:
+        words = [Word(w, i, w, '', 'O', 'NOUN', 'dep', i) for i, w in enumerate(bill['clean_text'].split())]
+        sent_scores[bill['bill_id']] = [(bill['clean_text'], words, {'rouge-2': {'p': 0.5}})]
+        sum_sents[bill['bill_id']] = [bill['clean_summary']]
+    return sent_scores, sum_sents
+
+
+class TestLabelShards(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.input = os.path.join(self.dir.name, 'bills.jsonl')
+        self.work_dir = os.path.join(self.dir.name, 'work')
+        self.bills = [{'bill_id': 'b{}'.format(k), 'clean_text': 'text of bill {}'.format(k),
+                       'clean_summary': 'summary {}'.format(k), 'clean_title': 'title {}'.format(k)}
+                      for k in range(N_BILLS)]
+        # Blank lines between and after the bills are not bills
+        with open(self.input, 'w') as f:
+            for k, bill in enumerate(self.bills):
+                f.write(json.dumps(bill) + '\n')
+                if k % 2 == 0:
+                    f.write('\n')
+            f.write('\n  \n')
+
+        fake_prepare_split.calls = 0
+        patcher = mock.patch.object(label_shards.label_sentences, 'prepare_split', fake_prepare_split)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def run_worker(self, **kwargs):
+        return label_shards.run_worker(self.input, self.work_dir, SHARD_SIZE, **kwargs)
+
+    def test_plan_shards(self):
+        offsets, n_bills = label_shards.plan_shards(self.input, SHARD_SIZE)
+        self.assertEqual(n_bills, N_BILLS)
+        self.assertEqual(len(offsets), 3)
+
+        manifest = {'input': self.input, 'offsets': offsets, 'shard_size': SHARD_SIZE}
+        read = [label_shards.read_shard(manifest, shard) for shard in range(len(offsets))]
+        self.assertEqual([len(bills) for bills in read], [3, 3, 1])
+        self.assertEqual(sum(read, []), self.bills)
+
+    def test_rerun_skips_done_shards(self):
+        self.assertEqual(self.run_worker(), 3)
+        self.assertEqual(fake_prepare_split.calls, 3)
+
+        self.assertEqual(self.run_worker(), 0)
+        self.assertEqual(fake_prepare_split.calls, 3)
+        self.assertEqual(label_shards.shard_status(self.work_dir), ([0, 1, 2], [], []))
+
+    def test_manifest_of_other_input(self):
+        self.run_worker()
+
+        # Same size, other content
+        other = os.path.join(self.dir.name, 'other.jsonl')
+        with open(self.input) as f, open(other, 'w') as out:
+            out.write(f.read().replace('text', 'TEXT'))
+        with self.assertRaises(ValueError):
+            label_shards.run_worker(other, self.work_dir, SHARD_SIZE)
+
+        # Same file, changed
+        os.utime(self.input, (0, 0))
+        with self.assertRaises(ValueError):
+            self.run_worker()
+
+    def _claim(self, shard, owner, stale=True):
+        os.makedirs(self.work_dir, exist_ok=True)
+        path = label_shards._shard_path(self.work_dir, shard, '.claim')
+        with open(path, 'w') as f:
+            f.write(owner)
+        if stale:
+            os.utime(path, (0, 0))
+        return path
+
+    def test_claims(self):
+        path = self._claim(1, 'other:1')
+        self.assertFalse(label_shards.claim_shard(self.work_dir, 1, None))
+
+        # A live claim is left alone, and not released by another worker
+        os.utime(path)
+        self.assertEqual(self.run_worker(reclaim_after=60), 2)
+        self.assertTrue(os.path.exists(path))
+        label_shards.release_shard(self.work_dir, 1)
+        self.assertTrue(os.path.exists(path))
+
+        # A stale one is taken over
+        os.utime(path, (0, 0))
+        self.assertEqual(self.run_worker(reclaim_after=60), 1)
+        self.assertEqual(label_shards.shard_status(self.work_dir), ([0, 1, 2], [], []))
+
+    def test_takeover_race(self):
+        path = self._claim(0, 'other:1')
+        getmtime = os.path.getmtime
+
+        def taken_over_first(p):
+            # Another worker takes over the stale claim while this one looks at it
+            mtime = getmtime(p)
+            os.remove(path)
+            with open(path, 'w') as f:
+                f.write('other:2')
+            return mtime
+
+        with mock.patch.object(label_shards.os.path, 'getmtime', taken_over_first):
+            self.assertFalse(label_shards.claim_shard(self.work_dir, 0, 60))
+        with open(path) as f:
+            self.assertEqual(f.read(), 'other:2')
+
+    def test_lost_claim_writes_nothing(self):
+        os.makedirs(self.work_dir)
+        manifest = label_shards.load_manifest(self.work_dir, self.input, SHARD_SIZE,
+                                              {'min_sent_words': 5, 'profile': None, 'metrics': None})
+        self.assertTrue(label_shards.claim_shard(self.work_dir, 0))
+
+        def taken_over(*args, **kwargs):
+            with open(label_shards._shard_path(self.work_dir, 0, '.claim'), 'w') as f:
+                f.write('other:1')
+            return fake_prepare_split(*args, **kwargs)
+
+        with mock.patch.object(label_shards.label_sentences, 'prepare_split', taken_over):
+            with self.assertRaises(label_shards.ClaimLost):
+                label_shards.label_shard(self.work_dir, manifest, 0)
+        for suffix in ['.store', '_sum_sents.pkl', '.done']:
+            self.assertFalse(os.path.exists(label_shards._shard_path(self.work_dir, 0, suffix)))
+
+    def test_merge(self):
+        # Shards finished in the order 2, 0, 1
+        claims = [self._claim(shard, 'other:1', stale=False) for shard in [0, 1]]
+        self.assertEqual(self.run_worker(), 1)
+        for path in claims:
+            os.remove(path)
+            self.assertEqual(self.run_worker(), 1)
+
+        store_path = os.path.join(self.dir.name, 'all.store')
+        sum_sents_path = os.path.join(self.dir.name, 'sum_sents.pkl')
+        self.assertEqual(label_shards.merge_shards(self.work_dir, store_path, sum_sents_path), N_BILLS)
+
+        store = SentenceStore(store_path)
+        self.assertEqual(list(store), [bill['bill_id'] for bill in self.bills])
+        for bill in self.bills:
+            self.assertEqual(store.sentence_texts(bill['bill_id']), [bill['clean_text']])
+            self.assertEqual(store.doc_field(bill['bill_id'], 'clean_title'), bill['clean_title'])
+        with open(sum_sents_path, 'rb') as f:
+            self.assertEqual(pickle.load(f), {bill['bill_id']: [bill['clean_summary']] for bill in self.bills})
+
+    def test_merge_needs_every_shard(self):
+        self._claim(1, 'other:1', stale=False)
+        self.run_worker()
+        with self.assertRaises(ValueError):
+            label_shards.merge_shards(self.work_dir, os.path.join(self.dir.name, 'all.store'),
+                                      os.path.join(self.dir.name, 'sum_sents.pkl'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+'''
+extract_data_xml_stream must read data.xml and billStatus files like
+extract_data_xml, and reject the same malformed ones.
+
+    python -m pytest tests
+'''
+import io
+import unittest
+import xml.etree.ElementTree as ET
+
+from billsum.data_collect.prepare_dataset import extract_data_xml, extract_data_xml_stream
+
+DATA_XML = b'''<bill>
+  <titles>
+    <title type="short">Old title</title>
+    <title type="official">An Act to do things.</title>
+  </titles>
+  <actions><action>Introduced</action></actions>
+  <summary>A summary of the bill.</summary>
+</bill>'''
+
+BILL_STATUS = b'''<billStatus>
+  <bill>
+    <titles>
+      <item><titleType>Short</titleType><title>First title</title></item>
+      <item><titleType>Official</titleType><title>Latest title</title></item>
+    </titles>
+    <summaries>
+      <billSummaries>
+        <item><text>&lt;p&gt;Introduced summary.&lt;/p&gt;</text></item>
+        <item><text>&lt;p&gt;Passed summary.&lt;/p&gt;</text></item>
+      </billSummaries>
+    </summaries>
+  </bill>
+</billStatus>'''
+
+NO_TITLES = [
+    b'<bill>\n  <summary>A summary.</summary>\n</bill>',
+    b'<billStatus><bill><summaries><billSummaries><item><text>S</text></item>'
+    b'</billSummaries></summaries></bill></billStatus>',
+]
+
+
+class TestExtractDataXmlStream(unittest.TestCase):
+
+    def test_same_as_extract_data_xml(self):
+        for data in [DATA_XML, BILL_STATUS]:
+            expected = extract_data_xml(ET.fromstring(data))
+            self.assertEqual(extract_data_xml_stream(io.BytesIO(data)), expected)
+
+    def test_no_titles(self):
+        for data in NO_TITLES:
+            with self.assertRaises(Exception):
+                extract_data_xml(ET.fromstring(data))
+            with self.assertRaisesRegex(ValueError, 'No title'):
+                extract_data_xml_stream(io.BytesIO(data))
+
+
+if __name__ == '__main__':
+    unittest.main()
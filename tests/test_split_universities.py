@@ -0,0 +1,71 @@
+'''
+read_policies must stream json arrays into the same records as json.load,
+whatever the read size.
+
+    python -m pytest tests
+'''
+import json
+import os
+import tempfile
+import unittest
+
+from billsum.data_prep import split_universities
+
+ARRAYS = [
+    '[]',
+    ' \n[ ]',
+    '[1, 2.5e3 ,-7, true, null, "x"]',
+    '[{"university": "cu", "text": "a]b,c \\"d\\""}, {"university": "psu", "text": "\\u00e9", "n": [1, {}]}]',
+    '[' + ','.join(json.dumps({'university': 'cmu', 'text': 'w' * n}) for n in range(0, 400, 37)) + ']',
+]
+
+MALFORMED = ['[1,]', '[1 2]', '[1,', '[{"a":', '[2.5x]']
+
+
+class TestReadPolicies(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.read_size = split_universities.READ_SIZE
+
+    def tearDown(self):
+        split_universities.READ_SIZE = self.read_size
+        self.dir.cleanup()
+
+    def _write(self, content):
+        path = os.path.join(self.dir.name, 'policies.json')
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_arrays(self):
+        for read_size in [1, 2, 3, 7, 64, 1 << 16]:
+            split_universities.READ_SIZE = read_size
+            for content in ARRAYS:
+                path = self._write(content)
+                self.assertEqual(list(split_universities.read_policies(path)), json.loads(content))
+
+    def test_malformed_arrays(self):
+        split_universities.READ_SIZE = 2
+        for content in MALFORMED:
+            path = self._write(content)
+            with self.assertRaises(ValueError):
+                list(split_universities.read_policies(path))
+
+    def test_jsonl(self):
+        records = [{'university': 'cu', 'text': 'a'}, {'university': 'psu', 'text': 'b'}]
+        path = self._write('\n'.join(json.dumps(r) for r in records) + '\n\n')
+        self.assertEqual(list(split_universities.read_policies(path)), records)
+
+    def test_round_trip(self):
+        records = json.loads(ARRAYS[3]) + json.loads(ARRAYS[4])
+        counts = split_universities.split_by_university(records, self.dir.name)
+        self.assertEqual(counts['cmu'], len(json.loads(ARRAYS[4])))
+        for uni in split_universities.UNIVERSITIES:
+            path = os.path.join(self.dir.name, uni + '.json')
+            self.assertEqual(list(split_universities.read_policies(path)),
+                             [r for r in records if r['university'] == uni])
+
+
+if __name__ == '__main__':
+    unittest.main()